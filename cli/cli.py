@@ -8,7 +8,8 @@ from cli.operations import (
     onboard_folder,
     onboard_container,
     LOWER_LIMIT,
-    UPPER_LIMIT
+    UPPER_LIMIT,
+    DOWNLOAD_STRATEGIES
 )
 
 if __name__ == "__main__":
@@ -27,6 +28,8 @@ if __name__ == "__main__":
     parser.add_argument('-c', '--storage-container')
     parser.add_argument('-k', '--storage-key')
     parser.add_argument('-n', '--num-images', type=int)
+    parser.add_argument('-s', '--strategy', choices=DOWNLOAD_STRATEGIES,
+                        help='Rank downloaded images by the confidence of the latest training run')
 
     args = parser.parse_args()
     operation = args.operation
@@ -35,7 +38,7 @@ if __name__ == "__main__":
     config = Config.read_config(config_path)
 
     if operation == 'download':
-        download(config, args.num_images)
+        download(config, args.num_images, args.strategy)
     elif operation == 'upload':
         upload(config)
     else:
@@ -3,15 +3,18 @@ import time
 import shutil
 import json
 import copy
+import itertools
 import pathlib
 import os
 from azure.storage.blob import BlockBlobService, ContentSettings
 from utils.blob_utils import BlobStorage
-from utils.vott_parser import process_vott_json, create_starting_vott_json, build_id_to_VottImageTag
+from utils.vott_parser import process_vott_json, create_starting_vott_json, build_id_to_VottImageTag, VottImageTag
 
 DEFAULT_NUM_IMAGES = 40
 LOWER_LIMIT = 0
 UPPER_LIMIT = 100
+# Checkout strategies understood by the download function
+DOWNLOAD_STRATEGIES = ['any', 'lowest', 'highest']
 
 azure_storage_client = None
 
@@ -93,7 +96,9 @@ def onboard_container(config, account, key, container):
     resp = requests.post(function_url, params=query, json=data)
     resp.raise_for_status()
 
-    print("Set up container for onboarding. Onboarding may take some time.")
+    json_resp = resp.json()
+    print("Set up container for onboarding as job {0}. Onboarding may take some time.".format(json_resp["jobId"]))
+    print("Progress: " + json_resp["progressUrl"])
 
 
 def _download_bounds(num_images):
@@ -115,14 +120,19 @@ def download(config, num_images, strategy=None):
     images_to_download = _download_bounds(num_images)
     query = {
         "imageCount": images_to_download,
-        "userName": user_name
+        "userName": user_name,
+        "format": "columnar"
     }
+    if strategy:
+        query["strategy"] = strategy
 
     response = requests.get(functions_url, params=query)
     response.raise_for_status()
 
     json_resp = response.json()
-    count = len(json_resp['images'])
+    # Functions deployed before the columnar format ignore the parameter and send rows
+    columnar = json_resp.get("format") == "columnar"
+    count = len(json_resp['images']['id']) if columnar else len(set(row[0] for row in json_resp['images']))
 
     print("Received " + str(count) + " files.")
     
@@ -144,7 +154,11 @@ def download(config, num_images, strategy=None):
         parents=True,
         exist_ok=True
     )
-    vott_json, image_urls = _build_vott_json_from_raw_data(json_resp["images"], json_resp["classification_list"])
+    if columnar:
+        vott_json, image_urls = _build_vott_json_from_columnar_data(json_resp["images"], json_resp["boxes"],
+                                                                    json_resp["classes"], json_resp["classification_list"])
+    else:
+        vott_json, image_urls = _build_vott_json_from_raw_data(json_resp["images"], json_resp["classification_list"])
 
     json_data = {'vott_json': vott_json,
                  'imageUrls': image_urls}
@@ -230,9 +244,26 @@ def _build_vott_json_from_raw_data(rawdata, classification_list):
 
         if image_id not in image_id_to_image_tag:
             image_id_to_image_tag[image_id] = []
-        image_id_to_image_tag[image_id].append(build_id_to_VottImageTag(row))
+        image_id_to_image_tag[image_id].extend(build_id_to_VottImageTag(row).values())
 
     vott_json = create_starting_vott_json(image_id_to_image_url, image_id_to_image_tag, classification_list)
 
     return vott_json, list(image_id_to_image_url.values())
 
+
+def _build_vott_json_from_columnar_data(images, boxes, classes, classification_list):
+    image_id_to_image_url = dict(zip(images["id"], images["location"]))
+    image_id_to_image_tag = {}
+    # Boxes are listed image by image, box_count of them for each
+    box_rows = zip(boxes["class_id"], boxes["x_min"], boxes["x_max"], boxes["y_min"], boxes["y_max"])
+    for image_id, location, height, width, box_count in zip(images["id"], images["location"], images["height"],
+                                                           images["width"], images["box_count"]):
+        # JSON object keys are strings, so class ids are looked up as strings
+        image_id_to_image_tag[image_id] = [
+            VottImageTag(image_id, x_min, x_max, y_min, y_max, [classes[str(class_id)].strip()], height, width, location)
+            for class_id, x_min, x_max, y_min, y_max in itertools.islice(box_rows, box_count)
+        ]
+
+    vott_json = create_starting_vott_json(image_id_to_image_url, image_id_to_image_tag, classification_list)
+
+    return vott_json, list(image_id_to_image_url.values())
@@ -22,6 +22,8 @@ from utils.config import (
 )
 from .operations import (
     _download_bounds,
+    _build_vott_json_from_raw_data,
+    _build_vott_json_from_columnar_data,
     upload,
     ImageLimitException,
     DEFAULT_NUM_IMAGES,
@@ -48,6 +50,42 @@ class TestCLIOperations(unittest.TestCase):
         downloaded_image_count = _download_bounds(10)
         self.assertEqual(10, downloaded_image_count)
 
+    def test_columnar_and_raw_data_build_the_same_vott_json(self):
+        rows = [
+            [1, "https://host/perm/1.jpg", 2, "cat", 10, 20, 30, 40, 600, 400, 0.9, 0.8, "tag_inprogress"],
+            [1, "https://host/perm/1.jpg", 3, "dog", 15, 25, 35, 45, 600, 400, 0.85, 0.8, "tag_inprogress"],
+            [2, "https://host/perm/2.jpg", None, None, None, None, None, None, 300, 200, None, None, "tag_inprogress"]
+        ]
+        images = {"id": [1, 2], "location": ["https://host/perm/1.jpg", "https://host/perm/2.jpg"],
+                  "height": [600, 300], "width": [400, 200], "image_confidence": [0.8, None], "box_count": [2, 0]}
+        boxes = {"class_id": [2, 3], "x_min": [10, 15], "x_max": [20, 25], "y_min": [30, 35], "y_max": [40, 45],
+                 "confidence": [0.9, 0.85]}
+        classification_list = ["cat", "dog"]
+        raw_vott_json, raw_urls = _build_vott_json_from_raw_data(rows, classification_list)
+        vott_json, urls = _build_vott_json_from_columnar_data(images, boxes, {"2": "cat", "3": "dog"},
+                                                              classification_list)
+        self.assertEqual(raw_vott_json, vott_json)
+        self.assertEqual(raw_urls, urls)
+        self.assertEqual(["cat"], vott_json["frames"]["1.jpg"][0]["tags"])
+        self.assertEqual([], vott_json["frames"]["2.jpg"])
+
+    def test_columnar_and_raw_data_keep_boxes_on_the_image_edge(self):
+        rows = [
+            [1, "https://host/perm/1.jpg", 2, "cat", 0, 20, 0, 40, 600, 400, 0.9, 0.8, "tag_inprogress"],
+            [2, "https://host/perm/2.jpg", 3, "dog", 15, 25, 35, 0, 300, 200, 0.85, 0.7, "tag_inprogress"]
+        ]
+        images = {"id": [1, 2], "location": ["https://host/perm/1.jpg", "https://host/perm/2.jpg"],
+                  "height": [600, 300], "width": [400, 200], "image_confidence": [0.8, 0.7], "box_count": [1, 1]}
+        boxes = {"class_id": [2, 3], "x_min": [0, 15], "x_max": [20, 25], "y_min": [0, 35], "y_max": [40, 0],
+                 "confidence": [0.9, 0.85]}
+        classification_list = ["cat", "dog"]
+        raw_vott_json, _ = _build_vott_json_from_raw_data(rows, classification_list)
+        vott_json, _ = _build_vott_json_from_columnar_data(images, boxes, {"2": "cat", "3": "dog"},
+                                                           classification_list)
+        self.assertEqual(raw_vott_json, vott_json)
+        self.assertEqual(["cat"], vott_json["frames"]["1.jpg"][0]["tags"])
+        self.assertEqual(["dog"], vott_json["frames"]["2.jpg"][0]["tags"])
+
 
 class TestConfig(unittest.TestCase):
 
@@ -0,0 +1,49 @@
+import argparse
+import getpass
+from benchmark_utils import (
+    env_is_configured,
+    get_data_access,
+    timed,
+    RoundTripCounter,
+    print_results
+)
+from functions.pipeline.shared.db_access import ImageTagDataAccess
+from functions.pipeline.shared.db_access.db_access_v2 import (
+    ADD_IMAGES_CHUNK_SIZE,
+    generate_test_image_infos
+)
+
+#################################################################
+# Compares add_new_images sending one INSERT per image, the way
+# it used to, against the batched unnest path. Reports the round
+# trips to the database per 1k images along with throughput.
+#################################################################
+
+def main(num_of_images):
+    if not env_is_configured():
+        return
+
+    data_access = get_data_access()
+    user_id = data_access.create_user(getpass.getuser())
+
+    results = []
+    round_trips = []
+    for label, chunk_size in (("One INSERT per image", 1), ("unnest chunks of {0}".format(ADD_IMAGES_CHUNK_SIZE), ADD_IMAGES_CHUNK_SIZE)):
+        counter = RoundTripCounter(data_access._db_provider)
+        image_infos = generate_test_image_infos(num_of_images)
+        _, seconds = timed(ImageTagDataAccess(counter).add_new_images, image_infos, user_id, chunk_size=chunk_size)
+        results.append((label, num_of_images, seconds))
+        round_trips.append((label, counter.round_trips))
+    print_results("add_new_images", results)
+
+    print()
+    print("{0:<30}{1:>12}{2:>18}".format("Mode", "Round trips", "Per 1k images"))
+    for label, count in round_trips:
+        print("{0:<30}{1:>12}{2:>18.1f}".format(label, count, count * 1000 / num_of_images))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-images', type=int, default=10000,
+                        help='Images onboarded per mode')
+    args = parser.parse_args()
+    main(args.num_images)
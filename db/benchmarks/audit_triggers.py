@@ -0,0 +1,103 @@
+import os
+import argparse
+import getpass
+from benchmark_utils import (
+    env_is_configured,
+    get_data_access,
+    timed,
+    onboard_test_images,
+    print_results
+)
+from functions.pipeline.shared.db_access import ImageTagDataAccess, ImageTagState
+from functions.pipeline.shared.db_access.db_access_v2 import generate_test_image_infos
+
+#################################################################
+# Times bulk state transitions and image inserts with the row
+# level audit triggers against the statement level ones. Triggers
+# are swapped inside a transaction that is rolled back at the end
+# of each mode, so the database keeps whatever it had installed.
+#################################################################
+
+DB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRIGGER_TABLES = {"image_info_insert": "Image_Info",
+                  "image_tagging_state_insert": "Image_Tagging_State",
+                  "image_tagging_state_changes": "Image_Tagging_State"}
+
+def read_sql_files(sub_dir_name):
+    sub_dir = os.path.join(DB_DIR, sub_dir_name)
+    queries = []
+    for file_name in sorted(os.listdir(sub_dir)):
+        with open(os.path.join(sub_dir, file_name)) as sql_file:
+            queries.append(sql_file.read())
+    return queries
+
+def row_trigger_queries():
+    drops = ["DROP TRIGGER IF EXISTS {0} ON {1}".format(name, table) for name, table in TRIGGER_TABLES.items()]
+    return drops + read_sql_files("triggers")
+
+# Hands the same connection to every call and keeps their commits inside our transaction
+class SingleTransactionProvider:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def get_connection(self):
+        return self
+
+    def cursor(self):
+        return self._connection.cursor()
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+def count_audit_rows(cursor, image_ids, tag_state):
+    cursor.execute("SELECT count(*) FROM Image_Tagging_State_Audit WHERE ImageId = ANY(%s) AND TagStateId = %s",
+                   (image_ids, int(tag_state)))
+    return cursor.fetchone()[0]
+
+def main(num_of_images):
+    if not env_is_configured():
+        return
+
+    data_access = get_data_access()
+    user_id = data_access.create_user(getpass.getuser())
+    print("Onboarding {0} test images...".format(num_of_images))
+    image_ids = onboard_test_images(data_access, generate_test_image_infos(num_of_images), user_id)
+
+    update_results = []
+    insert_results = []
+    for label, queries in (("FOR EACH ROW", row_trigger_queries()),
+                           ("FOR EACH STATEMENT", read_sql_files("statement_triggers"))):
+        conn = data_access._db_provider.get_connection()
+        try:
+            cursor = conn.cursor()
+            for query in queries:
+                cursor.execute(query)
+            single_transaction = ImageTagDataAccess(SingleTransactionProvider(conn))
+
+            _, seconds = timed(single_transaction._update_images, image_ids, ImageTagState.TAG_IN_PROGRESS, user_id, None)
+            audited = count_audit_rows(cursor, image_ids, ImageTagState.TAG_IN_PROGRESS)
+            if audited != len(image_ids):
+                print("{0}: expected {1} audit rows but found {2}".format(label, len(image_ids), audited))
+            update_results.append((label, len(image_ids), seconds))
+
+            url_to_image_id_map, seconds = timed(single_transaction.add_new_images,
+                                                 generate_test_image_infos(num_of_images), user_id)
+            audited = count_audit_rows(cursor, list(url_to_image_id_map.values()), ImageTagState.NOT_READY)
+            if audited != num_of_images:
+                print("{0}: expected {1} audit rows but found {2}".format(label, num_of_images, audited))
+            insert_results.append((label, num_of_images, seconds))
+        finally:
+            conn.rollback()
+            conn.close()
+    print_results("_update_images to TAG_IN_PROGRESS", update_results)
+    print_results("add_new_images", insert_results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-images', type=int, default=10000,
+                        help='Images moved to a new state in one statement')
+    args = parser.parse_args()
+    main(args.num_images)
@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import multiprocessing
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from functions.pipeline.shared.db_provider import PostGresProvider, get_postgres_provider, get_database_info_from_env
+from functions.pipeline.shared.db_access import ImageTagDataAccess, ImageTagState
+
+def env_is_configured():
+    if(os.getenv("DB_HOST") is None or os.getenv("DB_USER") is None or os.getenv("DB_NAME") is None or os.getenv("DB_PASS") is None):
+        print("Please set environment variables for DB_HOST, DB_USER, DB_NAME, DB_PASS")
+        return False
+    return True
+
+def get_data_access(instrumentation=None):
+    return ImageTagDataAccess(get_postgres_provider(), instrumentation=instrumentation)
+
+# Connection that does not come from, or go back to, the pool. For statements that need the
+# connection in a state pooled connections are not handed out in, like autocommit.
+def get_unpooled_connection():
+    return PostGresProvider(get_database_info_from_env()).get_connection()
+
+# Pool of worker processes that each build their own connection pool. Workers are spawned rather
+# than forked, a forked worker would inherit the sockets the parent's pooled provider already
+# opened and share them with the parent and every other worker. Returns once every worker has
+# started, so the time spawned workers spend importing is not counted in the results.
+def worker_pool(processes):
+    get_postgres_provider().close_all()
+    pool = multiprocessing.get_context("spawn").Pool(processes=processes)
+    pool.map(_worker_started, range(processes), chunksize=1)
+    return pool
+
+def _worker_started(_):
+    return os.getpid()
+
+# Wraps a DB provider and counts the statements and commits sent to the server,
+# each of which costs one round trip. Also records each distinct statement text since
+# the driver parses and plans every new text once per connection.
+class RoundTripCounter:
+    def __init__(self, db_provider):
+        self._db_provider = db_provider
+        self.round_trips = 0
+        self.statements = set()
+
+    def get_connection(self):
+        return _CountingConnection(self._db_provider.get_connection(), self)
+
+class _CountingConnection:
+    def __init__(self, connection, counter):
+        self._connection = connection
+        self._counter = counter
+
+    def cursor(self):
+        return _CountingCursor(self._connection.cursor(), self._counter)
+
+    def commit(self):
+        self._counter.round_trips += 1
+        self._connection.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+class _CountingCursor:
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter.round_trips += 1
+        self._counter.statements.add(args[0] if args else kwargs.get('operation'))
+        return self._cursor.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+# Nearest rank percentile of an unsorted list, pct between 0 and 100
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def onboard_test_images(data_access, list_of_image_infos, user_id):
+    url_to_image_id_map = data_access.add_new_images(list_of_image_infos, user_id)
+    image_ids = list(url_to_image_id_map.values())
+    data_access._update_images(image_ids, ImageTagState.READY_TO_TAG, user_id, None)
+    return image_ids
+
+def create_training_run(data_access, user_id, description):
+    conn = data_access._db_provider.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO Training_Info (TrainingDescription,ModelLocation,CreatedByUser) "
+                       "VALUES (%s,%s,%s) RETURNING TrainingId", (description, "benchmark", user_id))
+        training_id = cursor.fetchone()[0]
+        conn.commit()
+        cursor.close()
+    finally: conn.close()
+    return training_id
+
+def print_results(title, results):
+    # results is a list of (label, rows, seconds)
+    print()
+    print(title)
+    print("{0:<30}{1:>12}{2:>12}{3:>14}".format("Mode", "Rows", "Seconds", "Rows/sec"))
+    for label, rows, seconds in results:
+        print("{0:<30}{1:>12}{2:>12.3f}{3:>14.0f}".format(label, rows, seconds, rows / seconds if seconds else 0))
@@ -0,0 +1,58 @@
+import argparse
+import getpass
+from benchmark_utils import (
+    env_is_configured,
+    get_data_access,
+    timed,
+    onboard_test_images,
+    create_training_run,
+    print_results
+)
+from functions.pipeline.shared.db_access.db_access_v2 import (
+    TestClassifications,
+    generate_test_image_infos,
+    generate_test_image_tags,
+    generate_test_prediction_labels
+)
+
+#################################################################
+# Compares rows per second of the multi-row INSERT string path
+# against the COPY FROM STDIN path for prediction and annotated
+# labels. Each mode writes to its own training run / images so
+# the two never collide on primary keys.
+#################################################################
+
+def main(num_of_images):
+    if not env_is_configured():
+        return
+
+    data_access = get_data_access()
+    user_id = data_access.create_user(getpass.getuser())
+    print("Onboarding {0} test images...".format(num_of_images * 2))
+    image_ids = onboard_test_images(data_access, generate_test_image_infos(num_of_images * 2), user_id)
+    class_map = data_access.get_classification_map(set(TestClassifications), user_id)
+
+    prediction_results = []
+    for label, bulk_load in (("INSERT ... VALUES", False), ("COPY FROM STDIN", True)):
+        training_id = create_training_run(data_access, user_id, "bulk ingest benchmark: " + label)
+        prediction_labels = generate_test_prediction_labels(training_id, image_ids, class_map)
+        _, seconds = timed(data_access.add_prediction_labels, prediction_labels, training_id, bulk_load=bulk_load)
+        prediction_results.append((label, len(prediction_labels), seconds))
+    print_results("add_prediction_labels", prediction_results)
+
+    annotated_results = []
+    image_id_halves = (image_ids[:num_of_images], image_ids[num_of_images:])
+    for (label, bulk_load), ids in zip((("INSERT ... VALUES", False), ("COPY FROM STDIN", True)), image_id_halves):
+        # One class per tag keeps us clear of the Annotated_Labels primary key
+        image_tags = generate_test_image_tags(ids, 4, 1)
+        annotated_labels = data_access.convert_to_annotated_label(image_tags, class_map)
+        _, seconds = timed(data_access.update_tagged_images_v2, annotated_labels, user_id, bulk_load=bulk_load)
+        annotated_results.append((label, len(annotated_labels), seconds))
+    print_results("update_tagged_images_v2", annotated_results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-images', type=int, default=10000,
+                        help='Images per mode. Predictions average two boxes per image')
+    args = parser.parse_args()
+    main(args.num_images)
@@ -0,0 +1,84 @@
+import gzip
+import json
+import argparse
+import getpass
+import statistics
+from benchmark_utils import (
+    env_is_configured,
+    get_data_access,
+    timed,
+    onboard_test_images,
+    create_training_run
+)
+from cli.operations import _build_vott_json_from_raw_data, _build_vott_json_from_columnar_data
+from functions.pipeline.shared.db_access import ImageTagState, CheckoutStrategy, to_columnar_checkout
+from functions.pipeline.shared.db_access.db_access_v2 import (
+    TestClassifications,
+    generate_test_image_infos,
+    generate_test_prediction_labels
+)
+
+#################################################################
+# Compares the two download response formats on real checkouts.
+# rows sends one 13 column row per prediction box with the image
+# columns repeated on every row, columnar sends each image once
+# and the boxes of all images as parallel arrays. Reports the
+# payload size, raw and gzipped, and how long the CLI takes to
+# parse it and build the VoTT json from it.
+#################################################################
+
+def encode(checked_out_images, classification_list, response_format):
+    if response_format == "columnar":
+        body = to_columnar_checkout(checked_out_images)
+        body["format"] = response_format
+    else:
+        body = {"images": checked_out_images}
+    body["classification_list"] = classification_list
+    # Same as the download function, Decimal is the only type json can't encode
+    return json.dumps(body, default=float).encode("utf-8")
+
+def parse(content, response_format):
+    json_resp = json.loads(content)
+    if response_format == "columnar":
+        return _build_vott_json_from_columnar_data(json_resp["images"], json_resp["boxes"], json_resp["classes"],
+                                                   json_resp["classification_list"])
+    return _build_vott_json_from_raw_data(json_resp["images"], json_resp["classification_list"])
+
+def median_ms(repeats, func, *args):
+    return statistics.median(timed(func, *args)[1] for _ in range(repeats)) * 1000
+
+def main(num_of_images, batch_sizes, repeats):
+    if not env_is_configured():
+        return
+
+    data_access = get_data_access()
+    user_id = data_access.create_user(getpass.getuser())
+    print("Onboarding {0} test images with predictions...".format(num_of_images))
+    image_ids = onboard_test_images(data_access, generate_test_image_infos(num_of_images), user_id)
+    class_map = data_access.get_classification_map(set(TestClassifications), user_id)
+    training_id = create_training_run(data_access, user_id, "checkout payload benchmark")
+    data_access.add_prediction_labels(generate_test_prediction_labels(training_id, image_ids, class_map), training_id)
+    classification_list = data_access.get_existing_classifications()
+
+    print()
+    print("{0:<12}{1:>8}{2:>8}{3:>12}{4:>12}{5:>12}{6:>12}".format("Format", "Images", "Boxes", "Bytes",
+                                                                   "Gzip bytes", "Loads ms", "VoTT ms"))
+    for batch_size in batch_sizes:
+        # Ranked checkout only hands out images with predictions from the run above
+        checked_out = data_access.checkout_images(batch_size, user_id, CheckoutStrategy.HIGHEST_CONFIDENCE)
+        data_access._update_images(list(set(row[0] for row in checked_out)), ImageTagState.READY_TO_TAG, user_id, None)
+        images = len(set(row[0] for row in checked_out))
+        for response_format in ("rows", "columnar"):
+            content = encode(checked_out, classification_list, response_format)
+            print("{0:<12}{1:>8}{2:>8}{3:>12}{4:>12}{5:>12.3f}{6:>12.3f}".format(
+                response_format, images, len(checked_out), len(content), len(gzip.compress(content)),
+                median_ms(repeats, json.loads, content), median_ms(repeats, parse, content, response_format)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-images', type=int, default=5000)
+    parser.add_argument('-b', '--batch-sizes', type=int, nargs='+', default=[40, 100, 1000],
+                        help='Images per checkout')
+    parser.add_argument('-r', '--repeats', type=int, default=50, help='Parses to take the median of')
+    args = parser.parse_args()
+    main(args.num_images, args.batch_sizes, args.repeats)
@@ -0,0 +1,72 @@
+import sys
+import time
+import argparse
+import getpass
+from benchmark_utils import (
+    env_is_configured,
+    get_data_access,
+    onboard_test_images,
+    print_results,
+    worker_pool
+)
+from functions.pipeline.shared.db_access import ImageTagState
+from functions.pipeline.shared.db_access.db_access_v2 import generate_test_image_infos
+
+#################################################################
+# Load test for checkout_images. N simulated taggers check out
+# batches concurrently until the READY_TO_TAG pool is drained.
+# Fails loudly if any image is handed to more than one tagger and
+# reports images checked out per second for each level of
+# concurrency.
+#################################################################
+
+def tagger(args):
+    # Each simulated tagger runs in its own process with its own connection pool, so the
+    # driver's Python overhead does not serialize the taggers on the GIL.
+    user_id, batch_size = args
+    data_access = get_data_access()
+    checked_out = []
+    while True:
+        rows = data_access.checkout_images(batch_size, user_id)
+        if not rows:
+            return checked_out
+        checked_out.extend(set(row[0] for row in rows))
+
+def run_taggers(user_ids, batch_size):
+    with worker_pool(len(user_ids)) as pool:
+        start = time.perf_counter()
+        checked_out = pool.map(tagger, [(user_id, batch_size) for user_id in user_ids])
+        return checked_out, time.perf_counter() - start
+
+def main(num_of_images, batch_size, tagger_counts):
+    if not env_is_configured():
+        return
+
+    data_access = get_data_access()
+    user_id = data_access.create_user(getpass.getuser())
+    print("Onboarding {0} test images...".format(num_of_images))
+    image_ids = onboard_test_images(data_access, generate_test_image_infos(num_of_images), user_id)
+
+    results = []
+    for tagger_count in tagger_counts:
+        user_ids = [data_access.create_user("{0}-tagger-{1}".format(getpass.getuser(), i)) for i in range(tagger_count)]
+        # Anything left over from a previous run makes the counts below meaningless
+        data_access._update_images(image_ids, ImageTagState.READY_TO_TAG, user_id, None)
+
+        checked_out, seconds = run_taggers(user_ids, batch_size)
+        all_checked_out = [image_id for ids in checked_out for image_id in ids]
+        duplicates = len(all_checked_out) - len(set(all_checked_out))
+        if duplicates:
+            print("ERROR: {0} images were checked out by more than one tagger".format(duplicates))
+            sys.exit(1)
+        results.append(("{0} tagger(s)".format(tagger_count), len(all_checked_out), seconds))
+
+    print_results("checkout_images, batches of {0} (no duplicates)".format(batch_size), results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-images', type=int, default=5000)
+    parser.add_argument('-b', '--batch-size', type=int, default=40)
+    parser.add_argument('-t', '--taggers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    main(args.num_images, args.batch_size, args.taggers)
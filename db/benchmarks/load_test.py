@@ -0,0 +1,292 @@
+import sys
+import json
+import time
+import random
+import argparse
+import getpass
+from benchmark_utils import (
+    env_is_configured,
+    get_data_access,
+    get_unpooled_connection,
+    create_training_run,
+    percentile,
+    worker_pool
+)
+from local_postgres import temp_cluster
+from functions.pipeline.shared.db_access import ImageTagState, Instrumentation
+from functions.pipeline.shared.db_access.db_access_v2 import (
+    TestClassifications,
+    generate_test_image_infos,
+    generate_test_image_tags,
+    generate_test_prediction_labels
+)
+
+#################################################################
+# Load test for the data access layer. Seeds a database with
+# millions of images, labels and predictions, then replays a mix
+# of onboard, download, upload, labels and images traffic from N
+# concurrent workers and reports p50/p99 latency and throughput
+# for every ImageTagDataAccess method the traffic calls.
+#
+# Results can be saved and compared against a saved baseline so
+# a schema or query change that slows a method down fails the
+# run before it is deployed.
+#################################################################
+
+SEED_BATCH_SIZE = 10000
+# p99 changes smaller than this are noise, mostly calls answered from a cache
+MIN_REGRESSION_MS = 1.0
+DEFAULT_MIX = "download=10,upload=8,images=2,labels=2,onboard=1"
+
+# Collects one latency per data access call in the worker that made it
+class LatencyExporter:
+    records_bytes = False
+
+    def __init__(self):
+        self.records = []
+
+    def export(self, method_name, duration_ms, rows, bytes_returned, success):
+        self.records.append((method_name, duration_ms, success))
+
+    def track_metric(self, name, value):
+        pass
+
+def count_images(data_access):
+    conn = data_access._db_provider.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT count(*) FROM Image_Info")
+        return cursor.fetchone()[0]
+    finally: conn.close()
+
+# Commits the refresh before the ANALYZE starts. Runs on a connection of its own so switching it
+# to autocommit never reaches the pool the workers' connections come from.
+def analyze():
+    conn = get_unpooled_connection()
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY Latest_Predictions")
+        cursor.execute("ANALYZE")
+    finally: conn.close()
+
+# Images go through the same calls the functions make: onboarded, moved to permanent storage,
+# most of them tagged and all of them predicted by one training run. Runs in batches so memory
+# stays flat, and only tops up what is missing so a seeded database is reused.
+def seed(data_access, num_of_images, tagged_fraction):
+    existing = count_images(data_access)
+    if existing >= num_of_images:
+        print("Database already holds {0} images".format(existing))
+        return
+    user_id = data_access.create_user(getpass.getuser())
+    class_map = data_access.get_classification_map(set(TestClassifications), user_id)
+    training_id = create_training_run(data_access, user_id, "load test seed")
+    start = time.perf_counter()
+    for seeded in range(existing, num_of_images, SEED_BATCH_SIZE):
+        batch_size = min(SEED_BATCH_SIZE, num_of_images - seeded)
+        url_to_image_id_map = data_access.add_new_images(generate_test_image_infos(batch_size), user_id)
+        image_ids = list(url_to_image_id_map.values())
+        data_access.update_image_urls({image_id: url.replace("new-uploads", "perm-uploads")
+                                       for url, image_id in url_to_image_id_map.items()}, user_id)
+        image_tags = generate_test_image_tags(image_ids[:int(batch_size * tagged_fraction)], 4, 1)
+        data_access.update_tagged_images_v2(data_access.convert_to_annotated_label(image_tags, class_map), user_id)
+        data_access.add_prediction_labels(generate_test_prediction_labels(training_id, image_ids, class_map),
+                                          training_id, refresh_latest_predictions=False)
+        print("Seeded {0} of {1} images ({2:.0f}s)".format(seeded + batch_size, num_of_images,
+                                                           time.perf_counter() - start))
+    analyze()
+
+class Session:
+    def __init__(self, data_access, user_id, batch_size):
+        self.data_access = data_access
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.checked_out = []
+        self.claimed = []
+        self.empty_checkouts = 0
+        self.last_image_tag_id = data_access.get_last_image_tag_id()
+
+    def onboard(self):
+        url_to_image_id_map = self.data_access.add_new_images(generate_test_image_infos(self.batch_size), self.user_id)
+        self.data_access.update_image_urls({image_id: url.replace("new-uploads", "perm-uploads")
+                                            for url, image_id in url_to_image_id_map.items()}, self.user_id)
+
+    def download(self):
+        rows = self.data_access.checkout_images(self.batch_size, self.user_id)
+        self.data_access.get_existing_classifications()
+        self.checked_out = list(set(row[0] for row in rows))
+        self.claimed.extend(self.checked_out)
+        if not rows:
+            self.empty_checkouts += 1
+
+    # A tagger hands back what it checked out: most images tagged, some empty, some unfinished
+    def upload(self):
+        if not self.checked_out:
+            self.download()
+        image_ids, self.checked_out = self.checked_out, []
+        tagged, empty, incomplete = image_ids[:int(len(image_ids) * 0.8)], image_ids[int(len(image_ids) * 0.8):-1], image_ids[-1:]
+        image_tags = generate_test_image_tags(tagged, 4, 1)
+        class_map = self.data_access.get_classification_map(set(TestClassifications), self.user_id)
+        self.data_access.update_tagged_images_v2(self.data_access.convert_to_annotated_label(image_tags, class_map),
+                                                 self.user_id)
+        self.data_access.update_completed_untagged_images(empty, self.user_id)
+        self.data_access.update_incomplete_images(incomplete, self.user_id)
+
+    def labels(self):
+        labels, self.last_image_tag_id = self.data_access.get_labels_since(self.last_image_tag_id)
+
+    def images(self):
+        images_by_tag_status, _ = self.data_access.get_images_by_tag_status_page(
+            [int(ImageTagState.READY_TO_TAG), int(ImageTagState.COMPLETED_TAG)], page_size=self.batch_size)
+        self.data_access.get_image_info_for_image_ids(list(images_by_tag_status.keys()))
+
+def worker(args):
+    # Each worker runs in its own process with its own connection pool, like a function host
+    # instance, so the driver's Python overhead does not serialize the workers on the GIL.
+    worker_id, mix, duration, batch_size = args
+    exporter = LatencyExporter()
+    data_access = get_data_access(Instrumentation(exporter))
+    session = Session(data_access, data_access.create_user("{0}-load-{1}".format(getpass.getuser(), worker_id)),
+                      batch_size)
+    del exporter.records[:]
+    scenarios = list(mix)
+    weights = [mix[s] for s in scenarios]
+    scenario_records = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        scenario = random.choices(scenarios, weights)[0]
+        start = time.perf_counter()
+        success = True
+        try:
+            getattr(session, scenario)()
+        except Exception as e:
+            print("{0} failed: {1}".format(scenario, e))
+            success = False
+        scenario_records.append((scenario, (time.perf_counter() - start) * 1000, success))
+    return scenario_records, exporter.records, session.claimed, session.empty_checkouts
+
+def summarize(records, seconds):
+    by_name = {}
+    for name, duration_ms, success in records:
+        by_name.setdefault(name, []).append((duration_ms, success))
+    summary = {}
+    for name, calls in by_name.items():
+        latencies = [duration_ms for duration_ms, _ in calls]
+        summary[name] = {"calls": len(calls),
+                         "errors": sum(1 for _, success in calls if not success),
+                         "p50_ms": percentile(latencies, 50),
+                         "p99_ms": percentile(latencies, 99),
+                         "per_sec": len(calls) / seconds}
+    return summary
+
+def run(data_access, worker_count, mix, duration, batch_size):
+    with worker_pool(worker_count) as pool:
+        start = time.perf_counter()
+        results = pool.map(worker, [(i, mix, duration, batch_size) for i in range(worker_count)])
+        seconds = time.perf_counter() - start
+    scenario_records = [r for scenarios, _, _, _ in results for r in scenarios]
+    method_records = [r for _, methods, _, _ in results for r in methods]
+    claimed = [image_id for _, _, image_ids, _ in results for image_id in image_ids]
+    empty_checkouts = sum(empty for _, _, _, empty in results)
+    if empty_checkouts:
+        print("WARNING: {0} checkouts found no images ready to tag, seed more images or shorten the run".format(
+            empty_checkouts))
+    # Every image checked out was ready to tag, putting them back gives the next run the same pool
+    data_access._update_images(claimed, ImageTagState.READY_TO_TAG, data_access.create_user(getpass.getuser()), None)
+    return {"scenarios": summarize(scenario_records, seconds), "methods": summarize(method_records, seconds)}
+
+def print_summary(title, summary, baseline=None):
+    print()
+    print(title)
+    print("{0:<36}{1:>8}{2:>8}{3:>10}{4:>10}{5:>10}{6:>12}".format("Call", "Calls", "Errors", "p50 ms", "p99 ms",
+                                                                   "Calls/sec", "p99 change"))
+    for name, stats in sorted(summary.items()):
+        change = ""
+        if baseline and baseline.get(name, {}).get("p99_ms"):
+            change = "{0:+.0%}".format(stats["p99_ms"] / baseline[name]["p99_ms"] - 1)
+        print("{0:<36}{1:>8}{2:>8}{3:>10.1f}{4:>10.1f}{5:>10.1f}{6:>12}".format(
+            name, stats["calls"], stats["errors"], stats["p50_ms"], stats["p99_ms"], stats["per_sec"], change))
+
+# A method regresses when its p99 latency grows or its throughput drops by more than max_regression
+def find_regressions(results, baseline, max_regression):
+    regressions = []
+    for workers, result in results.items():
+        for name, stats in result["methods"].items():
+            before = baseline.get(workers, {}).get("methods", {}).get(name)
+            if before is None:
+                continue
+            if stats["p99_ms"] > max(before["p99_ms"] * (1 + max_regression), before["p99_ms"] + MIN_REGRESSION_MS):
+                regressions.append("{0} worker(s) {1}: p99 {2:.1f} ms, was {3:.1f} ms".format(
+                    workers, name, stats["p99_ms"], before["p99_ms"]))
+            if stats["per_sec"] < before["per_sec"] * (1 - max_regression):
+                regressions.append("{0} worker(s) {1}: {2:.1f} calls/sec, was {3:.1f}".format(
+                    workers, name, stats["per_sec"], before["per_sec"]))
+    return regressions
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        scenario, weight = part.split("=")
+        if not hasattr(Session, scenario.strip()):
+            raise ValueError("Unknown scenario {0}".format(scenario))
+        weights[scenario.strip()] = float(weight)
+    return weights
+
+def main(args):
+    if not env_is_configured():
+        return
+    data_access = get_data_access()
+    print("Seeding {0} images...".format(args.num_images))
+    seed(data_access, args.num_images, args.tagged_fraction)
+    if args.seed_only:
+        return
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    mix = parse_mix(args.mix)
+    results = {}
+    for worker_count in args.workers:
+        key = str(worker_count)
+        results[key] = run(data_access, worker_count, mix, args.duration, args.batch_size)
+        base = baseline.get(key) if baseline else None
+        print_summary("{0} worker(s), {1}s: scenarios".format(worker_count, args.duration),
+                      results[key]["scenarios"], base and base["scenarios"])
+        print_summary("{0} worker(s), {1}s: ImageTagDataAccess methods".format(worker_count, args.duration),
+                      results[key]["methods"], base and base["methods"])
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if baseline:
+        regressions = find_regressions(results, baseline, args.max_regression / 100)
+        if regressions:
+            print()
+            print("ERROR: {0} regression(s) against {1}".format(len(regressions), args.baseline))
+            for regression in regressions:
+                print("\t" + regression)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-images', type=int, default=1000000)
+    parser.add_argument('--tagged-fraction', type=float, default=0.7,
+                        help='Fraction of the seeded images that are tagged, the rest are ready to tag')
+    parser.add_argument('--seed-only', action='store_true')
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('-d', '--duration', type=int, default=60, help='Seconds of traffic per worker count')
+    parser.add_argument('-b', '--batch-size', type=int, default=40, help='Images per checkout, upload and onboard')
+    parser.add_argument('-m', '--mix', default=DEFAULT_MIX, help='Relative weight of each scenario')
+    parser.add_argument('--save', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against results saved with --save and fail on regressions')
+    parser.add_argument('--max-regression', type=float, default=20,
+                        help='Percent a p99 may grow or a throughput may drop before the run fails')
+    parser.add_argument('--local', action='store_true',
+                        help='Run against a temporary cluster started with initdb and pg_ctl from PATH')
+    args = parser.parse_args()
+    if args.local:
+        with temp_cluster("load_test"):
+            main(args)
+    else:
+        main(args)
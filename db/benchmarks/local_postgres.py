@@ -0,0 +1,37 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import contextlib
+
+#################################################################
+# Throwaway PostgreSQL cluster for benchmarks. Runs initdb and
+# pg_ctl from PATH in a temporary directory, installs the schema
+# with install-db-resources.py and points the DB_* environment
+# variables at it. Everything is deleted when the block exits.
+#################################################################
+
+DEFAULT_PORT = 5499
+DB_USER = "postgres"
+
+INSTALL_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "install-db-resources.py")
+
+@contextlib.contextmanager
+def temp_cluster(db_name, port=DEFAULT_PORT):
+    data_dir = tempfile.mkdtemp(prefix="active-learning-pg-")
+    try:
+        subprocess.check_call(["initdb", "-D", data_dir, "-U", DB_USER, "--auth=trust"], stdout=subprocess.DEVNULL)
+        subprocess.check_call(["pg_ctl", "-D", data_dir, "-w", "-l", os.path.join(data_dir, "server.log"),
+                               "-o", "-p {0} -k {1} -c listen_addresses=localhost".format(port, data_dir), "start"],
+                              stdout=subprocess.DEVNULL)
+        try:
+            # Trust authentication ignores the password, the scripts only need one to be set
+            os.environ.update(DB_HOST="localhost", DB_PORT=str(port), DB_SSL="false", DB_USER=DB_USER,
+                              DB_PASS="benchmark", DB_NAME=db_name)
+            subprocess.check_call([sys.executable, INSTALL_SCRIPT, db_name])
+            yield
+        finally:
+            subprocess.call(["pg_ctl", "-D", data_dir, "-w", "-m", "fast", "stop"], stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
@@ -0,0 +1,128 @@
+import argparse
+import getpass
+import random
+import statistics
+from benchmark_utils import (
+    env_is_configured,
+    get_data_access,
+    timed,
+    RoundTripCounter,
+    onboard_test_images
+)
+from functions.pipeline.shared.db_access import ImageTagDataAccess
+from functions.pipeline.shared.db_access.db_access_v2 import (
+    AnnotatedLabel,
+    generate_test_image_infos
+)
+
+#################################################################
+# Shows what binding values instead of formatting them into the
+# query text buys. The same image info lookup runs with a literal
+# IN list, with a bound = ANY(%s) array and as a server prepared
+# statement. Every new query text is parsed and planned again and
+# takes another slot in the driver's prepared statement cache,
+# bound queries reuse one. Then times repeated checkout and upload
+# round trips through the data access layer.
+#################################################################
+
+IMAGE_INFO_QUERY = ("select i.imageid, i.originalimagename, i.imagelocation, i.height, i.width, i.createdbyuser "
+                    "from image_info i where i.imageid {0}")
+
+def run_lookups(conn, label, id_lists, execute):
+    cursor = conn.cursor()
+    statements = set()
+    latencies = []
+    for ids in id_lists:
+        query, args = execute(ids)
+        statements.add(query)
+        _, seconds = timed(cursor.execute, query, args) if args else timed(cursor.execute, query)
+        cursor.fetchall()
+        latencies.append(seconds * 1000)
+    return (label, len(id_lists), len(statements), statistics.median(latencies), sorted(latencies)[int(len(latencies) * 0.99)])
+
+def literal_in_list(ids):
+    return IMAGE_INFO_QUERY.format("IN ({0})".format(",".join(str(i) for i in ids))), None
+
+def bound_array(ids):
+    return IMAGE_INFO_QUERY.format("= ANY(%s)"), (ids,)
+
+# EXECUTE is a utility statement and can't take bind parameters, the plan it runs is still reused
+def server_prepared(ids):
+    return "EXECUTE image_info_lookup(ARRAY[{0}])".format(",".join(str(i) for i in ids)), None
+
+def print_plan_cache(conn):
+    cursor = conn.cursor()
+    try:
+        # generic_plans and custom_plans are only reported by PostgreSQL 14 and later
+        cursor.execute("SELECT name, generic_plans, custom_plans FROM pg_prepared_statements")
+    except Exception:
+        conn.rollback()
+        cursor.execute("SELECT name, NULL, NULL FROM pg_prepared_statements")
+    print()
+    print("{0:<40}{1:>15}{2:>15}".format("Prepared statement", "Generic plans", "Custom plans"))
+    for name, generic_plans, custom_plans in cursor.fetchall():
+        print("{0:<40}{1:>15}{2:>15}".format(name[:38], str(generic_plans), str(custom_plans)))
+
+def time_tagging_sessions(data_access, user_id, class_id, sessions, images_per_session):
+    checkout_ms = []
+    upload_ms = []
+    for _ in range(sessions):
+        checked_out, seconds = timed(data_access.checkout_images, images_per_session, user_id)
+        checkout_ms.append(seconds * 1000)
+        image_ids = list(set(row[0] for row in checked_out))
+        labels = [AnnotatedLabel(image_id, class_id, 10, 20, 30, 40) for image_id in image_ids]
+        _, seconds = timed(data_access.update_tagged_images_v2, labels, user_id, bulk_load=False)
+        upload_ms.append(seconds * 1000)
+    return checkout_ms, upload_ms
+
+def main(num_of_images, num_of_calls, ids_per_call, sessions):
+    if not env_is_configured():
+        return
+
+    data_access = get_data_access()
+    user_id = data_access.create_user(getpass.getuser())
+    image_ids = onboard_test_images(data_access, generate_test_image_infos(num_of_images), user_id)
+    id_lists = [random.sample(image_ids, random.randint(1, ids_per_call)) for _ in range(num_of_calls)]
+
+    conn = data_access._db_provider.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DEALLOCATE ALL")
+        cursor.execute("PREPARE image_info_lookup(integer[]) AS " + IMAGE_INFO_QUERY.format("= ANY($1)"))
+        results = [run_lookups(conn, "Literal IN list", id_lists, literal_in_list),
+                   run_lookups(conn, "Bound = ANY(%s)", id_lists, bound_array),
+                   run_lookups(conn, "PREPARE / EXECUTE", id_lists, server_prepared)]
+        print()
+        print("Image info lookups of 1 to {0} ids".format(ids_per_call))
+        print("{0:<30}{1:>10}{2:>18}{3:>12}{4:>12}".format("Mode", "Calls", "Distinct texts", "p50 ms", "p99 ms"))
+        for label, calls, texts, p50, p99 in results:
+            print("{0:<30}{1:>10}{2:>18}{3:>12.3f}{4:>12.3f}".format(label, calls, texts, p50, p99))
+        print_plan_cache(conn)
+        cursor.execute("DEALLOCATE ALL")
+        conn.commit()
+    finally: conn.close()
+
+    counter = RoundTripCounter(data_access._db_provider)
+    counting_data_access = ImageTagDataAccess(counter)
+    class_id = counting_data_access.get_classification_map({"benchmark"}, user_id)["benchmark"]
+    checkout_ms, upload_ms = time_tagging_sessions(counting_data_access, user_id, class_id, sessions, 10)
+    print()
+    print("{0} tagging sessions of 10 images".format(sessions))
+    print("{0:<30}{1:>12}{2:>12}".format("Call", "p50 ms", "p99 ms"))
+    for label, latencies in (("checkout_images", checkout_ms), ("update_tagged_images_v2", upload_ms)):
+        latencies = sorted(latencies)
+        print("{0:<30}{1:>12.3f}{2:>12.3f}".format(label, statistics.median(latencies), latencies[int(len(latencies) * 0.99)]))
+    print("Distinct statement texts across {0} round trips: {1}".format(counter.round_trips, len(counter.statements)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-images', type=int, default=10000,
+                        help='Images to onboard for the lookups')
+    parser.add_argument('-c', '--num-calls', type=int, default=2000,
+                        help='Lookups per mode')
+    parser.add_argument('-i', '--ids-per-call', type=int, default=50,
+                        help='Most image ids in one lookup')
+    parser.add_argument('-s', '--sessions', type=int, default=200,
+                        help='Checkout and upload rounds to time')
+    args = parser.parse_args()
+    main(args.num_images, args.num_calls, args.ids_per_call, args.sessions)
@@ -77,7 +77,9 @@ def get_connection():
     return __new_postgres_connection(os.environ['DB_HOST'],os.environ['DB_NAME'],os.environ['DB_USER'],os.environ['DB_PASS'])
 
 def __new_postgres_connection(host_name,db_name,db_user,db_pass):
-    return pg8000.connect(db_user, host=host_name, unix_sock=None, port=5432, database=db_name, password=db_pass, ssl=True, timeout=None, application_name=None)
+    # DB_PORT and DB_SSL=false allow installing into a local PostgreSQL, such as the benchmark cluster
+    return pg8000.connect(db_user, host=host_name, unix_sock=None, port=int(os.getenv('DB_PORT', 5432)), database=db_name,
+                          password=db_pass, ssl=os.getenv('DB_SSL', 'true').lower() != 'false', timeout=None, application_name=None)
 
 def get_file_query_map(sub_dir_name):
     dirname = os.path.dirname(__file__)
@@ -102,12 +104,77 @@ def execute_files_in_dir_list(conn,list_of_sub_dirs):
             return
         execute_queries_from_map(conn,file_query_map)
 
-def main(db_name, overwrite_db):
+# Migrations live in the migrations directory as NNN_description.sql, one statement per file.
+# Applied versions are recorded in Schema_Migrations so each one runs exactly once per database.
+def get_migrations(sub_dir_name="migrations"):
+    file_query_map = get_file_query_map(sub_dir_name)
+    migrations = []
+    for file_path, query in file_query_map.items():
+        version = int(os.path.basename(file_path).split('_')[0])
+        migrations.append((version, file_path, query))
+    return sorted(migrations)
+
+def get_applied_migrations(conn):
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS Schema_Migrations ("
+                   "Version integer PRIMARY KEY, "
+                   "FileName text NOT NULL, "
+                   "AppliedDtim timestamp NOT NULL default current_timestamp)")
+    conn.commit()
+    cursor.execute("SELECT Version FROM Schema_Migrations")
+    return set(row[0] for row in cursor.fetchall())
+
+def apply_migrations(conn):
+    applied = get_applied_migrations(conn)
+    pending = [m for m in get_migrations() if m[0] not in applied]
+    if not pending:
+        print("\nDatabase schema is up to date")
+        return
+    print("\n****\tApplying migrations\t****\n")
+    cursor = conn.cursor()
+    for version, file_path, query in pending:
+        if not query:
+            print("The migration {0} is empty. Please fix".format(file_path))
+            return
+        cursor.execute(query)
+        cursor.execute("INSERT INTO Schema_Migrations (Version, FileName) VALUES (%s, %s)",
+                       (version, os.path.basename(file_path)))
+        conn.commit()
+        print("\t{0}".format(file_path))
+
+# Replaces the FOR EACH ROW audit triggers with FOR EACH STATEMENT versions that read transition
+# tables, so a bulk state change writes its audit rows in one INSERT. Runs as a single transaction
+# so the tables are never left without audit triggers.
+def install_statement_triggers(conn, sub_dir_name="statement_triggers"):
+    file_query_map = collections.OrderedDict(sorted(get_file_query_map(sub_dir_name).items()))
+    if '' in file_query_map.values():
+        print("One of the files is empty. Please fix")
+        return
+    print("\n****\tInstalling statement level triggers\t****\n")
+    cursor = conn.cursor()
+    for file_path,query in file_query_map.items():
+        cursor.execute(query)
+    conn.commit()
+    for file_path in file_query_map:
+        print("\t{0}".format(file_path))
+
+def main(db_name, overwrite_db, migrate_only=False, statement_triggers=False):
     try:
         if(os.getenv("DB_HOST") is None or os.getenv("DB_USER") is None or os.getenv("DB_PASS") is None):
             print("Please set environment variables for DB_HOST, DB_USER, DB_PASS")
             return
 
+        if migrate_only:
+            if not database_exists(get_default_connection(), db_name):
+                print("Database {0} does not exist. Run without --migrate to install it.".format(db_name))
+                return
+            conn = get_connection_for_db(db_name)
+            apply_migrations(conn)
+            if statement_triggers:
+                install_statement_triggers(conn)
+            print("Done!")
+            return
+
         if (database_exists(get_default_connection(), db_name) and overwrite_db):
             remove_database(get_default_connection(),db_name)
         elif (database_exists(get_default_connection(), db_name) and not overwrite_db):
@@ -124,6 +191,9 @@ def main(db_name, overwrite_db):
         conn = get_connection_for_db(db_name)
         sub_dirs = ["tables","functions","triggers","data"]
         execute_files_in_dir_list(conn,sub_dirs)
+        apply_migrations(conn)
+        if statement_triggers:
+            install_statement_triggers(conn)
 
         print("Done!")
     except Exception as e:
@@ -139,6 +209,12 @@ if __name__ == "__main__":
     parser.add_argument('-o','--overwrite', action='store_true',
                     help='Will drop and restore a database if it already exists')
 
+    parser.add_argument('-m','--migrate', action='store_true',
+                    help='Only apply pending migrations to an existing database')
+
+    parser.add_argument('-s','--statement-triggers', action='store_true',
+                    help='Install statement level audit triggers in place of the row level ones')
+
     args = parser.parse_args()
     database_name = args.database_name
-    main(args.database_name,args.overwrite)
+    main(args.database_name,args.overwrite,args.migrate,args.statement_triggers)
@@ -0,0 +1,2 @@
+-- Every image has exactly one tagging state row. State transitions and joins look rows up by ImageId
+ALTER TABLE Image_Tagging_State ADD PRIMARY KEY (ImageId);
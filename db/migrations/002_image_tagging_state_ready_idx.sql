@@ -0,0 +1,2 @@
+-- Images waiting for a tagger are a small slice of the table. Serves get_images_for_tagging and unranked checkout
+CREATE INDEX IF NOT EXISTS Image_Tagging_State_Ready_Idx ON Image_Tagging_State (CreatedDtim DESC, ImageId) WHERE TagStateId IN (1,4);
@@ -0,0 +1,2 @@
+-- Serves get_images_by_tag_status for arbitrary states, newest first
+CREATE INDEX IF NOT EXISTS Image_Tagging_State_TagState_Idx ON Image_Tagging_State (TagStateId, CreatedDtim DESC);
@@ -0,0 +1,2 @@
+-- Ranked checkout walks this index for the latest training run in image confidence order
+CREATE INDEX IF NOT EXISTS Prediction_Labels_Confidence_Idx ON Prediction_Labels (TrainingId, ImageConfidence, ImageId);
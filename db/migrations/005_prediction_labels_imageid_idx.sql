@@ -0,0 +1,2 @@
+-- The primary key leads with TrainingId, so lookups and foreign key checks by image need their own index
+CREATE INDEX IF NOT EXISTS Prediction_Labels_ImageId_Idx ON Prediction_Labels (ImageId);
@@ -0,0 +1,2 @@
+-- Foreign key to Classification_Info. Annotated_Labels ImageId is already covered by the primary key
+CREATE INDEX IF NOT EXISTS Annotated_Labels_ClassificationId_Idx ON Annotated_Labels (ClassificationId);
@@ -0,0 +1,2 @@
+-- Audit history is read per image
+CREATE INDEX IF NOT EXISTS Image_Tagging_State_Audit_ImageId_Idx ON Image_Tagging_State_Audit (ImageId, ArchiveDtim);
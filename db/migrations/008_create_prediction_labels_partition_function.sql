@@ -0,0 +1,16 @@
+-- Creates the Prediction_Labels partition for a training run if it does not exist yet.
+-- Checking the catalog first keeps the lock on the parent table to runs without a partition.
+CREATE OR REPLACE FUNCTION create_prediction_labels_partition(training_id integer)
+    RETURNS void AS
+    '
+        BEGIN
+            IF to_regclass(''prediction_labels_'' || training_id) IS NULL THEN
+                EXECUTE format(''CREATE TABLE prediction_labels_%s PARTITION OF Prediction_Labels FOR VALUES IN (%s)'',
+                               training_id, training_id);
+            END IF;
+        EXCEPTION WHEN duplicate_table THEN
+            -- Another session created it first
+            NULL;
+        END;
+    '
+    LANGUAGE plpgsql;
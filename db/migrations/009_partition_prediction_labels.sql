@@ -0,0 +1,38 @@
+-- Rebuilds Prediction_Labels as a table partitioned by TrainingId with one partition per training run,
+-- so checkout only reads the latest run and old runs can be dropped whole. Existing rows are copied over.
+DO
+    '
+        DECLARE
+            training_id integer;
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = ''prediction_labels''::regclass) THEN
+                RETURN;
+            END IF;
+
+            ALTER TABLE Prediction_Labels RENAME TO Prediction_Labels_Unpartitioned;
+            ALTER TABLE Prediction_Labels_Unpartitioned RENAME CONSTRAINT prediction_labels_pkey TO prediction_labels_unpartitioned_pkey;
+            DROP INDEX IF EXISTS Prediction_Labels_Confidence_Idx;
+            DROP INDEX IF EXISTS Prediction_Labels_ImageId_Idx;
+
+            CREATE TABLE Prediction_Labels (
+                TrainingId integer REFERENCES Training_Info(TrainingId),
+                ImageId integer REFERENCES Image_Info(ImageId),
+                ClassificationId integer REFERENCES Classification_Info(ClassificationId),
+                X_Min decimal(6,2) NOT NULL,
+                X_Max decimal(6,2) NOT NULL,
+                Y_Min decimal(6,2) NOT NULL,
+                Y_Max decimal(6,2) NOT NULL,
+                BoxConfidence decimal(5,4) NOT NULL,
+                ImageConfidence decimal(5,4) NOT NULL,
+                PRIMARY KEY (TrainingId,ImageId,ClassificationId,X_Min,X_Max,Y_Min,Y_Max)
+            ) PARTITION BY LIST (TrainingId);
+            CREATE INDEX Prediction_Labels_Confidence_Idx ON Prediction_Labels (TrainingId, ImageConfidence, ImageId);
+            CREATE INDEX Prediction_Labels_ImageId_Idx ON Prediction_Labels (ImageId);
+
+            FOR training_id IN SELECT DISTINCT TrainingId FROM Prediction_Labels_Unpartitioned LOOP
+                PERFORM create_prediction_labels_partition(training_id);
+            END LOOP;
+            INSERT INTO Prediction_Labels SELECT * FROM Prediction_Labels_Unpartitioned;
+            DROP TABLE Prediction_Labels_Unpartitioned;
+        END;
+    ';
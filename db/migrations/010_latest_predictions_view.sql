@@ -0,0 +1,12 @@
+-- One row per image from the latest training run that stored predictions. Refreshed by add_prediction_labels
+-- so checkout and the images API don't aggregate Prediction_Labels on every call.
+CREATE MATERIALIZED VIEW IF NOT EXISTS Latest_Predictions AS
+    SELECT p.ImageId,
+           p.TrainingId,
+           MAX(p.ImageConfidence) AS ImageConfidence,
+           array_agg(DISTINCT ci.ClassificationName::text) AS ClassificationNames,
+           count(*) AS BoxCount
+    FROM Prediction_Labels p
+    JOIN Classification_Info ci ON ci.ClassificationId = p.ClassificationId
+    WHERE p.TrainingId = (SELECT MAX(TrainingId) FROM Prediction_Labels)
+    GROUP BY p.ImageId, p.TrainingId;
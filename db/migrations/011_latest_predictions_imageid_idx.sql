@@ -0,0 +1,2 @@
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY needs a unique index
+CREATE UNIQUE INDEX IF NOT EXISTS Latest_Predictions_ImageId_Idx ON Latest_Predictions (ImageId);
@@ -0,0 +1,2 @@
+-- Ranked checkout walks this index in image confidence order
+CREATE INDEX IF NOT EXISTS Latest_Predictions_Confidence_Idx ON Latest_Predictions (ImageConfidence, ImageId);
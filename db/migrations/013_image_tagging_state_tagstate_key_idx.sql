@@ -0,0 +1,2 @@
+-- Keyset paging through images by tag status, ImageId breaks ties between images created together
+CREATE INDEX IF NOT EXISTS Image_Tagging_State_TagState_Key_Idx ON Image_Tagging_State (TagStateId, CreatedDtim DESC, ImageId DESC);
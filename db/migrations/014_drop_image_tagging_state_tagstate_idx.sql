@@ -0,0 +1,2 @@
+-- Superseded by Image_Tagging_State_TagState_Key_Idx which has the same leading columns
+DROP INDEX IF EXISTS Image_Tagging_State_TagState_Idx;
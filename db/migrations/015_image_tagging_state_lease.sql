@@ -0,0 +1,2 @@
+-- Images checked out for tagging hold a lease until this time. Expired leases are reclaimed by the reapcheckouts function
+ALTER TABLE Image_Tagging_State ADD COLUMN IF NOT EXISTS LeaseExpiresDtim timestamp;
@@ -0,0 +1,2 @@
+-- Images already checked out get the default four hour lease from their last change so they can be reclaimed too
+UPDATE Image_Tagging_State SET LeaseExpiresDtim = ModifiedDtim + interval '4 hours' WHERE TagStateId = 2 AND LeaseExpiresDtim IS NULL;
@@ -0,0 +1,2 @@
+-- Lets the reaper find expired leases without scanning every image in progress
+CREATE INDEX IF NOT EXISTS Image_Tagging_State_Lease_Idx ON Image_Tagging_State (LeaseExpiresDtim) WHERE TagStateId = 2;
@@ -0,0 +1,16 @@
+-- Container onboarding jobs. NextMarker is the list_blobs continuation marker of the next page to enqueue,
+-- so an interrupted job resumes from the last page it finished.
+CREATE TABLE IF NOT EXISTS Onboarding_Job (
+    JobId SERIAL PRIMARY KEY,
+    StorageAccount text NOT NULL,
+    StorageContainer text NOT NULL,
+    Status text NOT NULL,
+    NextMarker text,
+    PagesListed integer NOT NULL default 0,
+    BlobsListed integer NOT NULL default 0,
+    ImagesQueued integer NOT NULL default 0,
+    ErrorMessage text,
+    CreatedByUser integer REFERENCES User_Info(UserId),
+    ModifiedDtim timestamp NOT NULL default current_timestamp,
+    CreatedDtim timestamp NOT NULL default current_timestamp
+);
@@ -7,7 +7,7 @@ import time
 import logging
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from functions.pipeline.shared.db_access import ImageTagDataAccess
-from functions.pipeline.shared.db_provider import PostGresProvider, DatabaseInfo
+from functions.pipeline.shared.db_provider import PostGresProvider, get_postgres_provider, get_database_info_from_env
 from functions.pipeline.shared.db_access.db_access_v2 import generate_test_image_infos
 
 def get_transformed_id_to_url_map(id_to_url_map):
@@ -53,6 +53,39 @@ def extract_image_id_from_urls(list_of_image_urls):
             extracted_image_ids.append(extracted_id)
         return extracted_image_ids
 
+# Predictions for each training run live in their own Prediction_Labels partition named
+# prediction_labels_(TrainingId), so old runs are removed by dropping whole partitions
+def drop_old_prediction_label_partitions(conn, runs_to_keep):
+    cursor = conn.cursor()
+    cursor.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                   "WHERE i.inhparent = 'prediction_labels'::regclass")
+    partitions = sorted((int(row[0].rsplit('_', 1)[1]), row[0]) for row in cursor.fetchall())
+    dropped = []
+    for training_id, partition_name in partitions[:-runs_to_keep]:
+        cursor.execute("DROP TABLE {0}".format(partition_name))
+        dropped.append(training_id)
+    conn.commit()
+    return dropped
+
+def retain_prediction_runs(runs_to_keep):
+    if(os.getenv("DB_HOST") is None or os.getenv("DB_USER") is None or os.getenv("DB_NAME") is None or os.getenv("DB_PASS") is None):
+        print("Please set environment variables for DB_HOST, DB_USER, DB_NAME, DB_PASS")
+        return
+
+    if(runs_to_keep < 1):
+        print("Number of training runs to keep should be at least 1")
+        return
+
+    # One connection for one command, no pool. Honours DB_PORT and DB_SSL like the functions do.
+    conn = PostGresProvider(get_database_info_from_env()).get_connection()
+    try:
+        dropped = drop_old_prediction_label_partitions(conn, runs_to_keep)
+    finally: conn.close()
+    if dropped:
+        print("Dropped predictions for training runs: {0}".format(", ".join(str(i) for i in dropped)))
+    else:
+        print("No predictions older than the last {0} training runs".format(runs_to_keep))
+
 def main(num_of_images,user_name):
     try:
         if(os.getenv("DB_HOST") is None or os.getenv("DB_USER") is None or os.getenv("DB_NAME") is None or os.getenv("DB_PASS") is None):
@@ -74,8 +107,7 @@ def main(num_of_images,user_name):
         #   Checking in images that have or have not been tagged
         #################################################################   
 
-        db_config = DatabaseInfo(os.getenv("DB_HOST"),os.getenv("DB_NAME"),os.getenv("DB_USER"),os.getenv("DB_PASS"))
-        pg = PostGresProvider(db_config)
+        pg = get_postgres_provider()
         data_access = ImageTagDataAccess(pg)
         user_id = data_access.create_user(user_name)
 
@@ -114,7 +146,10 @@ def main(num_of_images,user_name):
         # Prints the audit history of the generated of all the newly onboarded 
         # images involved in the simulation to prove the state tracking for onboarding.
         image_ids = list(updated_image_id_url_map.keys())
-        pretty_print_audit_history(pg.get_connection(),image_ids)
+        audit_conn = pg.get_connection()
+        try:
+            pretty_print_audit_history(audit_conn,image_ids)
+        finally: audit_conn.close()
         time.sleep(3)
         print()
         
@@ -174,7 +209,10 @@ if __name__ == "__main__":
     log = logging.getLogger()
     log.setLevel(logging.getLevelName('DEBUG'))
     log.addHandler(console)
-    if (len(sys.argv) != 3):
+    if (len(sys.argv) == 3 and sys.argv[1] == "retain-predictions"):
+        retain_prediction_runs(int(sys.argv[2]))
+    elif (len(sys.argv) != 3):
         print("Usage: {0} (Number of Images) (User Name)".format(sys.argv[0]))
+        print("       {0} retain-predictions (Number of Training Runs To Keep)".format(sys.argv[0]))
     else:
         main(int(sys.argv[1]), str(sys.argv[2])) 
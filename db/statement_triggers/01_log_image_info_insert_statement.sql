@@ -0,0 +1,12 @@
+--Statement level version of log_image_info_insert. Creates the state rows for every inserted image in one INSERT
+CREATE OR REPLACE FUNCTION log_image_info_insert_statement()
+    RETURNS trigger AS
+    '
+        BEGIN
+            INSERT INTO Image_Tagging_State(ImageId,TagStateId,ModifiedByUser,ModifiedDtim,CreatedDtim)
+            SELECT ImageId,0,CreatedByUser,current_timestamp,current_timestamp FROM inserted_images;
+
+            RETURN NULL;
+        END;
+    '
+    LANGUAGE plpgsql;
@@ -0,0 +1,12 @@
+-- ActionFlag: 1 = insert, 2 = update, 3 = delete
+CREATE OR REPLACE FUNCTION log_image_tagging_state_insert_statement()
+    RETURNS trigger AS
+    '
+        BEGIN
+            INSERT INTO Image_Tagging_State_Audit(ImageId,TagStateId,ModifiedByUser,ModifiedDtim,ArchiveDtim,ActionFlag)
+            SELECT ImageId,TagStateId,ModifiedByUser,ModifiedDtim,current_timestamp,1 FROM inserted_states;
+
+            RETURN NULL;
+        END;
+    '
+    LANGUAGE plpgsql;
@@ -0,0 +1,14 @@
+-- ActionFlag: 1 = insert, 2 = update, 3 = delete
+CREATE OR REPLACE FUNCTION log_image_tagging_state_changes_statement()
+    RETURNS trigger AS
+    '
+        BEGIN
+            INSERT INTO Image_Tagging_State_Audit(ImageId,TagStateId,ModifiedByUser,ModifiedDtim,ArchiveDtim,ActionFlag)
+            SELECT n.ImageId,n.TagStateId,n.ModifiedByUser,n.ModifiedDtim,current_timestamp,2
+            FROM new_states n JOIN old_states o ON o.ImageId = n.ImageId
+            WHERE n.TagStateId <> o.TagStateId;
+
+            RETURN NULL;
+        END;
+    '
+    LANGUAGE plpgsql;
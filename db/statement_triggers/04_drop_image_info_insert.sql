@@ -0,0 +1 @@
+DROP TRIGGER IF EXISTS image_info_insert ON Image_Info;
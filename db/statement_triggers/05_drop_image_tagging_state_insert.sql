@@ -0,0 +1 @@
+DROP TRIGGER IF EXISTS image_tagging_state_insert ON Image_Tagging_State;
@@ -0,0 +1 @@
+DROP TRIGGER IF EXISTS image_tagging_state_changes ON Image_Tagging_State;
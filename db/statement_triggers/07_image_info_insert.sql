@@ -0,0 +1,5 @@
+CREATE TRIGGER image_info_insert
+    AFTER INSERT ON Image_Info
+    REFERENCING NEW TABLE AS inserted_images
+    FOR EACH STATEMENT
+        EXECUTE PROCEDURE log_image_info_insert_statement();
@@ -0,0 +1,5 @@
+CREATE TRIGGER image_tagging_state_insert
+    AFTER INSERT ON Image_Tagging_State
+    REFERENCING NEW TABLE AS inserted_states
+    FOR EACH STATEMENT
+        EXECUTE PROCEDURE log_image_tagging_state_insert_statement();
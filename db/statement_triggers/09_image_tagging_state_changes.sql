@@ -0,0 +1,5 @@
+CREATE TRIGGER image_tagging_state_changes
+    AFTER UPDATE ON Image_Tagging_State
+    REFERENCING OLD TABLE AS old_states NEW TABLE AS new_states
+    FOR EACH STATEMENT
+        EXECUTE PROCEDURE log_image_tagging_state_changes_statement();
@@ -46,4 +46,7 @@ az storage container create -n $STORAGE_PERM_CONTAINER --account-key $STORAGE_KE
 echo "Creating an onboarding queue"
 az storage queue create -n onboardqueue --account-key $STORAGE_KEY --account-name $STORAGE_NAME
 
+echo "Creating the container onboarding job queue"
+az storage queue create -n onboardjobqueue --account-key $STORAGE_KEY --account-name $STORAGE_NAME
+
 echo "Done!"
\ No newline at end of file
@@ -0,0 +1,127 @@
+import io
+import os
+import sys
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import urlopen
+from PIL import Image
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from functions.pipeline.shared.onboarding import probe_image_dimensions, probe_all_image_dimensions
+
+#################################################################
+# Compares reading image sizes by downloading each image and
+# opening it with Pillow, as onboarding used to, against ranged
+# probes of the first bytes run one at a time and concurrently.
+# Images are served by a local HTTP server standing in for blob
+# storage, with a per request latency and a per connection
+# bandwidth cap so whole downloads cost what they would over
+# the network.
+#################################################################
+
+CHUNK_SIZE = 64 * 1024
+
+def make_images(width, height):
+    # Noise compresses badly, which keeps the files as large as camera photos
+    img = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    images = {}
+    for extension, image_format in (("jpg", "JPEG"), ("png", "PNG"), ("gif", "GIF")):
+        buffer = io.BytesIO()
+        img.save(buffer, image_format)
+        images[extension] = buffer.getvalue()
+    return images
+
+class ImageServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, images, latency_seconds, bytes_per_second):
+        super().__init__(("127.0.0.1", 0), ImageRequestHandler)
+        self.images = images
+        self.latency_seconds = latency_seconds
+        self.bytes_per_second = bytes_per_second
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+# Serves /<name>.<extension> with the image of that extension and honours single Range requests
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = self.server.images[self.path.rsplit(".", 1)[-1]]
+        start, end = 0, len(data) - 1
+        byte_range = self.headers.get("Range")
+        if byte_range:
+            first, last = byte_range.split("=")[1].split("-")
+            start, end = int(first), min(int(last), end)
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        time.sleep(self.server.latency_seconds)
+        try:
+            for offset in range(start, end + 1, CHUNK_SIZE):
+                chunk = data[offset:min(offset + CHUNK_SIZE, end + 1)]
+                self.wfile.write(chunk)
+                with self.server.lock:
+                    self.server.bytes_sent += len(chunk)
+                time.sleep(len(chunk) / self.server.bytes_per_second)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client read what it needed and closed the connection
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def full_fetch(urls):
+    sizes = {}
+    for url in urls:
+        with Image.open(urlopen(url)) as img:
+            sizes[url] = img.size
+    return sizes
+
+def sequential_probe(urls):
+    return {url: probe_image_dimensions(url) for url in urls}
+
+def main(num_of_images, width, height, latency_ms, mbps, workers):
+    print("Generating {0}x{1} test images...".format(width, height))
+    images = make_images(width, height)
+    for extension, data in sorted(images.items()):
+        print("\t{0}: {1:.1f} MB".format(extension, len(data) / 1e6))
+
+    server = ImageServer(images, latency_ms / 1000, mbps * 1e6 / 8)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    extensions = sorted(images)
+    urls = ["http://127.0.0.1:{0}/{1}.{2}".format(server.server_port, i, extensions[i % len(extensions)])
+            for i in range(num_of_images)]
+
+    print()
+    print("{0} images, {1} ms latency, {2} Mbit/s per connection".format(num_of_images, latency_ms, mbps))
+    print("{0:<36}{1:>12}{2:>12}{3:>14}".format("Mode", "MB read", "Seconds", "Images/sec"))
+    expected = None
+    for label, probe in (("Full fetch with Pillow", full_fetch),
+                         ("Ranged probe, 1 at a time", sequential_probe),
+                         ("Ranged probe, {0} workers".format(workers),
+                          lambda urls: probe_all_image_dimensions(urls, workers))):
+        server.bytes_sent = 0
+        start = time.perf_counter()
+        sizes = probe(urls)
+        seconds = time.perf_counter() - start
+        if expected is not None and sizes != expected:
+            print("ERROR: {0} read different sizes".format(label))
+            sys.exit(1)
+        expected = sizes
+        print("{0:<36}{1:>12.1f}{2:>12.2f}{3:>14.1f}".format(label, server.bytes_sent / 1e6, seconds,
+                                                             num_of_images / seconds))
+    server.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-images', type=int, default=60)
+    parser.add_argument('--width', type=int, default=3000)
+    parser.add_argument('--height', type=int, default=2000)
+    parser.add_argument('-l', '--latency-ms', type=float, default=20, help='Added before each response')
+    parser.add_argument('-m', '--mbps', type=float, default=200, help='Bandwidth of each connection')
+    parser.add_argument('-w', '--workers', type=int, default=16)
+    args = parser.parse_args()
+    main(args.num_images, args.width, args.height, args.latency_ms, args.mbps, args.workers)
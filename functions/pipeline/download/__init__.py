@@ -1,17 +1,31 @@
+import os
 import logging
+import asyncio
 
 import azure.functions as func
 import json
+from decimal import Decimal
 
 from ..shared.db_provider import get_postgres_provider
-from ..shared.db_access import ImageTagDataAccess
+from ..shared.db_access import AsyncImageTagDataAccess, CheckoutStrategy, DEFAULT_CHECKOUT_LEASE_SECONDS, to_columnar_checkout
 
+# rows returns the checkout rows as they come from the database, one per prediction box.
+# columnar returns each image once with its boxes as parallel arrays, see to_columnar_checkout.
+RESPONSE_FORMATS = ("rows", "columnar")
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+def encode_decimal(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError("{0} is not JSON serializable".format(type(value).__name__))
+
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
     image_count = req.params.get('imageCount')
     user_name = req.params.get('userName')
+    strategy = req.params.get('strategy', CheckoutStrategy.ANY.value)
+    response_format = req.params.get('format', 'rows')
 
     # setup response object
     headers = {
@@ -29,23 +43,42 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             headers=headers,
             body=json.dumps({"error": "image count not specified"})
         )
+    elif strategy not in [s.value for s in CheckoutStrategy]:
+        return func.HttpResponse(
+            status_code=400,
+            headers=headers,
+            body=json.dumps({"error": "strategy must be one of {0}".format([s.value for s in CheckoutStrategy])})
+        )
+    elif response_format not in RESPONSE_FORMATS:
+        return func.HttpResponse(
+            status_code=400,
+            headers=headers,
+            body=json.dumps({"error": "format must be one of {0}".format(list(RESPONSE_FORMATS))})
+        )
     else:
         try:
             # DB configuration
             image_count = int(image_count)
-            data_access = ImageTagDataAccess(get_postgres_provider())
-            user_id = data_access.create_user(user_name)
+            data_access = AsyncImageTagDataAccess(get_postgres_provider())
+            user_id = await data_access.create_user(user_name)
             
             image_count = int(image_count)
-            image_id_to_tag_data = data_access.checkout_images(image_count, user_id)
-            existing_classifications_list = data_access.get_existing_classifications()
+            # Images not uploaded within the lease are returned to the pool by the reapcheckouts function
+            lease_seconds = int(os.getenv('CHECKOUT_LEASE_SECONDS', DEFAULT_CHECKOUT_LEASE_SECONDS))
+            # The checkout and the classification list don't depend on each other, so each runs on its own connection
+            image_id_to_tag_data, existing_classifications_list = await asyncio.gather(
+                data_access.checkout_images(image_count, user_id, CheckoutStrategy(strategy), lease_seconds),
+                data_access.get_existing_classifications())
 
-            return_body_json = {
-                "images": image_id_to_tag_data,
-                "classification_list": existing_classifications_list
-            }
+            if response_format == "columnar":
+                return_body_json = to_columnar_checkout(image_id_to_tag_data)
+                return_body_json["format"] = response_format
+            else:
+                return_body_json = {"images": image_id_to_tag_data}
+            return_body_json["classification_list"] = existing_classifications_list
 
-            content = json.dumps(return_body_json)
+            # Box coordinates and confidences are numeric columns, which the driver returns as Decimal
+            content = json.dumps(return_body_json, default=encode_decimal)
             return func.HttpResponse(
                 status_code=200,
                 headers=headers,
@@ -1,19 +1,35 @@
 import logging
+import re
 
 import azure.functions as func
 import json
+from datetime import datetime, timedelta
 
 from ..shared.db_provider import get_postgres_provider
-from ..shared.db_access import ImageTagDataAccess, ImageTagState
+from ..shared.db_access import AsyncImageTagDataAccess, ImageTagState
 
+MAX_PAGE_SIZE = 5000
+EPOCH = datetime(1970, 1, 1)
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+# The page cursor handed to clients is "<created microseconds since epoch>_<image id>"
+def encode_page_cursor(key):
+    created_dtim, image_id = key
+    return "{0}_{1}".format((created_dtim - EPOCH) // timedelta(microseconds=1), image_id)
+
+def decode_page_cursor(cursor):
+    created_micros, image_id = cursor.split("_")
+    return EPOCH + timedelta(microseconds=int(created_micros)), int(image_id)
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
     image_count = req.params.get('imageCount')
     user_name = req.params.get('userName')
     tag_status = req.params.get('tagStatus')
     image_ids = req.params.get('imageId')
+    # Page through images by tag status, the next page's cursor is returned in the x-images-cursor header
+    page_size = req.params.get('pageSize')
+    page_cursor = req.params.get('cursor')
 
     # setup response object
     headers = {
@@ -25,11 +41,23 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             headers=headers,
             body=json.dumps({"error": "invalid userName given or omitted"})
         )
-    elif not image_count and tag_status:
+    elif not image_count and not page_size and tag_status:
+        return func.HttpResponse(
+            status_code=400,
+            headers=headers,
+            body=json.dumps({"error": "image count or page size needs to be specified if tag status is specified"})
+        )
+    elif page_size is not None and (not page_size.isdigit() or not 0 < int(page_size) <= MAX_PAGE_SIZE):
+        return func.HttpResponse(
+            status_code=400,
+            headers=headers,
+            body=json.dumps({"error": "page size must be between 1 and {0}".format(MAX_PAGE_SIZE)})
+        )
+    elif page_cursor is not None and not re.match(r"^\d+_\d+$", page_cursor):
         return func.HttpResponse(
             status_code=400,
             headers=headers,
-            body=json.dumps({"error": "image count needs to be specified if tag status is specified"})
+            body=json.dumps({"error": "invalid cursor given"})
         )
     elif not tag_status and not image_ids:
         return func.HttpResponse(
@@ -40,8 +68,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     else:
         try:
             # DB configuration
-            data_access = ImageTagDataAccess(get_postgres_provider())
-            user_id = data_access.create_user(user_name)
+            data_access = AsyncImageTagDataAccess(get_postgres_provider())
+            user_id = await data_access.create_user(user_name)
 
             #TODO: Merge with the existing "Download" API
             # If client adds the querystring param api/images&vott=true 
@@ -52,12 +80,20 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
             # Get images info
             if image_ids:
-                image_infos = data_access.get_image_info_for_image_ids(image_ids.split(','))
+                image_infos = await data_access.get_image_info_for_image_ids(image_ids.split(','))
+            elif tag_status and page_size:
+                after = decode_page_cursor(page_cursor) if page_cursor else None
+                images_by_tag_status, next_key = await data_access.get_images_by_tag_status_page(
+                    tag_status.split(','), int(page_size), after)
+                logging.debug("Received a page of {0} images in tag status {1}".format(len(images_by_tag_status),tag_status))
+                image_infos = await data_access.get_image_info_for_image_ids(list(images_by_tag_status.keys()))
+                if next_key:
+                    headers["x-images-cursor"] = encode_page_cursor(next_key)
             elif tag_status:
                 image_count = int(image_count)
-                images_by_tag_status = data_access.get_images_by_tag_status(tag_status.split(','), image_count)
+                images_by_tag_status = await data_access.get_images_by_tag_status(tag_status.split(','), image_count)
                 logging.debug("Received {0} images in tag status {1}".format(len(images_by_tag_status),tag_status))
-                image_infos = data_access.get_image_info_for_image_ids(list(images_by_tag_status.keys()))
+                image_infos = await data_access.get_image_info_for_image_ids(list(images_by_tag_status.keys()))
 
             content = json.dumps(image_infos)
             return func.HttpResponse(
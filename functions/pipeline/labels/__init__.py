@@ -2,14 +2,37 @@ import logging
 import jsonpickle
 import azure.functions as func
 import json
+import io
 from ..shared.db_provider import get_postgres_provider
-from ..shared.db_access import ImageTagDataAccess, ImageTagState
+from ..shared.db_access import AsyncImageTagDataAccess, ImageTagState
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+# Encode one image at a time as rows stream out of the database rather than
+# building every label object before encoding the whole list
+def encode_labels(labels, output_format):
+    content = io.StringIO()
+    json_array = output_format != "ndjson"
+    separator = "," if json_array else "\n"
+    if json_array:
+        content.write("[")
+    for i, label in enumerate(labels):
+        if i > 0:
+            content.write(separator)
+        #Encode the complex object nesting
+        content.write(jsonpickle.encode(label,unpicklable=False))
+    if json_array:
+        content.write("]")
+    return content.getvalue()
+
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
     user_name = req.params.get('userName')
+    # "json" returns a single array, "ndjson" returns one image per line so clients can parse incrementally
+    output_format = req.params.get('format', 'json')
+    # High-water mark from the x-labels-cursor header of an earlier response
+    since = req.params.get('since')
     
     # setup response object
     headers = {
@@ -21,11 +44,23 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             headers=headers,
             body=json.dumps({"error": "invalid userName given or omitted"})
         )
+    elif output_format not in ("json", "ndjson"):
+        return func.HttpResponse(
+            status_code=400,
+            headers=headers,
+            body=json.dumps({"error": "format must be json or ndjson"})
+        )
+    elif since is not None and not since.isdigit():
+        return func.HttpResponse(
+            status_code=400,
+            headers=headers,
+            body=json.dumps({"error": "since must be a non-negative integer"})
+        )
     else:
         try:
             # DB configuration
-            data_access = ImageTagDataAccess(get_postgres_provider())
-            user_id = data_access.create_user(user_name)
+            data_access = AsyncImageTagDataAccess(get_postgres_provider())
+            user_id = await data_access.create_user(user_name)
 
             # TODO: Support POST http calls by merging with the existing "Upload" API.
             # Ideally GET http calls rerurn all human annotated labels. 
@@ -34,10 +69,16 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
             # Note: Currently we return all human annotated labels since TAGGING.CSV requires all rows
             # No use case to return predicted labels at the moment.
-            labels = data_access.get_labels()
-
-            #Encode the complex object nesting
-            content = jsonpickle.encode(labels,unpicklable=False)
+            # When since is given only images tagged after it are returned, whole, so the caller
+            # can replace its cached rows for them.
+            last_image_tag_id = await data_access.get_last_image_tag_id()
+            headers["x-labels-cursor"] = str(last_image_tag_id)
+            # The labels generator holds a database cursor open, so it is read to the end on one worker thread
+            labels = data_access.sync_data_access.iter_labels(since=int(since) if since is not None else None,
+                                                              until=last_image_tag_id)
+            content = await data_access.run(encode_labels, labels, output_format)
+            if output_format == "ndjson":
+                headers["content-type"] = "application/x-ndjson"
             return func.HttpResponse(
                 status_code=200,
                 headers=headers,
@@ -2,18 +2,26 @@ import os
 import logging
 import json
 import azure.functions as func
-from urlpath import URL
+from urllib.parse import urlencode
 from datetime import datetime, timedelta
-from ..shared.constants import ImageFileType
 
-from azure.storage.blob import BlockBlobService, BlobPermissions
+from ..shared.db_provider import get_postgres_provider
+from ..shared.db_access import ImageTagDataAccess
+from ..shared.onboarding import build_job_page_message, ONBOARDING_JOB_QUEUE_NAME
+
+from azure.storage.blob import BlockBlobService, ContainerPermissions
 from azure.storage.queue import QueueService, QueueMessageFormat
 
 DEFAULT_RETURN_HEADER = {
     "content-type": "application/json"
 }
 
+# How long the images of a job can be read with its SAS token. Jobs that outlive it are resumed with a new one.
+SAS_HOURS = int(os.getenv('ONBOARDING_SAS_HOURS', 24))
+
 
+# POST starts a job that enqueues every image in the container page by page in the background, or resumes
+# the job given as jobId in the body from its last checkpoint. GET with jobId returns the progress of a job.
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
@@ -26,13 +34,39 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             body=json.dumps({"error": "invalid userName given or omitted"})
         )
 
+    data_access = ImageTagDataAccess(get_postgres_provider())
+
+    if req.method == "GET":
+        try:
+            job_id = int(req.params.get('jobId'))
+        except (TypeError, ValueError):
+            return func.HttpResponse(
+                status_code=400,
+                headers=DEFAULT_RETURN_HEADER,
+                body=json.dumps({"error": "jobId must be an integer"})
+            )
+        job = data_access.get_onboarding_job(job_id)
+        if job is None:
+            return func.HttpResponse(
+                status_code=404,
+                headers=DEFAULT_RETURN_HEADER,
+                body=json.dumps({"error": "no onboarding job with jobId {0}".format(job_id)})
+            )
+        # The marker is only needed to resume the job
+        del job["next_marker"]
+        return func.HttpResponse(
+            status_code=200,
+            headers=DEFAULT_RETURN_HEADER,
+            body=json.dumps(job, default=str)
+        )
+
     try:
         req_body = req.get_json()
-        logging.debug(req.get_json())
         storage_account = req_body["storageAccount"]
         storage_account_key = req_body["storageAccountKey"]
         storage_container = req_body["storageContainer"]
-    except ValueError:
+        job_id = req_body.get("jobId")
+    except (ValueError, KeyError):
         return func.HttpResponse(
             "ERROR: Unable to decode POST body",
             status_code=400
@@ -44,83 +78,56 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             status_code=401
         )
 
-    # Create blob service for storage account (retrieval source)
-    blob_service = BlockBlobService(account_name=storage_account,
-                                    account_key=storage_account_key)
-
-    # Queue service for perm storage and queue
-    queue_service = QueueService(
-        account_name=os.getenv('STORAGE_ACCOUNT_NAME'),
-        account_key=os.getenv('STORAGE_ACCOUNT_KEY')
-    )
-
-    queue_service.encode_function = QueueMessageFormat.text_base64encode
-
     try:
-        blob_list = []
-
-        for blob_object in blob_service.list_blobs(storage_container):
-            blob_url = URL(
-                blob_service.make_blob_url(
-                    storage_container,
-                    blob_object.name
+        user_id = data_access.create_user(user_name)
+        if job_id is None:
+            job_id = data_access.create_onboarding_job(storage_account, storage_container, user_id)
+            page = 0
+        else:
+            job = data_access.get_onboarding_job(int(job_id))
+            if job is None or (job["storage_account"], job["storage_container"]) != (storage_account, storage_container):
+                return func.HttpResponse(
+                    status_code=404,
+                    headers=DEFAULT_RETURN_HEADER,
+                    body=json.dumps({"error": "no onboarding job {0} for container {1}".format(job_id, storage_container)})
                 )
-            )
-            # Check for supported image types here.
-            if ImageFileType.is_supported_filetype(blob_url.suffix):
-                logging.debug("INFO: Building sas token for blob " + blob_object.name)
-                # create sas signature
-                sas_signature = blob_service.generate_blob_shared_access_signature(
-                    storage_container,
-                    blob_object.name,
-                    BlobPermissions.READ,
-                    datetime.utcnow() + timedelta(hours=1)
+            # Only a failed job is resumed, a running one still has its next page on the queue
+            page = data_access.resume_onboarding_job(job["id"])
+            if page is None:
+                return func.HttpResponse(
+                    status_code=409,
+                    headers=DEFAULT_RETURN_HEADER,
+                    body=json.dumps({"error": "onboarding job {0} is {1}, only failed jobs can be resumed".format(
+                        job_id, job["status"])})
                 )
+            job_id = job["id"]
+
+        # Create blob service for storage account (retrieval source)
+        blob_service = BlockBlobService(account_name=storage_account,
+                                        account_key=storage_account_key)
+        sas_token = blob_service.generate_container_shared_access_signature(
+            storage_container,
+            ContainerPermissions.READ | ContainerPermissions.LIST,
+            datetime.utcnow() + timedelta(hours=SAS_HOURS)
+        )
 
-                logging.debug("INFO: have sas signature {}".format(sas_signature))
-
-                signed_url = blob_url.with_query(sas_signature)
-
-                blob_list.append(signed_url.as_uri())
-
-                logging.debug("INFO: Built signed url: {}".format(signed_url))
-
-                msg_body = {
-                    "imageUrl": signed_url.as_uri(),
-                    "fileName": str(blob_url.name),
-                    "fileExtension": str(blob_url.suffix),
-                    "directoryComponents": __get_filepath_from_url(blob_url, storage_container),
-                    "userName": user_name
-                }
-
-                body_str = json.dumps(msg_body)
-                queue_service.put_message("onboardqueue", body_str)
-            else:
-                logging.info("Blob object not supported. Object URL={}".format(blob_url.as_uri))
+        # Queue service for perm storage and queue
+        queue_service = QueueService(
+            account_name=os.getenv('STORAGE_ACCOUNT_NAME'),
+            account_key=os.getenv('STORAGE_ACCOUNT_KEY')
+        )
+        queue_service.encode_function = QueueMessageFormat.text_base64encode
+        queue_service.put_message(ONBOARDING_JOB_QUEUE_NAME, build_job_page_message(job_id, page, user_name, sas_token))
 
+        logging.info("Onboarding job {0} queued to list container {1} from page {2}".format(job_id, storage_container,
+                                                                                            page))
+        progress_url = "{0}?{1}".format(req.url.split("?")[0], urlencode({"userName": user_name, "jobId": job_id}))
         return func.HttpResponse(
-            status_code=200,
+            status_code=202,
             headers=DEFAULT_RETURN_HEADER,
-            body=json.dumps(blob_list)
+            body=json.dumps({"jobId": job_id, "progressUrl": progress_url})
         )
     except Exception as e:
-        logging.error("ERROR: Could not build blob object list. Exception: " + str(e))
-        return func.HttpResponse("ERROR: Could not get list of blobs in storage_container={0}. Exception={1}".format(
+        logging.error("ERROR: Could not start onboarding job. Exception: " + str(e))
+        return func.HttpResponse("ERROR: Could not start onboarding of storage_container={0}. Exception={1}".format(
             storage_container, e), status_code=500)
-
-
-def __get_filepath_from_url(blob_url: URL, storage_container):
-    blob_uri = blob_url.path
-    return __remove_postfix(__remove_prefix(blob_uri, '/' + storage_container), '/' + blob_url.name)
-
-
-def __remove_prefix(text, prefix):
-    if text.startswith(prefix):
-        return text[len(prefix):]
-    return text
-
-
-def __remove_postfix(text, postfix):
-    if not text.endswith(postfix):
-        return text
-    return text[:len(text)-len(postfix)]
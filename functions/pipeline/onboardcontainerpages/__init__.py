@@ -0,0 +1,51 @@
+import os
+import json
+import logging
+import azure.functions as func
+
+from ..shared.db_provider import get_postgres_provider
+from ..shared.db_access import ImageTagDataAccess, OnboardingJobStatus
+from ..shared.onboarding import (
+    enqueue_container_page,
+    DEFAULT_PAGE_SIZE,
+    DEFAULT_BATCH_SIZE
+)
+from azure.storage.blob import BlockBlobService
+from azure.storage.queue import QueueService, QueueMessageFormat
+
+PAGE_SIZE = int(os.getenv('ONBOARDING_PAGE_SIZE', DEFAULT_PAGE_SIZE))
+BATCH_SIZE = int(os.getenv('ONBOARDING_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+# Deliveries before the functions host moves a message to the poison queue, maxDequeueCount in host.json
+MAX_DEQUEUE_COUNT = 5
+
+
+# Lists one page of a container onboarding job started by onboardcontainer and queues the next page,
+# so no invocation runs longer than a page however large the container is.
+def main(msg: func.QueueMessage) -> None:
+    page_msg = json.loads(msg.get_body().decode('utf-8'))
+    logging.info("Listing page {0} of onboarding job {1}".format(page_msg["page"], page_msg["jobId"]))
+
+    data_access = ImageTagDataAccess(get_postgres_provider())
+    try:
+        job = data_access.get_onboarding_job(page_msg["jobId"])
+        if job is None:
+            logging.error("ERROR: Onboarding job {0} does not exist".format(page_msg["jobId"]))
+            return
+
+        blob_service = BlockBlobService(account_name=job["storage_account"], sas_token=page_msg["sasToken"])
+        queue_service = QueueService(
+            account_name=os.getenv('STORAGE_ACCOUNT_NAME'),
+            account_key=os.getenv('STORAGE_ACCOUNT_KEY')
+        )
+        queue_service.encode_function = QueueMessageFormat.text_base64encode
+
+        enqueue_container_page(data_access, blob_service, queue_service, page_msg, PAGE_SIZE, BATCH_SIZE,
+                               redelivered=msg.dequeue_count > 1)
+    except Exception as e:
+        logging.error("ERROR: Could not list page {0} of onboarding job {1}. Exception: {2}".format(
+            page_msg["page"], page_msg["jobId"], e))
+        # The last error shows in the job's progress. Once the host gives up on the message the job is
+        # failed, and can be resumed from its checkpoint by posting its jobId to onboardcontainer.
+        status = OnboardingJobStatus.FAILED if msg.dequeue_count >= MAX_DEQUEUE_COUNT else OnboardingJobStatus.RUNNING
+        data_access.set_onboarding_job_status(page_msg["jobId"], status, str(e))
+        raise
@@ -1,12 +1,14 @@
 import os
 import logging
 import json
+import asyncio
+import functools
 import azure.functions as func
-from urllib.request import urlopen
-from PIL import Image
 from ..shared.db_provider import get_postgres_provider
-from ..shared.db_access import ImageTagDataAccess, ImageInfo
-from ..shared.onboarding import copy_images_to_permanent_storage, delete_images_from_temp_storage
+from ..shared.db_access import AsyncImageTagDataAccess, ImageInfo, get_instrumentation
+from ..shared.onboarding import copy_images_to_permanent_storage, delete_images_from_temp_storage, probe_all_image_dimensions
+from ..shared.onboarding.copy_engine import DEFAULT_COPY_WORKERS, DEFAULT_COPY_DEADLINE_SECONDS
+from ..shared.onboarding.image_dimensions import DEFAULT_PROBE_WORKERS
 from azure.storage.blob import BlockBlobService
 
 DEFAULT_RETURN_HEADER= { "content-type": "application/json" }
@@ -15,8 +17,17 @@ COPY_SOURCE = os.getenv('SOURCE_CONTAINER_NAME')
 COPY_DESTINATION = os.getenv('DESTINATION_CONTAINER_NAME')
 ACCOUNT_NAME=os.getenv('STORAGE_ACCOUNT_NAME')
 ACCOUNT_KEY=os.getenv('STORAGE_ACCOUNT_KEY')
+# Images whose size is read at the same time
+PROBE_WORKERS = int(os.getenv('IMAGE_PROBE_WORKERS', DEFAULT_PROBE_WORKERS))
+# Copies started and polled at the same time, and how long to wait for them to finish
+COPY_WORKERS = int(os.getenv('COPY_WORKERS', DEFAULT_COPY_WORKERS))
+COPY_DEADLINE_SECONDS = float(os.getenv('COPY_DEADLINE_SECONDS', DEFAULT_COPY_DEADLINE_SECONDS))
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+# Blob storage and image downloads are blocking calls, they run on the loop's default executor
+def run_blocking(func, *args):
+    return asyncio.get_event_loop().run_in_executor(None, functools.partial(func, *args))
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
     user_name = req.params.get('userName')
@@ -52,7 +63,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     url_list = set(raw_url_list)
 
     try:
-        image_object_list = build_objects_from_url_list(url_list)
+        image_object_list = await run_blocking(build_objects_from_url_list, url_list)
     except Exception as e:
         logging.error("Error: Could not build image object list. Exception: " + str(e))
         return func.HttpResponse(
@@ -62,7 +73,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         )
 
     try:
-        data_access = ImageTagDataAccess(get_postgres_provider())
+        data_access = AsyncImageTagDataAccess(get_postgres_provider())
     except Exception as e:
         logging.error("Error: Database connection failed. Exception: " + str(e))
         return func.HttpResponse(
@@ -72,19 +83,25 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         )
 
     # Create/look up username in database and retrieve user_id number
-    user_id= data_access.create_user(user_name)
+    user_id= await data_access.create_user(user_name)
     logging.info("User ID for {0} is {1}".format(user_name, user_id))
 
     # Add the images to the database and retrieve their image ID's
     logging.info("Add new images to the database, and retrieve a dictionary ImageId's mapped to ImageUrl's")
-    image_id_url_map = data_access.add_new_images(image_object_list,user_id)
+    image_id_url_map = await data_access.add_new_images(image_object_list,user_id)
 
     # Create blob service for storage account
     blob_service = BlockBlobService(account_name=ACCOUNT_NAME, account_key=ACCOUNT_KEY)
 
     # Copy images from temporary to permanent storage.  Receive back a list of the copy operations that succeeded and failed.
     # Note: Format for copy_succeeded_dict and copy_error_dict is { sourceURL : destinationURL }
-    copy_succeeded_dict, copy_error_dict = copy_images_to_permanent_storage(image_id_url_map, COPY_SOURCE, COPY_DESTINATION, blob_service)
+    copy_succeeded_dict, copy_error_dict, copy_report = await run_blocking(copy_images_to_permanent_storage, image_id_url_map, COPY_SOURCE, COPY_DESTINATION, blob_service, COPY_WORKERS, COPY_DEADLINE_SECONDS)
+    copy_metrics = copy_report.metrics()
+    exporter = get_instrumentation().exporter
+    exporter.track_metric("ImageCopiesPerSecond", copy_metrics["copies_per_second"])
+    if copy_metrics["p99_latency_ms"] is not None:
+        exporter.track_metric("ImageCopyP50LatencyMs", copy_metrics["p50_latency_ms"])
+        exporter.track_metric("ImageCopyP99LatencyMs", copy_metrics["p99_latency_ms"])
 
     # Update URLs in DB for images that were successfully copied
     logging.info("Now updating URLs in the DB for images that were successfully copied...")
@@ -95,13 +112,13 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         filename = str(destination_url).split('/')[-1]
         image_id_to_update = int(filename.split('.')[0])
         update_urls_dictionary[image_id_to_update] = str(destination_url)
-    data_access.update_image_urls(update_urls_dictionary, user_id)
+    await data_access.update_image_urls(update_urls_dictionary, user_id)
     logging.info("Done.")
 
     # Delete images from temporary storage.  Receive back a list of the delete operations that succeeded and failed.
     # Note: Format for delete_succeeded_dict and delete_error_dict is { sourceURL : destinationURL }
     logging.info("Now deleting images from temp storage...")
-    delete_succeeded_dict, delete_error_dict = delete_images_from_temp_storage(copy_succeeded_dict, COPY_SOURCE, blob_service)
+    delete_succeeded_dict, delete_error_dict = await run_blocking(delete_images_from_temp_storage, copy_succeeded_dict, COPY_SOURCE, blob_service)
     logging.info("Done.")
 
     # If both error_dicts are empty, return a 200 OK status code.
@@ -128,12 +145,13 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 # Given a list of image URL's, build an ImageInfo object for each, and return a list of these image objects.
 def build_objects_from_url_list(url_list):
     image_object_list = []
+    # Sizes are read from the first bytes of each image, several images at a time
+    url_to_dimensions = probe_all_image_dimensions(url_list, PROBE_WORKERS)
     for url in url_list:
         # Split original image name from URL
         original_filename = url.split("/")[-1]
         # Create ImageInfo object (def in db_access.py)
-        with Image.open(urlopen(url)) as img:
-            width, height = img.size
+        width, height = url_to_dimensions[url]
         image = ImageInfo(original_filename, url, height, width)
         # Append image object to the list
         image_object_list.append(image)
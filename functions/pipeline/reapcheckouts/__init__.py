@@ -0,0 +1,23 @@
+import os
+import logging
+
+import azure.functions as func
+
+from ..shared.db_provider import get_postgres_provider
+from ..shared.db_access import AsyncImageTagDataAccess, ImageTagState, get_instrumentation
+
+REAPER_USER_NAME = "checkout-reaper"
+
+# Returns images whose checkout lease has expired to the pool so abandoned tagging sessions
+# don't drain it. REAPER_TARGET_STATE can be set to ABANDONED to set them aside instead.
+async def main(timer: func.TimerRequest) -> None:
+    if timer.past_due:
+        logging.info('The checkout reaper is running late')
+
+    target_state = ImageTagState[os.getenv('REAPER_TARGET_STATE', ImageTagState.READY_TO_TAG.name)]
+    data_access = AsyncImageTagDataAccess(get_postgres_provider())
+    user_id = await data_access.create_user(REAPER_USER_NAME)
+    reclaimed_count = await data_access.reclaim_expired_checkouts(user_id, target_state)
+
+    logging.info("Reclaimed {0} expired checkouts to {1}".format(reclaimed_count, target_state.name))
+    get_instrumentation().exporter.track_metric("ReclaimedCheckouts", reclaimed_count)
@@ -1 +1,4 @@
-from .db_access_v2 import ImageTagDataAccess, ImageTag, ImageInfo, ImageTagState
\ No newline at end of file
+from .db_access_v2 import ImageTagDataAccess, ImageTag, ImageInfo, ImageTagState, CheckoutStrategy, OnboardingJobStatus, DEFAULT_CHECKOUT_LEASE_SECONDS, to_columnar_checkout
+from .classification_cache import ClassificationCache, get_classification_cache
+from .async_db_access import AsyncImageTagDataAccess, get_db_executor
+from .instrumentation import Instrumentation, AppInsightsExporter, NoOpExporter, get_instrumentation
\ No newline at end of file
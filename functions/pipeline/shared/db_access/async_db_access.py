@@ -0,0 +1,46 @@
+import asyncio
+import functools
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from ..db_provider.db_provider import DEFAULT_POOL_MAX_SIZE
+from .db_access_v2 import ImageTagDataAccess
+
+__executor_by_provider = weakref.WeakKeyDictionary()
+__executor_by_provider_lock = threading.Lock()
+
+def get_db_executor(db_provider):
+    # One executor per database provider, sized to its connection pool. More threads would
+    # only wait for a connection, fewer would leave pooled connections idle under load.
+    with __executor_by_provider_lock:
+        executor = __executor_by_provider.get(db_provider)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=getattr(db_provider, 'max_size', DEFAULT_POOL_MAX_SIZE))
+            __executor_by_provider[db_provider] = executor
+    return executor
+
+# Awaitable version of ImageTagDataAccess for async functions. Each call runs the blocking
+# pg8000 method on a worker thread with its own pooled connection, so the event loop keeps
+# serving other requests and independent calls can be awaited together with asyncio.gather.
+class AsyncImageTagDataAccess(object):
+    def __init__(self, db_provider, classification_cache=None, executor=None, instrumentation=None):
+        self.sync_data_access = ImageTagDataAccess(db_provider, classification_cache, instrumentation)
+        self._executor = executor or get_db_executor(db_provider)
+
+    # Runs any blocking function on the database executor, for work such as streaming labels
+    # that has to stay on one thread from start to finish
+    def run(self, func, *args, **kwargs):
+        return asyncio.get_event_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    # Only builds labels in memory, so it is called directly rather than awaited
+    def convert_to_annotated_label(self, image_tags, class_map):
+        return self.sync_data_access.convert_to_annotated_label(image_tags, class_map)
+
+    def __getattr__(self, name):
+        method = getattr(self.sync_data_access, name)
+        if name.startswith('_') or not callable(method):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        return call
@@ -0,0 +1,86 @@
+import os
+import time
+import threading
+import weakref
+
+# Class names are only ever added, so entries can live for a while. The TTL bounds how long
+# a class added or edited directly in the database goes unnoticed.
+DEFAULT_CLASSIFICATION_CACHE_TTL_SECONDS = 300
+
+__cache_by_provider = weakref.WeakKeyDictionary()
+__cache_by_provider_lock = threading.Lock()
+
+def get_classification_cache(db_provider):
+    # One cache per database provider. get_postgres_provider hands out the same provider to
+    # warm invocations, so they share what earlier invocations looked up.
+    with __cache_by_provider_lock:
+        cache = __cache_by_provider.get(db_provider)
+        if cache is None:
+            cache = ClassificationCache(float(os.getenv('CLASSIFICATION_CACHE_TTL_SECONDS',
+                                                        DEFAULT_CLASSIFICATION_CACHE_TTL_SECONDS)))
+            __cache_by_provider[db_provider] = cache
+    return cache
+
+# Thread safe map of classification name to id with a time to live. It also remembers
+# whether it holds every classification in the database so the full list can be served
+# without a query.
+class ClassificationCache(object):
+    def __init__(self, ttl_seconds=DEFAULT_CLASSIFICATION_CACHE_TTL_SECONDS, clock=time.monotonic):
+        if ttl_seconds < 0:
+            raise ValueError("ttl_seconds must not be negative")
+        self._ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._name_to_id = {}
+        self._loaded_at = None
+        self._complete = False
+        self.hits = 0
+        self.misses = 0
+
+    # Returns a map of the cached names and a set of the names that still need a lookup
+    def get(self, class_names):
+        with self._lock:
+            self._expire()
+            found = {}
+            missing = set()
+            for class_name in class_names:
+                class_id = self._name_to_id.get(class_name)
+                if class_id is None:
+                    missing.add(class_name)
+                else:
+                    found[class_name] = class_id
+            self.hits += len(found)
+            self.misses += len(missing)
+            return found, missing
+
+    # Returns every classification name, or None when the full list is not cached
+    def get_all(self):
+        with self._lock:
+            self._expire()
+            if not self._complete:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(self._name_to_id.keys())
+
+    def add(self, class_to_id, complete=False):
+        with self._lock:
+            self._expire()
+            if self._loaded_at is None or complete:
+                self._loaded_at = self._clock()
+            self._name_to_id.update(class_to_id)
+            if complete:
+                self._complete = True
+
+    def invalidate(self):
+        with self._lock:
+            self._name_to_id = {}
+            self._loaded_at = None
+            self._complete = False
+
+    def _expire(self):
+        # Everything expires together so the full list never mixes fresh and stale entries
+        if self._loaded_at is not None and self._clock() - self._loaded_at >= self._ttl_seconds:
+            self._name_to_id = {}
+            self._loaded_at = None
+            self._complete = False
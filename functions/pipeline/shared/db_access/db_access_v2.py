@@ -1,10 +1,15 @@
 import string
 import logging
 import random
-from enum import IntEnum, unique
+from enum import Enum, IntEnum, unique
+from datetime import datetime
 import getpass
 import itertools
+import csv
+import io
 from ..db_provider import DatabaseInfo, PostGresProvider
+from .classification_cache import get_classification_cache
+from .instrumentation import get_instrumentation, instrumented
 
 
 @unique
@@ -16,6 +21,36 @@ class ImageTagState(IntEnum):
     INCOMPLETE_TAG = 4
     ABANDONED = 5
 
+# How checkout_images picks among READY_TO_TAG images. The ranked strategies order by the
+# image confidence of the latest training run, mirroring pick_max in tag/download_vott_json.
+@unique
+class CheckoutStrategy(Enum):
+    ANY = "any"
+    LOWEST_CONFIDENCE = "lowest"
+    HIGHEST_CONFIDENCE = "highest"
+
+# Status of a container onboarding job, stored as its value in Onboarding_Job
+@unique
+class OnboardingJobStatus(Enum):
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+# Label sets at least this large are streamed with COPY instead of a multi-row INSERT
+BULK_LOAD_THRESHOLD = 10000
+# Rows sent per COPY statement. Bounds the size of the buffer built in memory.
+BULK_LOAD_CHUNK_SIZE = 50000
+# Images inserted per statement by add_new_images
+ADD_IMAGES_CHUNK_SIZE = 5000
+# Rows read per FETCH when streaming labels out of the database
+LABELS_FETCH_SIZE = 5000
+# How long reading the labels high-water mark waits for label writes in flight to commit
+LABELS_CURSOR_LOCK_TIMEOUT_MS = 30000
+# Default page size for keyset paging through images by tag status
+IMAGES_PAGE_SIZE = 500
+# How long a checked out image stays with its tagger before it can be reclaimed
+DEFAULT_CHECKOUT_LEASE_SECONDS = 4 * 60 * 60
+
 # An entity class for a VOTT image
 class ImageInfo(object):
     def __init__(self, image_name, image_location, height, width):
@@ -76,19 +111,27 @@ class PredictionLabel(AnnotatedLabel):
 
 
 class ImageTagDataAccess(object):
-    def __init__(self,  db_provider):
+    def __init__(self,  db_provider, classification_cache=None, instrumentation=None):
         self._db_provider = db_provider
+        # Shared by every ImageTagDataAccess over the same provider unless one is passed in
+        self.classification_cache = classification_cache if classification_cache is not None else get_classification_cache(db_provider)
+        # Times every public call, see instrumentation.py
+        self.instrumentation = instrumentation or get_instrumentation()
 
     def test_connection(self):
         conn = self._db_provider.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('select * from tagstate')
-        row = cursor.fetchone()
-        logging.info('')
-        while row:
-            logging.info(str(row[0]) + " " + str(row[1]))
+        try:
+            cursor = conn.cursor()
+            cursor.execute('select * from tagstate')
             row = cursor.fetchone()
+            logging.info('')
+            while row:
+                logging.info(str(row[0]) + " " + str(row[1]))
+                row = cursor.fetchone()
+        finally:
+            conn.close()
 
+    @instrumented
     def create_user(self,user_name):
         user_id = -1
         if not user_name:
@@ -119,6 +162,7 @@ class ImageTagDataAccess(object):
         finally: conn.close()
         return user_id
 
+    @instrumented
     def get_images_for_tagging(self, number_of_images, user_id):
         if number_of_images <= 0:
             raise ArgumentException("Parameter must be greater than zero")
@@ -128,12 +172,16 @@ class ImageTagDataAccess(object):
             conn = self._db_provider.get_connection()
             try:
                 cursor = conn.cursor()
+                # The states are inlined rather than bound so every plan, generic ones included, can use
+                # the partial index on ready images. They are constants, so the query text never changes.
                 query = ("SELECT b.ImageId, b.ImageLocation, a.TagStateId FROM Image_Tagging_State a "
-                        "JOIN Image_Info b ON a.ImageId = b.ImageId WHERE a.TagStateId IN ({1}, {2}) order by "
-                        "a.createddtim DESC limit {0}")
-                cursor.execute(query.format(number_of_images, ImageTagState.READY_TO_TAG, ImageTagState.INCOMPLETE_TAG))
+                        "JOIN Image_Info b ON a.ImageId = b.ImageId WHERE a.TagStateId IN ({0}, {1}) order by "
+                        "a.createddtim DESC limit %s").format(int(ImageTagState.READY_TO_TAG), int(ImageTagState.INCOMPLETE_TAG))
+                cursor.execute(query, (number_of_images,))
+                log_rows = logging.getLogger().isEnabledFor(logging.DEBUG)
                 for row in cursor:
-                    logging.debug('Image Id: {0} \t\tImage Name: {1} \t\tTag State: {2}'.format(row[0], row[1], row[2]))
+                    if log_rows:
+                        logging.debug('Image Id: %s \t\tImage Name: %s \t\tTag State: %s', row[0], row[1], row[2])
                     selected_images_to_tag[row[0]] = str(row[1])
                 self._update_images(selected_images_to_tag,ImageTagState.TAG_IN_PROGRESS, user_id, conn)
             finally:
@@ -145,50 +193,60 @@ class ImageTagDataAccess(object):
             conn.close()
         return selected_images_to_tag
 
-    def add_new_images(self,list_of_image_infos, user_id):
+    @instrumented
+    def add_new_images(self,list_of_image_infos, user_id, chunk_size=ADD_IMAGES_CHUNK_SIZE):
 
         if type(user_id) is not int:
             raise TypeError('user id must be an integer')
+        if type(chunk_size) is not int or chunk_size <= 0:
+            raise ArgumentException("chunk_size must be a positive integer")
 
         url_to_image_id_map = {}
+        list_of_image_infos = list(list_of_image_infos)
         if(len(list_of_image_infos) > 0):
             try:
                 conn = self._db_provider.get_connection()
                 try:
                     cursor = conn.cursor()
-                    for img in list(list_of_image_infos):
-                        query = ("INSERT INTO Image_Info (OriginalImageName,ImageLocation,Height,Width,CreatedByUser) "
-                                "VALUES (%s,%s,%s,%s,%s) RETURNING ImageId;")
-                        cursor.execute(query,(img.image_name,img.image_location,img.height,img.width,user_id))
-                        new_img_id = cursor.fetchone()[0]
-                        url_to_image_id_map[img.image_location] = new_img_id
+                    # One statement per chunk instead of per image. Returning the location lets us map
+                    # the generated ids back without relying on the order rows were inserted in.
+                    query = ("INSERT INTO Image_Info (OriginalImageName,ImageLocation,Height,Width,CreatedByUser) "
+                             "SELECT n, l, h, w, %s FROM unnest(%s::text[], %s::text[], %s::integer[], %s::integer[]) AS i(n, l, h, w) "
+                             "RETURNING ImageId, ImageLocation")
+                    for i in range(0, len(list_of_image_infos), chunk_size):
+                        chunk = list_of_image_infos[i:i + chunk_size]
+                        cursor.execute(query,(user_id,
+                                              [img.image_name for img in chunk],
+                                              [img.image_location for img in chunk],
+                                              [img.height for img in chunk],
+                                              [img.width for img in chunk]))
+                        for row in cursor.fetchall():
+                            url_to_image_id_map[row[1]] = row[0]
                     conn.commit()
                 finally: cursor.close()
-                logging.debug("Inserted {0} images to the DB".format(len(url_to_image_id_map)))
+                logging.debug("Inserted %s images to the DB", len(url_to_image_id_map))
             except Exception as e:
                 logging.error("An errors occured getting image ids: {0}".format(e))
                 raise
             finally: conn.close()
         return url_to_image_id_map
 
+    @instrumented
     def get_images_by_tag_status(self, tag_status, limit=None):
         images_by_tag_status = {}
         try:
             conn = self._db_provider.get_connection()
             try:
                 cursor = conn.cursor()
-                tags = ''
-                for id in tag_status:
-                    tags += str(id) + ','
-                tags = tags[:-1]
+                # LIMIT NULL returns every row
                 query = ("SELECT b.ImageId, b.ImageLocation, a.TagStateId FROM Image_Tagging_State a "
-                        "JOIN Image_Info b ON a.ImageId = b.ImageId WHERE a.TagStateId IN ({0}) order by "
-                        "a.createddtim DESC")
-                if limit:
-                    query += " limit {1}"
-                cursor.execute(query.format(tags, limit))
+                        "JOIN Image_Info b ON a.ImageId = b.ImageId WHERE a.TagStateId = ANY(%s) order by "
+                        "a.createddtim DESC limit %s")
+                cursor.execute(query, ([int(t) for t in tag_status], limit or None))
+                log_rows = logging.getLogger().isEnabledFor(logging.DEBUG)
                 for row in cursor:
-                    logging.debug('Image Id: {0} \t\tImage Name: {1} \t\tTag State: {2}'.format(row[0], row[1], row[2]))
+                    if log_rows:
+                        logging.debug('Image Id: %s \t\tImage Name: %s \t\tTag State: %s', row[0], row[1], row[2])
                     images_by_tag_status[row[0]] = str(row[1])
             finally:
                 cursor.close()
@@ -199,6 +257,51 @@ class ImageTagDataAccess(object):
             conn.close()
         return images_by_tag_status
   
+    # Returns one page of images in the given states, newest first, and the (CreatedDtim, ImageId)
+    # key to pass as after for the next page. The key is None once there are no more pages.
+    @instrumented
+    def get_images_by_tag_status_page(self, tag_status, page_size=IMAGES_PAGE_SIZE, after=None):
+        if type(page_size) is not int or page_size <= 0:
+            raise ArgumentException("page_size must be a positive integer")
+        if after is not None and (len(after) != 2 or not isinstance(after[0], datetime) or type(after[1]) is not int):
+            raise TypeError("after must be a (datetime, image id) tuple")
+
+        # Each state is read from its own range of the (TagStateId, CreatedDtim, ImageId) index so
+        # a page touches at most page_size rows per state however deep into the results it is
+        key_condition = "AND (a.CreatedDtim, a.ImageId) < (%s, %s) " if after else ""
+        query = ("SELECT p.ImageId, b.ImageLocation, p.CreatedDtim FROM ("
+                 "SELECT k.ImageId, k.CreatedDtim FROM unnest(%s::integer[]) s(TagStateId) "
+                 "CROSS JOIN LATERAL (SELECT a.ImageId, a.CreatedDtim FROM Image_Tagging_State a "
+                 "WHERE a.TagStateId = s.TagStateId " + key_condition +
+                 "ORDER BY a.CreatedDtim DESC, a.ImageId DESC LIMIT %s) k "
+                 "ORDER BY k.CreatedDtim DESC, k.ImageId DESC LIMIT %s) p "
+                 "JOIN Image_Info b ON b.ImageId = p.ImageId "
+                 "ORDER BY p.CreatedDtim DESC, p.ImageId DESC")
+        args = [sorted(set(int(t) for t in tag_status))]
+        if after:
+            args.extend(after)
+        args.extend([page_size, page_size])
+
+        images_by_tag_status = {}
+        next_key = None
+        conn = self._db_provider.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, tuple(args))
+            rows = cursor.fetchall()
+            for row in rows:
+                images_by_tag_status[row[0]] = str(row[1])
+            if len(rows) == page_size:
+                next_key = (rows[-1][2], rows[-1][0])
+            cursor.close()
+        except Exception as e:
+            logging.error("An errors occured getting a page of images by tag status: {0}".format(e))
+            raise
+        finally:
+            conn.close()
+        return images_by_tag_status, next_key
+
+    @instrumented
     def get_image_info_for_image_ids(self, image_ids):
         if not image_ids:
             return list()
@@ -207,13 +310,11 @@ class ImageTagDataAccess(object):
             conn = self._db_provider.get_connection()
             try:
                 cursor = conn.cursor()
-                ids = ''
-                for id in image_ids:
-                    ids += str(id) + ','
-                ids = ids[:-1]
-                query = ("select imageid, originalimagename, imagelocation, height, width, createdbyuser from image_info where imageid IN ({0});")
-                cursor.execute(query.format(ids))
-                logging.debug("Got image info back for image_id={}".format(image_ids))
+                query = ("select i.imageid, i.originalimagename, i.imagelocation, i.height, i.width, i.createdbyuser, "
+                         "lp.imageconfidence, lp.classificationnames from image_info i "
+                         "left join latest_predictions lp on lp.imageid = i.imageid where i.imageid = ANY(%s)")
+                cursor.execute(query, ([int(i) for i in image_ids],))
+                logging.debug("Got image info back for image_id=%s", image_ids)
 
                 images_info = []
                 for row in cursor:
@@ -223,6 +324,9 @@ class ImageTagDataAccess(object):
                     info['name'] = row[1]
                     info['location'] = row[2]
                     info['id'] = row[0]
+                    # Predictions of the latest training run, if it made any for this image
+                    info['image_confidence'] = float(row[6]) if row[6] is not None else None
+                    info['predicted_classes'] = row[7] or []
                     images_info.append(info)
             finally:
                 cursor.close()
@@ -234,49 +338,29 @@ class ImageTagDataAccess(object):
         return list(images_info)
 
 
-    def checkout_images(self, image_count, user_id):
+    @instrumented
+    def checkout_images(self, image_count, user_id, strategy=CheckoutStrategy.ANY, lease_seconds=DEFAULT_CHECKOUT_LEASE_SECONDS):
         if type(image_count) is not int:
             raise TypeError('image_count must be an integer')
+        if type(user_id) is not int:
+            raise TypeError('user id must be an integer')
+        if not isinstance(strategy, CheckoutStrategy):
+            raise TypeError('strategy must be an instance of CheckoutStrategy')
+        if type(lease_seconds) is not int or lease_seconds <= 0:
+            raise ArgumentException('lease_seconds must be a positive integer')
         checked_out_images = []
         try:
             conn = self._db_provider.get_connection()
             try:
                 cursor = conn.cursor()
-                query = ("with pl as ( "
-                        "SELECT p.*, ci.classificationname  "
-                        "FROM prediction_labels p "
-                        "join classification_info ci on ci.classificationid = p.classificationid "
-                        "WHERE trainingid = (select MAX(trainingid) From training_info) "
-                    ") "
-                    "select  "
-                        "its.imageid, "
-                        "i.imagelocation, "
-                        "pl.classificationid, "
-                        "pl.classificationname, "
-                        "pl.x_min, "
-                        "pl.x_max, "
-                        "pl.y_min, "
-                        "pl.y_max, "
-                        "i.height, "
-                        "i.width, "
-                        "pl.boxconfidence, "
-                        "pl.imageconfidence, "
-                        "ts.tagstatename "
-                    "from image_tagging_state its  "
-                    "left outer join pl on its.imageid = pl.imageid "
-                    "join image_info i on i.imageid = its.imageid "
-                    "join tag_state ts on ts.tagstateid = its.tagstateid "
-                    "where  "
-                        "its.tagstateid in ({1}) "
-                    "limit {0}")
-                cursor.execute(query.format(image_count, ImageTagState.READY_TO_TAG))
-
-                logging.debug("Got image tags back for image_count={0}".format(image_count))
-                # TODO: Optimize below two lines to simplify unique image ids, and improve the
-                # json output being returned, unflatten it
-                checked_out_images = list(cursor)
-                images_ids_to_update = list(set(row[0] for row in checked_out_images ))
-                self._update_images(images_ids_to_update, ImageTagState.TAG_IN_PROGRESS, user_id, conn)
+                checked_out_images = self._claim_images(cursor, image_count, user_id, strategy, lease_seconds)
+                claimed_count = len(set(row[0] for row in checked_out_images))
+                if strategy is not CheckoutStrategy.ANY and claimed_count < image_count:
+                    # Images without predictions from the latest training run are handed out once ranked ones run out
+                    checked_out_images += self._claim_images(cursor, image_count - claimed_count, user_id,
+                                                             CheckoutStrategy.ANY, lease_seconds)
+                conn.commit()
+                logging.debug("Checked out %s rows for image_count=%s", len(checked_out_images), image_count)
             finally:
                 cursor.close()
         except Exception as e:
@@ -286,20 +370,91 @@ class ImageTagDataAccess(object):
             conn.close()
         return checked_out_images
 
-
+    def _claim_images(self, cursor, image_count, user_id, strategy, lease_seconds):
+        # The ready state is inlined rather than bound, as in get_images_for_tagging, so generic plans
+        # can still use the partial index on ready images
+        ready = int(ImageTagState.READY_TO_TAG)
+        if strategy is CheckoutStrategy.ANY:
+            candidates = ("SELECT ImageId FROM Image_Tagging_State "
+                        "WHERE TagStateId = {0} "
+                        "LIMIT %s "
+                        "FOR UPDATE SKIP LOCKED").format(ready)
+            order_by = "c.imageid"
+        else:
+            # Walks the Latest_Predictions confidence index in order until enough ready images are found
+            direction = "ASC" if strategy is CheckoutStrategy.LOWEST_CONFIDENCE else "DESC"
+            candidates = ("SELECT its.ImageId FROM Latest_Predictions lp "
+                        "JOIN Image_Tagging_State its ON its.ImageId = lp.ImageId "
+                        "WHERE its.TagStateId = {0} "
+                        "ORDER BY lp.ImageConfidence {1}, lp.ImageId {1} "
+                        "LIMIT %s "
+                        "FOR UPDATE OF its SKIP LOCKED").format(ready, direction)
+            order_by = "pl.imageconfidence {0}, c.imageid".format(direction)
+
+        # Claims images atomically: candidate rows are locked with SKIP LOCKED so concurrent
+        # taggers never receive the same image, flipped to TAG_IN_PROGRESS, and returned
+        # together with the predictions of the run in Latest_Predictions in a single round trip.
+        query = ("with candidates as ( "
+                    "{0} "
+                "), "
+                "claimed as ( "
+                    "UPDATE Image_Tagging_State its "
+                    "SET TagStateId = %s, ModifiedByUser = %s, ModifiedDtim = now(), "
+                    "LeaseExpiresDtim = now() + %s::integer * interval '1 second' "
+                    "FROM candidates c "
+                    "WHERE its.ImageId = c.ImageId "
+                    "RETURNING its.ImageId, its.TagStateId "
+                "), "
+                "pl as ( "
+                    "SELECT p.*, ci.classificationname "
+                    "FROM claimed c "
+                    "join latest_predictions lp on lp.imageid = c.imageid "
+                    "join prediction_labels p on p.trainingid = lp.trainingid and p.imageid = lp.imageid "
+                    "join classification_info ci on ci.classificationid = p.classificationid "
+                ") "
+                "select "
+                    "c.imageid, "
+                    "i.imagelocation, "
+                    "pl.classificationid, "
+                    "pl.classificationname, "
+                    "pl.x_min, "
+                    "pl.x_max, "
+                    "pl.y_min, "
+                    "pl.y_max, "
+                    "i.height, "
+                    "i.width, "
+                    "pl.boxconfidence, "
+                    "pl.imageconfidence, "
+                    "ts.tagstatename "
+                "from claimed c "
+                "left outer join pl on c.imageid = pl.imageid "
+                "join image_info i on i.imageid = c.imageid "
+                "join tag_state ts on ts.tagstateid = c.tagstateid "
+                "order by {1}").format(candidates, order_by)
+        cursor.execute(query, (image_count, int(ImageTagState.TAG_IN_PROGRESS), user_id, lease_seconds))
+        return list(cursor)
+
+
+    @instrumented
     def get_existing_classifications(self):
+        cached = self.classification_cache.get_all()
+        if cached is not None:
+            logging.debug("Got %s classifications from the cache.", len(cached))
+            return sorted(cached)
         try:
             conn = self._db_provider.get_connection()
             try:
                 cursor = conn.cursor()
-                query = "SELECT classificationname from classification_info order by classificationname asc"
+                query = "SELECT classificationid, classificationname from classification_info order by classificationname asc"
                 cursor.execute(query)
 
-                classification_set = set()
+                class_to_id = {}
+                log_rows = logging.getLogger().isEnabledFor(logging.DEBUG)
                 for row in cursor:
-                    logging.debug(row)
-                    classification_set.add(row[0])
-                logging.debug("Got back {0} classifications existing in db.".format(len(classification_set)))
+                    if log_rows:
+                        logging.debug(row)
+                    class_to_id[row[1]] = int(row[0])
+                logging.debug("Got back %s classifications existing in db.", len(class_to_id))
             finally:
                 cursor.close()
         except Exception as e:
@@ -307,17 +462,200 @@ class ImageTagDataAccess(object):
             raise
         finally:
             conn.close()
-        return list(classification_set)
+        self.classification_cache.add(class_to_id, complete=True)
+        return list(class_to_id.keys())
 
+    @instrumented
     def update_incomplete_images(self, list_of_image_ids, user_id):
         #TODO: Make sure the image ids are in a TAG_IN_PROGRESS state
-        self._update_images(list_of_image_ids,ImageTagState.INCOMPLETE_TAG,user_id, self._db_provider.get_connection())
-        logging.debug("Updated {0} image(s) to the state {1}".format(len(list_of_image_ids),ImageTagState.INCOMPLETE_TAG.name))
+        conn = self._db_provider.get_connection()
+        try:
+            self._update_images(list_of_image_ids,ImageTagState.INCOMPLETE_TAG,user_id,conn)
+        finally: conn.close()
+        logging.debug("Updated %s image(s) to the state %s", len(list_of_image_ids),ImageTagState.INCOMPLETE_TAG.name)
 
+    @instrumented
     def update_completed_untagged_images(self,list_of_image_ids, user_id):
         #TODO: Make sure the image ids are in a TAG_IN_PROGRESS state
-        self._update_images(list_of_image_ids,ImageTagState.COMPLETED_TAG,user_id, self._db_provider.get_connection())
-        logging.debug("Updated {0} image(s) to the state {1}".format(len(list_of_image_ids),ImageTagState.COMPLETED_TAG.name))
+        conn = self._db_provider.get_connection()
+        try:
+            self._update_images(list_of_image_ids,ImageTagState.COMPLETED_TAG,user_id,conn)
+        finally: conn.close()
+        logging.debug("Updated %s image(s) to the state %s", len(list_of_image_ids),ImageTagState.COMPLETED_TAG.name)
+
+    # Moves images whose checkout lease has run out back to new_image_tag_state in one statement
+    # and returns how many were reclaimed. Images locked by an upload in flight are left alone.
+    @instrumented
+    def reclaim_expired_checkouts(self, user_id, new_image_tag_state=ImageTagState.READY_TO_TAG):
+        if new_image_tag_state not in (ImageTagState.READY_TO_TAG, ImageTagState.ABANDONED):
+            raise ArgumentException('expired checkouts can only be returned to READY_TO_TAG or ABANDONED')
+        if type(user_id) is not int:
+            raise TypeError('user id must be an integer')
+
+        # The state is inlined so the partial lease index can be used
+        query = ("WITH expired AS ( "
+                    "SELECT ImageId FROM Image_Tagging_State "
+                    "WHERE TagStateId = {0} AND LeaseExpiresDtim < now() "
+                    "FOR UPDATE SKIP LOCKED "
+                "), "
+                "reclaimed AS ( "
+                    "UPDATE Image_Tagging_State s "
+                    "SET TagStateId = %s, ModifiedByUser = %s, ModifiedDtim = now(), LeaseExpiresDtim = NULL "
+                    "FROM expired e WHERE s.ImageId = e.ImageId "
+                    "RETURNING s.ImageId "
+                ") "
+                "SELECT count(*) FROM reclaimed").format(int(ImageTagState.TAG_IN_PROGRESS))
+        reclaimed_count = 0
+        conn = self._db_provider.get_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, (int(new_image_tag_state), user_id))
+                reclaimed_count = cursor.fetchone()[0]
+                conn.commit()
+            finally: cursor.close()
+        except Exception as e:
+            logging.error("An error occurred reclaiming expired checkouts: {0}".format(e))
+            raise
+        finally:
+            conn.close()
+        logging.debug("Reclaimed %s expired checkouts to the state %s", reclaimed_count, new_image_tag_state.name)
+        return reclaimed_count
+
+    @instrumented
+    def create_onboarding_job(self, storage_account, storage_container, user_id):
+        if not storage_account or not storage_container:
+            raise ArgumentException("storage account and container cannot be empty")
+        if type(user_id) is not int:
+            raise TypeError('user id must be an integer')
+
+        job_id = None
+        conn = self._db_provider.get_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                query = ("INSERT INTO Onboarding_Job (StorageAccount, StorageContainer, Status, CreatedByUser) "
+                         "VALUES (%s, %s, %s, %s) RETURNING JobId")
+                cursor.execute(query, (storage_account, storage_container, OnboardingJobStatus.RUNNING.value, user_id))
+                job_id = cursor.fetchone()[0]
+                conn.commit()
+            finally: cursor.close()
+        except Exception as e:
+            logging.error("An error occurred creating an onboarding job: {0}".format(e))
+            raise
+        finally:
+            conn.close()
+        return job_id
+
+    # Returns the job as a dictionary, or None when there is no job with that id
+    @instrumented
+    def get_onboarding_job(self, job_id):
+        if type(job_id) is not int:
+            raise TypeError('job id must be an integer')
+
+        job = None
+        conn = self._db_provider.get_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(ONBOARDING_JOB_QUERY, (job_id,))
+                job = _onboarding_job_from_row(cursor.fetchone())
+            finally: cursor.close()
+        except Exception as e:
+            logging.error("An error occurred getting onboarding job {0}: {1}".format(job_id, e))
+            raise
+        finally:
+            conn.close()
+        return job
+
+    # Lists page number page of a running job with the job's row locked, so two deliveries of the same page
+    # message cannot both list it. list_page(job) is called while the lock is held and returns
+    # (next_marker, blobs_listed, images_queued), which are checkpointed in the same transaction. The job is
+    # completed when there is no next marker. Returns False, without calling list_page, when the page was
+    # already listed or the job is not running.
+    @instrumented
+    def list_onboarding_job_page(self, job_id, page, list_page):
+        if type(job_id) is not int:
+            raise TypeError('job id must be an integer')
+
+        listed = False
+        conn = self._db_provider.get_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(ONBOARDING_JOB_QUERY + " FOR UPDATE", (job_id,))
+                job = _onboarding_job_from_row(cursor.fetchone())
+                if job and job["status"] == OnboardingJobStatus.RUNNING.value and job["pages_listed"] == page:
+                    next_marker, blobs_listed, images_queued = list_page(job)
+                    status = OnboardingJobStatus.RUNNING if next_marker else OnboardingJobStatus.COMPLETED
+                    query = ("UPDATE Onboarding_Job SET NextMarker = %s, Status = %s, PagesListed = PagesListed + 1, "
+                             "BlobsListed = BlobsListed + %s, ImagesQueued = ImagesQueued + %s, ErrorMessage = NULL, "
+                             "ModifiedDtim = now() "
+                             "WHERE JobId = %s")
+                    cursor.execute(query, (next_marker or None, status.value, blobs_listed, images_queued, job_id))
+                    listed = True
+                conn.commit()
+            finally: cursor.close()
+        except Exception as e:
+            logging.error("An error occurred listing page {0} of onboarding job {1}: {2}".format(page, job_id, e))
+            raise
+        finally:
+            conn.close()
+        return listed
+
+    # Sets a failed job running again. Returns the page to list next, or None when the job is not failed.
+    @instrumented
+    def resume_onboarding_job(self, job_id):
+        if type(job_id) is not int:
+            raise TypeError('job id must be an integer')
+
+        page = None
+        conn = self._db_provider.get_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                query = ("UPDATE Onboarding_Job SET Status = %s, ErrorMessage = NULL, ModifiedDtim = now() "
+                         "WHERE JobId = %s AND Status = %s "
+                         "RETURNING PagesListed")
+                cursor.execute(query, (OnboardingJobStatus.RUNNING.value, job_id, OnboardingJobStatus.FAILED.value))
+                row = cursor.fetchone()
+                page = row[0] if row else None
+                conn.commit()
+            finally: cursor.close()
+        except Exception as e:
+            logging.error("An error occurred resuming onboarding job {0}: {1}".format(job_id, e))
+            raise
+        finally:
+            conn.close()
+        return page
+
+    # Records error_message as the last error of a running job, failing it when status is FAILED.
+    # Returns False when the job is not running or does not exist.
+    @instrumented
+    def set_onboarding_job_status(self, job_id, status, error_message=None):
+        if type(job_id) is not int:
+            raise TypeError('job id must be an integer')
+        if status not in (OnboardingJobStatus.RUNNING, OnboardingJobStatus.FAILED):
+            raise ArgumentException('a job can only be set to RUNNING or FAILED')
+
+        updated = False
+        conn = self._db_provider.get_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                query = ("UPDATE Onboarding_Job SET Status = %s, ErrorMessage = %s, ModifiedDtim = now() "
+                         "WHERE JobId = %s AND Status = %s "
+                         "RETURNING JobId")
+                cursor.execute(query, (status.value, error_message, job_id, OnboardingJobStatus.RUNNING.value))
+                updated = cursor.fetchone() is not None
+                conn.commit()
+            finally: cursor.close()
+        except Exception as e:
+            logging.error("An error occurred updating onboarding job {0}: {1}".format(job_id, e))
+            raise
+        finally:
+            conn.close()
+        return updated
 
     def _update_images(self, list_of_image_ids, new_image_tag_state, user_id, conn):
         if not isinstance(new_image_tag_state, ImageTagState):
@@ -326,18 +664,19 @@ class ImageTagDataAccess(object):
         if type(user_id) is not int:
             raise TypeError('user id must be an integer')
 
-        if not conn:
+        owns_connection = not conn
+        if owns_connection:
             conn = self._db_provider.get_connection()
 
         try:
             if(len(list_of_image_ids) > 0):
                 cursor = conn.cursor()
                 try:
-                    image_ids_as_strings = [str(i) for i in list_of_image_ids]
-                    images_to_update = '{0}'.format(', '.join(image_ids_as_strings))
-                    # TODO: find another way to do string subsitution that doesn't break this query
-                    query = "UPDATE Image_Tagging_State SET TagStateId = {0}, ModifiedByUser = {2}, ModifiedDtim = now() WHERE ImageId IN ({1})"
-                    cursor.execute(query.format(new_image_tag_state,images_to_update,user_id))
+                    # Images moved into TAG_IN_PROGRESS get a lease, moving to any other state clears it
+                    lease_seconds = DEFAULT_CHECKOUT_LEASE_SECONDS if new_image_tag_state == ImageTagState.TAG_IN_PROGRESS else None
+                    query = ("UPDATE Image_Tagging_State SET TagStateId = %s, ModifiedByUser = %s, ModifiedDtim = now(), "
+                             "LeaseExpiresDtim = now() + %s::integer * interval '1 second' WHERE ImageId = ANY(%s)")
+                    cursor.execute(query, (int(new_image_tag_state), user_id, lease_seconds, [int(i) for i in list_of_image_ids]))
                     conn.commit()
                 finally: cursor.close()
             else:
@@ -345,31 +684,47 @@ class ImageTagDataAccess(object):
         except Exception as e:
             logging.error("An errors occured updating images: {0}".format(e))
             raise
+        finally:
+            if owns_connection: conn.close()
 
+    # Moves images to their new locations and marks them ready to tag in one statement.
+    # Returns the ids of the images that were updated, ids missing from Image_Info are skipped.
+    @instrumented
     def update_image_urls(self,image_id_to_url_map, user_id):
         if type(user_id) is not int:
             raise TypeError('user id must be an integer')
 
+        updated_image_ids = []
         if(len(image_id_to_url_map.items())):
             try:
                 conn = self._db_provider.get_connection()
                 try:
                     cursor = conn.cursor()
-                    for image_id, new_url in image_id_to_url_map.items():
-                        cursor = conn.cursor()
-                        query = "UPDATE Image_Info SET ImageLocation = '{0}', ModifiedDtim = now() WHERE ImageId = {1}"
-                        cursor.execute(query.format(new_url,image_id))
-                        conn.commit()
-                        logging.debug("Updated ImageId: {0} to new ImageLocation: {1}".format(image_id,new_url))
-                        self._update_images([image_id],ImageTagState.READY_TO_TAG, user_id,conn)
-                        logging.debug("ImageId: {0} to has a new state: {1}".format(image_id,ImageTagState.READY_TO_TAG.name))
+                    query = ("WITH urls AS ( "
+                                "SELECT * FROM unnest(%s::integer[], %s::text[]) AS u(ImageId, ImageLocation) "
+                            "), moved AS ( "
+                                "UPDATE Image_Info i SET ImageLocation = urls.ImageLocation, ModifiedDtim = now() "
+                                "FROM urls WHERE i.ImageId = urls.ImageId "
+                                "RETURNING i.ImageId "
+                            ") "
+                            "UPDATE Image_Tagging_State s SET TagStateId = %s, ModifiedByUser = %s, ModifiedDtim = now() "
+                            "FROM moved WHERE s.ImageId = moved.ImageId "
+                            "RETURNING s.ImageId")
+                    image_ids = list(image_id_to_url_map.keys())
+                    cursor.execute(query, (image_ids, [image_id_to_url_map[i] for i in image_ids],
+                                           int(ImageTagState.READY_TO_TAG), user_id))
+                    updated_image_ids = [row[0] for row in cursor.fetchall()]
+                    conn.commit()
+                    logging.debug("Updated ImageLocation and set %s images to %s", len(updated_image_ids),
+                                  ImageTagState.READY_TO_TAG.name)
                 finally: cursor.close()
             except Exception as e:
                 logging.error("An errors occured updating image urls: {0}".format(e))
                 raise
             finally: conn.close()
+        return updated_image_ids
 
-    #TODO: Do safer query string formatting
+    @instrumented
     def update_tagged_images(self,list_of_image_tags, user_id):
         if(not list_of_image_tags):
             return
@@ -386,27 +741,38 @@ class ImageTagDataAccess(object):
                     for img_tag in list(list_of_tags):
                         query = ("with iti AS ( "
                                 "INSERT INTO image_tags (ImageId, X_Min,X_Max,Y_Min,Y_Max,CreatedByUser) "
-                                "VALUES ({0},{1},{2},{3},{4},{5}) "
+                                "VALUES (%s,%s,%s,%s,%s,%s) "
                                 "RETURNING ImageTagId), "
                                 "ci AS ( "
                                     "INSERT INTO classification_info (ClassificationName) "
-                                    "VALUES {6} "
+                                    "SELECT unnest(%s::text[]) "
                                     "ON CONFLICT (ClassificationName) DO UPDATE SET ClassificationName=EXCLUDED.ClassificationName "
                                     "RETURNING (SELECT iti.ImageTagId FROM iti), ClassificationId) "
                                 "INSERT INTO tags_classification (ImageTagId,ClassificationId) "
                                 "SELECT imagetagid,classificationid from ci;")
-                        classifications = ", ".join("('{0}')".format(name) for name in img_tag.classification_names)
-                        cursor.execute(query.format(img_tag.image_id,img_tag.x_min,img_tag.x_max,img_tag.y_min,img_tag.y_max,user_id,classifications))
+                        cursor.execute(query,(img_tag.image_id,img_tag.x_min,img_tag.x_max,img_tag.y_min,img_tag.y_max,user_id,
+                                              list(img_tag.classification_names)))
                     self._update_images([img_id],ImageTagState.COMPLETED_TAG,user_id,conn)
                     conn.commit()
-                logging.debug("Updated {0} image tags".format(len(list_of_image_tags)))
+                logging.debug("Updated %s image tags", len(list_of_image_tags))
             finally: cursor.close()
         except Exception as e:
             logging.error("An errors occured updating tagged image: {0}".format(e))
             raise
         finally: conn.close()
 
+    # Only names missing from the classification cache are looked up, and created if they are new
+    @instrumented
     def get_classification_map(self, class_names: set, user_id: int) -> dict:
+        class_to_id, missing_class_names = self.classification_cache.get(class_names)
+        if not missing_class_names:
+            return class_to_id
+        fetched_class_to_id = self._upsert_classifications(missing_class_names)
+        self.classification_cache.add(fetched_class_to_id)
+        class_to_id.update(fetched_class_to_id)
+        return class_to_id
+
+    def _upsert_classifications(self, class_names):
         class_to_id = {}
         try:
             conn = self._db_provider.get_connection()
@@ -414,8 +780,8 @@ class ImageTagDataAccess(object):
                 cursor = conn.cursor()
                 query = ("WITH sc AS ( "
                         "SELECT classificationid, classificationname FROM classification_info "
-                        "WHERE classificationname in ({0})), "
-                        "data(class_name) AS (values {1}), "
+                        "WHERE classificationname = ANY(%s::citext[])), "
+                        "data(class_name) AS (SELECT unnest(%s::text[])), "
                         "ci AS ( "
                             "INSERT INTO classification_info (ClassificationName) "
                             "SELECT d.class_name FROM data d "
@@ -424,13 +790,13 @@ class ImageTagDataAccess(object):
                         "SELECT classificationid,classificationname FROM ci  "
                         "UNION ALL "
                         "SELECT classificationid,classificationname FROM sc")
-                class_names_where = "'{0}'".format("', '".join(class_names))
-                class_names_value = ", ".join("('{0}')".format(class_name) for class_name in class_names)
-                query = query.format(class_names_where,class_names_value)
-                cursor.execute(query)
+                class_names = list(class_names)
+                cursor.execute(query, (class_names, class_names))
                 conn.commit()
+                log_rows = logging.getLogger().isEnabledFor(logging.DEBUG)
                 for row in cursor:
-                    logging.debug(row)
+                    if log_rows:
+                        logging.debug(row)
                     class_to_id[row[1]] = int(row[0])
             finally: cursor.close()
         except Exception as e:
@@ -439,7 +805,8 @@ class ImageTagDataAccess(object):
         finally: conn.close()
         return class_to_id
 
-    def update_tagged_images_v2(self, annotated_labels: list, user_id: int):
+    @instrumented
+    def update_tagged_images_v2(self, annotated_labels: list, user_id: int, bulk_load: bool = None):
         if(not annotated_labels):
             return
 
@@ -447,22 +814,33 @@ class ImageTagDataAccess(object):
             raise TypeError('user id must be an integer')
 
         labels_length = len(annotated_labels)
+        if bulk_load is None:
+            bulk_load = labels_length >= BULK_LOAD_THRESHOLD
         all_image_ids = list(l.image_id for l in annotated_labels)
         try:
             conn = self._db_provider.get_connection()
             try:
                 cursor = conn.cursor()
-                query = "INSERT INTO Annotated_Labels(ImageId,ClassificationId,X_Min,X_Max,Y_Min,Y_Max,CreatedByUser) VALUES "
-                #Build query so we can insert all rows at once
-                for i in range(labels_length):
-                    label = annotated_labels[i]
-                    query+="({0},{1},{2},{3},{4},{5},{6}) ".format(label.image_id,label.classification_id,
-                                                            label.x_min,label.x_max,label.y_min,label.y_max,user_id)
-                    if i != labels_length-1: query+=","
-                cursor.execute(query)
+                if bulk_load:
+                    rows = ((label.image_id,label.classification_id,label.x_min,label.x_max,
+                             label.y_min,label.y_max,user_id) for label in annotated_labels)
+                    _copy_rows(cursor, "COPY Annotated_Labels(ImageId,ClassificationId,X_Min,X_Max,Y_Min,Y_Max,CreatedByUser) "
+                                       "FROM STDIN WITH (FORMAT csv)", rows)
+                else:
+                    # Insert all rows at once from one array per column
+                    query = ("INSERT INTO Annotated_Labels(ImageId,ClassificationId,X_Min,X_Max,Y_Min,Y_Max,CreatedByUser) "
+                             "SELECT *, %s FROM unnest(%s::integer[], %s::integer[], %s::numeric[], %s::numeric[], "
+                             "%s::numeric[], %s::numeric[])")
+                    cursor.execute(query, (user_id,
+                                           [l.image_id for l in annotated_labels],
+                                           [l.classification_id for l in annotated_labels],
+                                           _numeric_array(l.x_min for l in annotated_labels),
+                                           _numeric_array(l.x_max for l in annotated_labels),
+                                           _numeric_array(l.y_min for l in annotated_labels),
+                                           _numeric_array(l.y_max for l in annotated_labels)))
                 self._update_images(all_image_ids,ImageTagState.COMPLETED_TAG,user_id,conn)
                 conn.commit()
-            #logging.debug("Updated status for {0} images".format(len(all_image_ids)))
+            #logging.debug("Updated status for %s images", len(all_image_ids))
             finally: cursor.close()
         except Exception as e:
             logging.error("An errors occured updating tagged image: {0}".format(e))
@@ -477,7 +855,10 @@ class ImageTagDataAccess(object):
                                         img_tag.x_min,img_tag.x_max,img_tag.y_min,img_tag.y_max))
         return annotated_labels
 
-    def add_prediction_labels(self, prediction_labels: list, training_id: int):
+    # Callers storing a run in several batches can skip refreshing Latest_Predictions on all but the last one
+    @instrumented
+    def add_prediction_labels(self, prediction_labels: list, training_id: int, bulk_load: bool = None,
+                              refresh_latest_predictions: bool = True):
         if(not prediction_labels):
             return
 
@@ -485,22 +866,42 @@ class ImageTagDataAccess(object):
             raise TypeError('training id must be an integer')
 
         labels_length = len(prediction_labels)
+        if bulk_load is None:
+            bulk_load = labels_length >= BULK_LOAD_THRESHOLD
         try:
             conn = self._db_provider.get_connection()
             try:
                 cursor = conn.cursor()
-                query = "INSERT INTO Prediction_Labels(TrainingId,ImageId,ClassificationId,X_Min,X_Max,Y_Min,Y_Max,BoxConfidence,ImageConfidence) VALUES "
-                #Build query so we can insert all rows at once
-                for i in range(labels_length):
-                    label = prediction_labels[i]
-                    query+="({0},{1},{2},{3},{4},{5},{6},{7},{8}) ".format(training_id,label.image_id,label.classification_id,
-                                                                    label.x_min,label.x_max,label.y_min,label.y_max,
-                                                                    label.box_confidence,label.image_confidence)
-                    if i != labels_length-1: query+=","
-                cursor.execute(query)
+                # Prediction_Labels has a partition per training run. Creating it locks the parent table,
+                # so that happens in its own short transaction rather than while the labels are loaded.
+                cursor.execute("SELECT create_prediction_labels_partition(%s)", (training_id,))
+                conn.commit()
+                if bulk_load:
+                    rows = ((training_id,label.image_id,label.classification_id,label.x_min,label.x_max,label.y_min,
+                             label.y_max,label.box_confidence,label.image_confidence) for label in prediction_labels)
+                    _copy_rows(cursor, "COPY Prediction_Labels(TrainingId,ImageId,ClassificationId,X_Min,X_Max,Y_Min,Y_Max,"
+                                       "BoxConfidence,ImageConfidence) FROM STDIN WITH (FORMAT csv)", rows)
+                else:
+                    # Insert all rows at once from one array per column
+                    query = ("INSERT INTO Prediction_Labels(TrainingId,ImageId,ClassificationId,X_Min,X_Max,Y_Min,Y_Max,BoxConfidence,ImageConfidence) "
+                             "SELECT %s, * FROM unnest(%s::integer[], %s::integer[], %s::numeric[], %s::numeric[], "
+                             "%s::numeric[], %s::numeric[], %s::numeric[], %s::numeric[])")
+                    cursor.execute(query, (training_id,
+                                           [l.image_id for l in prediction_labels],
+                                           [l.classification_id for l in prediction_labels],
+                                           _numeric_array(l.x_min for l in prediction_labels),
+                                           _numeric_array(l.x_max for l in prediction_labels),
+                                           _numeric_array(l.y_min for l in prediction_labels),
+                                           _numeric_array(l.y_max for l in prediction_labels),
+                                           _numeric_array(l.box_confidence for l in prediction_labels),
+                                           _numeric_array(l.image_confidence for l in prediction_labels)))
                 #TODO: Update some sort of training status table?
                 #self._update_training_status(training_id,conn)
                 conn.commit()
+                if refresh_latest_predictions:
+                    # CONCURRENTLY keeps checkout reading the previous run while the view is rebuilt
+                    cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY Latest_Predictions")
+                    conn.commit()
             # logging.debug('Inserted {0} predictions for training session {1}'.format(labels_length, training_id))
             finally: cursor.close()
         except Exception as e:
@@ -511,42 +912,189 @@ class ImageTagDataAccess(object):
     # In practice we won't be getting multiple class names per bounding box however
     # VOTT supports this. If multple class names per boounding box is common we can get more 
     # efficient with the nesting to avoid dupe bounding boxes per image
-    def get_labels(self):        
-        id_to_imagelabels = {}
-        conn = None
+    def get_labels(self):
+        labels = list(self.iter_labels())
+        logging.debug("Found labels for %s images", len(labels))
+        return labels
+
+    # Annotated labels are only ever appended, so the largest ImageTagId works as a high-water mark as
+    # long as no label with a lower id is still to be committed. Ids are drawn when a row is inserted but
+    # only seen once its transaction commits, so an upload holding lower ids that commits after MAX is read
+    # would be skipped by every later since= call. SHARE mode conflicts with the ROW EXCLUSIVE lock each
+    # INSERT and COPY takes: taking it waits for label writes in flight to commit and holds new ones, which
+    # draw higher ids, back until MAX has been read.
+    @instrumented
+    def get_last_image_tag_id(self):
+        conn = self._db_provider.get_connection()
         try:
-            conn = self._db_provider.get_connection()
+            cursor = conn.cursor()
             try:
-                cursor = conn.cursor()
-                query = ("SELECT d.imageid, d.imagelocation, d.height, d.width, "
+                cursor.execute("SET LOCAL lock_timeout = {0}".format(int(LABELS_CURSOR_LOCK_TIMEOUT_MS)))
+                cursor.execute("LOCK TABLE Annotated_Labels IN SHARE MODE")
+                cursor.execute("SELECT COALESCE(MAX(ImageTagId), 0) FROM Annotated_Labels")
+                last_image_tag_id = cursor.fetchone()[0]
+                conn.commit()
+                return last_image_tag_id
+            finally:
+                cursor.close()
+        except Exception as e:
+            logging.error("An error occurred getting the last image tag id: {0}".format(e))
+            raise
+        finally:
+            conn.close()
+
+    # Returns every label of the images that were tagged after image_tag_id, along with the
+    # high-water mark to pass on the next call. Images are returned whole so callers can
+    # replace what they have cached for them.
+    def get_labels_since(self, image_tag_id: int):
+        if type(image_tag_id) is not int:
+            raise TypeError('image tag id must be an integer')
+        last_image_tag_id = self.get_last_image_tag_id()
+        labels = list(self.iter_labels(since=image_tag_id, until=last_image_tag_id))
+        logging.debug("Found labels for %s images tagged after %s", len(labels), image_tag_id)
+        return labels, last_image_tag_id
+
+    # Yields one ImageLabel per image without holding the whole label set in memory.
+    # pg8000 has no named cursors, so the server side cursor is declared in SQL and read
+    # fetch_size rows at a time. Rows come back in image id order so each image can be
+    # yielded as soon as its last label has been read.
+    # since and until are ImageTagId bounds: only images with a label after since are
+    # returned, and only their labels up to until.
+    @instrumented
+    def iter_labels(self, fetch_size=LABELS_FETCH_SIZE, since=None, until=None):
+        if type(fetch_size) is not int or fetch_size <= 0:
+            raise ArgumentException("fetch_size must be a positive integer")
+        conditions = []
+        args = []
+        if since is not None:
+            conditions.append("a.imageid IN (SELECT ImageId FROM Annotated_Labels WHERE ImageTagId > %s)")
+            args.append(since)
+        if until is not None:
+            conditions.append("a.ImageTagId <= %s")
+            args.append(until)
+        conn = self._db_provider.get_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                query = ("DECLARE labels_cursor NO SCROLL CURSOR FOR "
+                         "SELECT d.imageid, d.imagelocation, d.height, d.width, "
                          "c.classificationname, x_min, x_max, y_min, y_max "
                             "FROM Annotated_Labels a "
                                 "inner join classification_info c on a.classificationid = c.classificationid "
-                                "inner join image_info d on d.imageid = a.imageid ")
-                cursor.execute(query)
-                for row in cursor:
-                    image_id = row[0]
-                    tag = Tag(row[4],float(row[5]),float(row[6]),float(row[7]),float(row[8]))
-                    if image_id in id_to_imagelabels:                  
-                        id_to_imagelabels[image_id].labels.append(tag)
-                    else:
-                        img_label = ImageLabel(image_id,row[1],row[2],row[3],[tag])
-                        id_to_imagelabels[image_id] = img_label
-                
-                logging.debug("Found labels for {0} images".format(len(id_to_imagelabels)))       
+                                "inner join image_info d on d.imageid = a.imageid "
+                            + ("WHERE " + " AND ".join(conditions) + " " if conditions else "") +
+                            "ORDER BY a.imageid")
+                if args:
+                    cursor.execute(query, tuple(args))
+                else:
+                    cursor.execute(query)
+                img_label = None
+                while True:
+                    cursor.execute("FETCH {0} FROM labels_cursor".format(fetch_size))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    for row in rows:
+                        tag = Tag(row[4],float(row[5]),float(row[6]),float(row[7]),float(row[8]))
+                        if img_label is not None and img_label.image_id == row[0]:
+                            img_label.labels.append(tag)
+                        else:
+                            if img_label is not None:
+                                yield img_label
+                            img_label = ImageLabel(row[0],row[1],row[2],row[3],[tag])
+                if img_label is not None:
+                    yield img_label
+                cursor.execute("CLOSE labels_cursor")
             finally:
                 cursor.close()
         except Exception as e:
             logging.error("An error occurred getting labels: {0}".format(e))
             raise
         finally:
+            # The cursor only lives as long as the transaction, closing the connection ends both
             conn.close()
-        return list(id_to_imagelabels.values())
 
 class ArgumentException(Exception):
     pass
 
 
+# Bound arrays must hold a single type, so mixed ints and floats are all sent as floats and cast to numeric
+ONBOARDING_JOB_QUERY = ("SELECT JobId, StorageAccount, StorageContainer, Status, NextMarker, PagesListed, BlobsListed, "
+                        "ImagesQueued, ErrorMessage, CreatedByUser, CreatedDtim, ModifiedDtim "
+                        "FROM Onboarding_Job WHERE JobId = %s")
+
+def _onboarding_job_from_row(row):
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "storage_account": row[1],
+        "storage_container": row[2],
+        "status": row[3],
+        "next_marker": row[4],
+        "pages_listed": row[5],
+        "blobs_listed": row[6],
+        "images_queued": row[7],
+        "error": row[8],
+        "created_by_user": row[9],
+        "created": row[10],
+        "modified": row[11]
+    }
+
+def _numeric_array(values):
+    return [None if v is None else float(v) for v in values]
+
+# Streams rows into a COPY ... FROM STDIN statement as CSV. Rows are sent in chunks of
+# chunk_size so memory stays bounded no matter how many rows the iterable yields.
+def _copy_rows(cursor, copy_query, rows, chunk_size=BULK_LOAD_CHUNK_SIZE):
+    rows = iter(rows)
+    rows_copied = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)
+        cursor.execute(copy_query, stream=io.BytesIO(buffer.getvalue().encode('utf-8')))
+        rows_copied += len(chunk)
+        logging.debug("Copied %s rows", rows_copied)
+    return rows_copied
+
+# Regroups checkout_images rows, one per prediction box with the image columns repeated on each,
+# into columns: each image once, then the boxes of every image as parallel arrays in image order,
+# box_count of them per image. Class names are sent once in a classification id to name dictionary
+# and numeric columns become floats so the result can be passed straight to json.dumps. Every
+# checked out image is in TAG_IN_PROGRESS so the tag state column is left out.
+def to_columnar_checkout(checked_out_images):
+    images = {"id": [], "location": [], "height": [], "width": [], "image_confidence": [], "box_count": []}
+    boxes = {"class_id": [], "x_min": [], "x_max": [], "y_min": [], "y_max": [], "confidence": []}
+    classes = {}
+    # Ranked checkouts order rows by box confidence, so the rows of an image are brought together
+    # in the order the images first appear
+    first_seen = {}
+    for row in checked_out_images:
+        first_seen.setdefault(row[0], len(first_seen))
+    for row in sorted(checked_out_images, key=lambda row: first_seen[row[0]]):
+        if not images["id"] or images["id"][-1] != row[0]:
+            images["id"].append(row[0])
+            images["location"].append(row[1])
+            images["height"].append(row[8])
+            images["width"].append(row[9])
+            images["image_confidence"].append(None if row[11] is None else float(row[11]))
+            images["box_count"].append(0)
+        # Images without predictions come back once with empty prediction columns
+        if row[2] is not None:
+            classes[row[2]] = row[3]
+            boxes["class_id"].append(row[2])
+            boxes["x_min"].append(float(row[4]))
+            boxes["x_max"].append(float(row[5]))
+            boxes["y_min"].append(float(row[6]))
+            boxes["y_max"].append(float(row[7]))
+            boxes["confidence"].append(float(row[10]))
+            images["box_count"][-1] += 1
+    return {"images": images, "boxes": boxes, "classes": classes}
+
+
 def main():
     #################################################################
     # This main method is an example of how to use some of
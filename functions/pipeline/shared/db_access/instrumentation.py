@@ -0,0 +1,148 @@
+import os
+import time
+import logging
+import functools
+import threading
+import types
+
+# Calls slower than this are logged as warnings whatever exporter is configured
+DEFAULT_SLOW_QUERY_MS = 1000
+
+# Receives one record per data access call and any custom metrics. Exporters decide where the
+# numbers go; counting bytes walks every returned value so only exporters that report it ask for it.
+class NoOpExporter(object):
+    records_bytes = False
+
+    def export(self, method_name, duration_ms, rows, bytes_returned, success):
+        pass
+
+    def track_metric(self, name, value):
+        pass
+
+# Reports each call as an Application Insights dependency of type PostgreSQL, so DB time shows
+# up in the application map and end to end transaction views next to the function invocation.
+# telemetry_client is an applicationinsights TelemetryClient or anything with the same
+# track_dependency signature. Without one the records are logged, which the Functions host
+# forwards to Application Insights as traces.
+class AppInsightsExporter(object):
+    records_bytes = True
+
+    def __init__(self, telemetry_client=None):
+        self._telemetry_client = telemetry_client
+
+    def export(self, method_name, duration_ms, rows, bytes_returned, success):
+        properties = {"rows": str(rows), "bytes": str(bytes_returned)}
+        if self._telemetry_client is not None:
+            self._telemetry_client.track_dependency(method_name, method_name, type="PostgreSQL",
+                                                    duration=int(duration_ms), success=success,
+                                                    properties=properties)
+        else:
+            logging.info("Dependency PostgreSQL %s took %.1f ms, returned %s rows and %s bytes, success=%s",
+                         method_name, duration_ms, rows, bytes_returned, success)
+
+    # Custom metrics such as the number of reclaimed checkouts
+    def track_metric(self, name, value):
+        if self._telemetry_client is not None:
+            self._telemetry_client.track_metric(name, value)
+            self._telemetry_client.flush()
+        else:
+            logging.info("Metric %s: %s", name, value)
+
+class Instrumentation(object):
+    def __init__(self, exporter=None, slow_query_ms=DEFAULT_SLOW_QUERY_MS, clock=time.perf_counter):
+        self.exporter = exporter or NoOpExporter()
+        self.slow_query_ms = slow_query_ms
+        self._clock = clock
+
+    def record(self, method_name, started, rows, bytes_returned, success):
+        duration_ms = (self._clock() - started) * 1000
+        if duration_ms >= self.slow_query_ms:
+            logging.warning("Slow data access call %s took %.1f ms and returned %s rows", method_name, duration_ms, rows)
+        try:
+            self.exporter.export(method_name, duration_ms, rows, bytes_returned, success)
+        except Exception as e:
+            # Telemetry must never fail the call it measures
+            logging.debug("Failed to export metrics for %s: %s", method_name, e)
+
+__instrumentation = None
+__instrumentation_lock = threading.Lock()
+
+def get_instrumentation():
+    # Shared by every data access object in the worker. Application Insights is used when the
+    # function app has an instrumentation key, otherwise nothing is exported.
+    global __instrumentation
+    with __instrumentation_lock:
+        if __instrumentation is None:
+            __instrumentation = Instrumentation(__get_exporter_from_env(),
+                                                float(os.getenv('DB_SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)))
+    return __instrumentation
+
+def __get_exporter_from_env():
+    instrumentation_key = os.getenv('APPINSIGHTS_INSTRUMENTATIONKEY')
+    if not instrumentation_key or os.getenv('DB_INSTRUMENTATION', '').lower() == 'none':
+        return NoOpExporter()
+    try:
+        from applicationinsights import TelemetryClient
+        return AppInsightsExporter(TelemetryClient(instrumentation_key))
+    except ImportError:
+        return AppInsightsExporter()
+
+# Times a data access method and reports what it returned. Generators are timed until they are
+# exhausted or closed since that is when their database work is done.
+def instrumented(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = self.instrumentation
+        started = instrumentation._clock()
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception:
+            instrumentation.record(method.__name__, started, 0, None, False)
+            raise
+        if isinstance(result, types.GeneratorType):
+            return _instrumented_generator(instrumentation, method.__name__, started, result)
+        bytes_returned = estimate_bytes(result) if instrumentation.exporter.records_bytes else None
+        instrumentation.record(method.__name__, started, count_rows(result), bytes_returned, True)
+        return result
+    return wrapper
+
+def _instrumented_generator(instrumentation, method_name, started, generator):
+    rows = 0
+    bytes_returned = 0 if instrumentation.exporter.records_bytes else None
+    success = False
+    try:
+        for item in generator:
+            rows += 1
+            if bytes_returned is not None:
+                bytes_returned += estimate_bytes(item)
+            yield item
+        success = True
+    finally:
+        generator.close()
+        instrumentation.record(method_name, started, rows, bytes_returned, success)
+
+def count_rows(result):
+    if result is None:
+        return 0
+    # Paged methods return (rows, next key)
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], (list, dict)):
+        return len(result[0])
+    if isinstance(result, (list, dict, set)):
+        return len(result)
+    return 1
+
+# Rough size of the values a call handed back, not the bytes on the wire
+def estimate_bytes(value):
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (int, float)):
+        return 8
+    if isinstance(value, dict):
+        return sum(estimate_bytes(k) + estimate_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sum(estimate_bytes(v) for v in value)
+    if hasattr(value, '__dict__'):
+        return estimate_bytes(vars(value))
+    return 8
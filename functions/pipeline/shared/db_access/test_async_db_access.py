@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from .async_db_access import AsyncImageTagDataAccess, get_db_executor
+from .classification_cache import ClassificationCache
+from .db_access_v2 import ImageTag
+from .test_db_access_v2 import RecordingCursor, RecordingDBProvider
+
+# Every statement waits at a barrier until the other caller arrives, so the calls
+# only finish if they run on separate threads at the same time
+class BarrierCursor(RecordingCursor):
+    def __init__(self, barrier, rows):
+        super().__init__(rows)
+        self.barrier = barrier
+
+    def execute(self, query, args=None, stream=None):
+        self.barrier.wait(timeout=5)
+        super().execute(query, args, stream)
+
+class BarrierDBProvider(RecordingDBProvider):
+    max_size = 2
+
+    def __init__(self, rows):
+        super().__init__(rows)
+        self.barrier = threading.Barrier(2)
+        self.connection.recording_cursor = BarrierCursor(self.barrier, rows)
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+class TestAsyncImageTagDataAccess(unittest.TestCase):
+    def test_independent_calls_run_concurrently(self):
+        provider = BarrierDBProvider([(1, "cat")])
+        data_access = AsyncImageTagDataAccess(provider, ClassificationCache(),
+                                              executor=ThreadPoolExecutor(max_workers=2))
+
+        async def download():
+            return await asyncio.gather(data_access.get_existing_classifications(),
+                                        data_access.reclaim_expired_checkouts(9))
+
+        classifications, reclaimed_count = run(download())
+        self.assertEqual(["cat"], classifications)
+        self.assertEqual(1, reclaimed_count)
+        self.assertFalse(provider.barrier.broken)
+
+    def test_private_methods_are_not_exposed(self):
+        data_access = AsyncImageTagDataAccess(BarrierDBProvider([]), executor=ThreadPoolExecutor(max_workers=1))
+        with self.assertRaises(AttributeError):
+            data_access._update_images
+
+    def test_convert_to_annotated_label_is_not_a_coroutine(self):
+        data_access = AsyncImageTagDataAccess(BarrierDBProvider([]), executor=ThreadPoolExecutor(max_workers=1))
+        labels = data_access.convert_to_annotated_label([ImageTag(1, 10, 20, 30, 40, ["cat", "dog"])],
+                                                        {"cat": 2, "dog": 3})
+        self.assertEqual([2, 3], [label.classification_id for label in labels])
+
+    def test_errors_are_raised_to_the_caller(self):
+        data_access = AsyncImageTagDataAccess(BarrierDBProvider([]), executor=ThreadPoolExecutor(max_workers=1))
+        with self.assertRaises(TypeError):
+            run(data_access.checkout_images(2, "I should be an integer"))
+
+    def test_executor_is_shared_per_provider(self):
+        provider = BarrierDBProvider([])
+        self.assertIs(get_db_executor(provider), get_db_executor(provider))
+        self.assertEqual(2, get_db_executor(provider)._max_workers)
+
+if __name__ == '__main__':
+    unittest.main()
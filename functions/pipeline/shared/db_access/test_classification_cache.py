@@ -0,0 +1,78 @@
+import unittest
+
+from .classification_cache import ClassificationCache, get_classification_cache
+from .db_access_v2 import ImageTagDataAccess
+from .test_db_access_v2 import RecordingDBProvider
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+class TestClassificationCache(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = ClassificationCache()
+        cache.add({"cat": 1, "dog": 2})
+        found, missing = cache.get({"cat", "bird"})
+        self.assertEqual({"cat": 1}, found)
+        self.assertEqual({"bird"}, missing)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        cache = ClassificationCache(ttl_seconds=10, clock=clock)
+        cache.add({"cat": 1}, complete=True)
+        clock.now = 9
+        self.assertEqual(["cat"], cache.get_all())
+        clock.now = 10
+        self.assertIsNone(cache.get_all())
+        self.assertEqual({"cat"}, cache.get({"cat"})[1])
+
+    def test_full_list_needs_complete_load(self):
+        cache = ClassificationCache()
+        cache.add({"cat": 1})
+        self.assertIsNone(cache.get_all())
+        cache.add({"dog": 2}, complete=True)
+        cache.add({"bird": 3})
+        self.assertEqual({"cat", "dog", "bird"}, set(cache.get_all()))
+
+    def test_invalidate(self):
+        cache = ClassificationCache()
+        cache.add({"cat": 1}, complete=True)
+        cache.invalidate()
+        self.assertIsNone(cache.get_all())
+        self.assertEqual({"cat"}, cache.get({"cat"})[1])
+
+    def test_shared_per_provider(self):
+        provider = RecordingDBProvider()
+        self.assertIs(get_classification_cache(provider), ImageTagDataAccess(provider).classification_cache)
+        self.assertIsNot(get_classification_cache(provider), get_classification_cache(RecordingDBProvider()))
+
+class TestCachedDataAccess(unittest.TestCase):
+    def test_classification_map_only_queries_new_names(self):
+        provider = RecordingDBProvider([(1, "cat"), (2, "dog")])
+        data_access = ImageTagDataAccess(provider, ClassificationCache())
+        self.assertEqual({"cat": 1, "dog": 2}, data_access.get_classification_map({"cat", "dog"}, 5))
+        self.assertEqual({"cat": 1}, data_access.get_classification_map({"cat"}, 5))
+        cursor = provider.connection.recording_cursor
+        self.assertEqual(1, len(cursor.statements))
+
+        cursor.rows = [(3, "bird")]
+        self.assertEqual({"cat": 1, "bird": 3}, data_access.get_classification_map({"cat", "bird"}, 5))
+        self.assertEqual(2, len(cursor.statements))
+        self.assertEqual((["bird"], ["bird"]), cursor.args)
+
+    def test_existing_classifications_are_cached(self):
+        provider = RecordingDBProvider([(1, "cat"), (2, "dog")])
+        data_access = ImageTagDataAccess(provider, ClassificationCache())
+        self.assertEqual(["cat", "dog"], data_access.get_existing_classifications())
+        self.assertEqual(["cat", "dog"], data_access.get_existing_classifications())
+        self.assertEqual(1, len(provider.connection.recording_cursor.statements))
+        # The full list also fills in ids for the upload path
+        self.assertEqual({"cat": 1}, data_access.get_classification_map({"cat"}, 5))
+        self.assertEqual(1, len(provider.connection.recording_cursor.statements))
+
+if __name__ == '__main__':
+    unittest.main()
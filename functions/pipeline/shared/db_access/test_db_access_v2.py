@@ -1,4 +1,7 @@
+import json
 import unittest
+from datetime import datetime
+from decimal import Decimal
 from unittest.mock import patch 
 from unittest.mock import Mock
 
@@ -6,6 +9,13 @@ from .db_access_v2 import(
     ImageTagDataAccess,
     ArgumentException,
     ImageTagState,
+    CheckoutStrategy,
+    OnboardingJobStatus,
+    AnnotatedLabel,
+    PredictionLabel,
+    DEFAULT_CHECKOUT_LEASE_SECONDS,
+    _copy_rows,
+    to_columnar_checkout,
     generate_test_image_infos
 #    _update_images,
 #    create_user,
@@ -34,6 +44,9 @@ class MockConnection:
     def cursor(self):
         return self._mock_cursor()
 
+    def close(self):
+        pass
+
 class MockDBProvider:
     def __init__(self, fail = False):
         self.fail = fail
@@ -96,5 +109,408 @@ class TestImageTagDataAccess(unittest.TestCase):
             data_access = ImageTagDataAccess(MockDBProvider())
             data_access.update_image_urls((),"I should be an integer")
  
+class RecordingCursor:
+    def __init__(self, rows=()):
+        self.statements = []
+        self.rows = list(rows)
+
+    def execute(self, query, args=None, stream=None):
+        self.statements.append((query, stream.read().decode('utf-8') if stream else None))
+        self.args = args
+        if query.startswith("FETCH"):
+            count = int(query.split()[1])
+            self.fetched, self.rows = self.rows[:count], self.rows[count:]
+        else:
+            self.fetched = self.rows
+
+    def fetchone(self):
+        return self.fetched[0] if self.fetched else None
+
+    def fetchall(self):
+        return self.fetched
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+class RecordingConnection:
+    def __init__(self, rows=()):
+        self.recording_cursor = RecordingCursor(rows)
+        self.commits = 0
+        self.closed = False
+
+    def cursor(self):
+        return self.recording_cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        self.closed = True
+
+class RecordingDBProvider:
+    def __init__(self, rows=()):
+        self.connection = RecordingConnection(rows)
+
+    def get_connection(self):
+        return self.connection
+
+class TestBulkLoad(unittest.TestCase):
+    def test_copy_rows_in_chunks(self):
+        cursor = RecordingCursor()
+        rows = ((i, "name {0}".format(i), None) for i in range(5))
+        copied = _copy_rows(cursor, "COPY t FROM STDIN", rows, chunk_size=2)
+        self.assertEqual(5, copied)
+        self.assertEqual(3, len(cursor.statements))
+        self.assertEqual("0,name 0,\r\n1,name 1,\r\n", cursor.statements[0][1])
+        self.assertEqual("4,name 4,\r\n", cursor.statements[2][1])
+
+    def test_add_prediction_labels_bulk_load(self):
+        provider = RecordingDBProvider()
+        data_access = ImageTagDataAccess(provider)
+        labels = [PredictionLabel(7, 1, 2, 10.5, 20, 30, 40, 100, 200, 0.9, 0.8)]
+        data_access.add_prediction_labels(labels, 7, bulk_load=True)
+        query, data = provider.connection.recording_cursor.statements[1]
+        self.assertTrue(query.startswith("COPY Prediction_Labels"))
+        self.assertEqual("7,1,2,10.5,20,30,40,0.9,0.8\r\n", data)
+
+    def test_add_prediction_labels_insert(self):
+        provider = RecordingDBProvider()
+        data_access = ImageTagDataAccess(provider)
+        labels = [PredictionLabel(7, 1, 2, 10.5, 20, 30, 40, 100, 200, 0.9, 0.8)]
+        data_access.add_prediction_labels(labels, 7, bulk_load=False)
+        query, data = provider.connection.recording_cursor.statements[1]
+        self.assertTrue(query.startswith("INSERT INTO Prediction_Labels"))
+        self.assertIsNone(data)
+
+    def test_add_prediction_labels_creates_partition_first(self):
+        provider = RecordingDBProvider()
+        data_access = ImageTagDataAccess(provider)
+        labels = [PredictionLabel(7, 1, 2, 10.5, 20, 30, 40, 100, 200, 0.9, 0.8)]
+        data_access.add_prediction_labels(labels, 7)
+        statements = [query for query, _ in provider.connection.recording_cursor.statements]
+        self.assertEqual("SELECT create_prediction_labels_partition(%s)", statements[0])
+        self.assertEqual("REFRESH MATERIALIZED VIEW CONCURRENTLY Latest_Predictions", statements[-1])
+        # The partition and the view refresh are committed on their own before and after the labels
+        self.assertEqual(3, provider.connection.commits)
+
+    def test_add_prediction_labels_without_refresh(self):
+        provider = RecordingDBProvider()
+        data_access = ImageTagDataAccess(provider)
+        labels = [PredictionLabel(7, 1, 2, 10.5, 20, 30, 40, 100, 200, 0.9, 0.8)]
+        data_access.add_prediction_labels(labels, 7, refresh_latest_predictions=False)
+        statements = [query for query, _ in provider.connection.recording_cursor.statements]
+        self.assertNotIn("REFRESH MATERIALIZED VIEW CONCURRENTLY Latest_Predictions", statements)
+
+    def test_update_tagged_images_v2_bulk_load(self):
+        provider = RecordingDBProvider()
+        data_access = ImageTagDataAccess(provider)
+        labels = [AnnotatedLabel(1, 2, 10, 20, 30, 40), AnnotatedLabel(3, 2, 11, 21, 31, 41)]
+        data_access.update_tagged_images_v2(labels, 5, bulk_load=True)
+        statements = provider.connection.recording_cursor.statements
+        self.assertTrue(statements[0][0].startswith("COPY Annotated_Labels"))
+        self.assertEqual("1,2,10,20,30,40,5\r\n3,2,11,21,31,41,5\r\n", statements[0][1])
+        self.assertTrue(statements[1][0].startswith("UPDATE Image_Tagging_State"))
+
+class TestCheckoutImages(unittest.TestCase):
+    def test_checkout_is_single_atomic_claim(self):
+        rows = [(1, "url1", 2, "cat"), (1, "url1", 3, "dog"), (2, "url2", None, None)]
+        provider = RecordingDBProvider(rows)
+        data_access = ImageTagDataAccess(provider)
+        checked_out = data_access.checkout_images(2, 9)
+        self.assertEqual(rows, checked_out)
+        statements = provider.connection.recording_cursor.statements
+        self.assertEqual(1, len(statements))
+        self.assertIn("FOR UPDATE SKIP LOCKED", statements[0][0])
+        # Inlined so the partial index on ready images stays usable
+        self.assertIn("WHERE TagStateId = {0} ".format(int(ImageTagState.READY_TO_TAG)), statements[0][0])
+        self.assertEqual((2, ImageTagState.TAG_IN_PROGRESS, 9, DEFAULT_CHECKOUT_LEASE_SECONDS),
+                         provider.connection.recording_cursor.args)
+        self.assertEqual(1, provider.connection.commits)
+
+    def test_checkout_ranked_by_lowest_confidence(self):
+        rows = [(1, "url1", 2, "cat"), (2, "url2", 2, "cat")]
+        provider = RecordingDBProvider(rows)
+        data_access = ImageTagDataAccess(provider)
+        data_access.checkout_images(2, 9, CheckoutStrategy.LOWEST_CONFIDENCE)
+        statements = provider.connection.recording_cursor.statements
+        self.assertEqual(1, len(statements))
+        self.assertIn("ORDER BY lp.ImageConfidence ASC", statements[0][0])
+
+    def test_checkout_ranked_falls_back_to_any(self):
+        rows = [(1, "url1", 2, "cat")]
+        provider = RecordingDBProvider(rows)
+        data_access = ImageTagDataAccess(provider)
+        data_access.checkout_images(3, 9, CheckoutStrategy.HIGHEST_CONFIDENCE)
+        statements = provider.connection.recording_cursor.statements
+        self.assertEqual(2, len(statements))
+        self.assertIn("ORDER BY lp.ImageConfidence DESC", statements[0][0])
+        self.assertNotIn("ORDER BY lp.ImageConfidence", statements[1][0])
+        self.assertEqual(2, provider.connection.recording_cursor.args[0])
+
+    def test_checkout_strategy_type_error(self):
+        with self.assertRaises(TypeError):
+            ImageTagDataAccess(RecordingDBProvider()).checkout_images(2, 9, "lowest")
+
+    def test_checkout_user_id_type_error(self):
+        with self.assertRaises(TypeError):
+            ImageTagDataAccess(RecordingDBProvider()).checkout_images(2, "I should be an integer")
+
+    def test_checkout_sets_lease(self):
+        provider = RecordingDBProvider()
+        ImageTagDataAccess(provider).checkout_images(2, 9, lease_seconds=60)
+        self.assertIn("LeaseExpiresDtim = now() + %s::integer * interval '1 second'",
+                      provider.connection.recording_cursor.statements[0][0])
+        self.assertEqual(60, provider.connection.recording_cursor.args[-1])
+
+    def test_checkout_invalid_lease(self):
+        with self.assertRaises(ArgumentException):
+            ImageTagDataAccess(RecordingDBProvider()).checkout_images(2, 9, lease_seconds=0)
+
+    def test_to_columnar_checkout(self):
+        rows = [(1, "url1", 2, "cat", Decimal("1.5"), Decimal("2.5"), Decimal("3.5"), Decimal("4.5"), 600, 400,
+                 Decimal("0.9"), Decimal("0.8"), "tag_inprogress"),
+                (2, "url2", None, None, None, None, None, None, 300, 200, None, None, "tag_inprogress"),
+                (1, "url1", 3, "dog", 5, 6, 7, 8, 600, 400, Decimal("0.85"), Decimal("0.8"), "tag_inprogress")]
+        columnar = to_columnar_checkout(rows)
+        self.assertEqual({"id": [1, 2], "location": ["url1", "url2"], "height": [600, 300], "width": [400, 200],
+                          "image_confidence": [0.8, None], "box_count": [2, 0]}, columnar["images"])
+        self.assertEqual({"class_id": [2, 3], "x_min": [1.5, 5.0], "x_max": [2.5, 6.0], "y_min": [3.5, 7.0],
+                          "y_max": [4.5, 8.0], "confidence": [0.9, 0.85]}, columnar["boxes"])
+        self.assertEqual({2: "cat", 3: "dog"}, columnar["classes"])
+        json.dumps(columnar)
+
+class TestReclaimExpiredCheckouts(unittest.TestCase):
+    def test_single_statement_returns_count(self):
+        provider = RecordingDBProvider([(3,)])
+        self.assertEqual(3, ImageTagDataAccess(provider).reclaim_expired_checkouts(9))
+        statements = provider.connection.recording_cursor.statements
+        self.assertEqual(1, len(statements))
+        self.assertIn("WHERE TagStateId = 2 AND LeaseExpiresDtim < now() FOR UPDATE SKIP LOCKED", statements[0][0])
+        self.assertEqual((int(ImageTagState.READY_TO_TAG), 9), provider.connection.recording_cursor.args)
+        self.assertEqual(1, provider.connection.commits)
+
+    def test_abandoned_target_state(self):
+        provider = RecordingDBProvider([(0,)])
+        ImageTagDataAccess(provider).reclaim_expired_checkouts(9, ImageTagState.ABANDONED)
+        self.assertEqual((int(ImageTagState.ABANDONED), 9), provider.connection.recording_cursor.args)
+
+    def test_invalid_target_state(self):
+        with self.assertRaises(ArgumentException):
+            ImageTagDataAccess(RecordingDBProvider()).reclaim_expired_checkouts(9, ImageTagState.COMPLETED_TAG)
+
+class TestAddNewImages(unittest.TestCase):
+    def test_images_are_inserted_in_chunks(self):
+        image_infos = generate_test_image_infos(5)
+        provider = RecordingDBProvider([(i + 1, info.image_location) for i, info in enumerate(image_infos)])
+        url_to_image_id_map = ImageTagDataAccess(provider).add_new_images(image_infos, 10, chunk_size=2)
+        self.assertEqual({info.image_location: i + 1 for i, info in enumerate(image_infos)}, url_to_image_id_map)
+        statements = provider.connection.recording_cursor.statements
+        self.assertEqual(3, len(statements))
+        self.assertTrue(all("unnest" in query for query, _ in statements))
+        self.assertEqual([image_infos[4].image_location], provider.connection.recording_cursor.args[2])
+        self.assertEqual(1, provider.connection.commits)
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(ArgumentException):
+            ImageTagDataAccess(RecordingDBProvider()).add_new_images(generate_test_image_infos(5), 10, chunk_size=0)
+
+class TestUpdateImageUrls(unittest.TestCase):
+    def test_single_set_based_update(self):
+        provider = RecordingDBProvider([(1,), (2,)])
+        updated = ImageTagDataAccess(provider).update_image_urls({1: "url1", 2: "url2", 3: "url3"}, 10)
+        self.assertEqual([1, 2], updated)
+        statements = provider.connection.recording_cursor.statements
+        self.assertEqual(1, len(statements))
+        self.assertEqual(([1, 2, 3], ["url1", "url2", "url3"], ImageTagState.READY_TO_TAG, 10),
+                         provider.connection.recording_cursor.args)
+        self.assertEqual(1, provider.connection.commits)
+
+    def test_empty_map(self):
+        provider = RecordingDBProvider()
+        self.assertEqual([], ImageTagDataAccess(provider).update_image_urls({}, 10))
+        self.assertEqual([], provider.connection.recording_cursor.statements)
+
+class TestTestConnection(unittest.TestCase):
+    def test_connection_is_closed(self):
+        provider = RecordingDBProvider()
+        ImageTagDataAccess(provider).test_connection()
+        self.assertTrue(provider.connection.closed)
+
+class TestLastImageTagId(unittest.TestCase):
+    def test_mark_is_read_after_label_writes_commit(self):
+        provider = RecordingDBProvider([(42,)])
+        self.assertEqual(42, ImageTagDataAccess(provider).get_last_image_tag_id())
+        statements = [query for query, _ in provider.connection.recording_cursor.statements]
+        self.assertEqual("LOCK TABLE Annotated_Labels IN SHARE MODE", statements[1])
+        self.assertIn("MAX(ImageTagId)", statements[2])
+        self.assertEqual(1, provider.connection.commits)
+
+def onboarding_job_row(pages_listed=0, next_marker=None, status="running"):
+    return (4, "account", "container", status, next_marker, pages_listed, 0, 0, None, 10, None, None)
+
+class TestOnboardingJobs(unittest.TestCase):
+    def test_create_job(self):
+        provider = RecordingDBProvider([(4,)])
+        self.assertEqual(4, ImageTagDataAccess(provider).create_onboarding_job("account", "container", 10))
+        self.assertEqual(("account", "container", "running", 10), provider.connection.recording_cursor.args)
+        self.assertEqual(1, provider.connection.commits)
+
+    def test_missing_job(self):
+        self.assertIsNone(ImageTagDataAccess(RecordingDBProvider()).get_onboarding_job(4))
+
+    def test_page_is_listed_with_the_job_locked(self):
+        provider = RecordingDBProvider([onboarding_job_row(pages_listed=2, next_marker="marker2")])
+        jobs = []
+        def list_page(job):
+            jobs.append(job)
+            return "marker3", 1000, 900
+        self.assertTrue(ImageTagDataAccess(provider).list_onboarding_job_page(4, 2, list_page))
+        statements = [query for query, _ in provider.connection.recording_cursor.statements]
+        self.assertTrue(statements[0].endswith("WHERE JobId = %s FOR UPDATE"))
+        self.assertEqual("marker2", jobs[0]["next_marker"])
+        self.assertTrue(statements[1].startswith("UPDATE Onboarding_Job"))
+        self.assertEqual(("marker3", "running", 1000, 900, 4), provider.connection.recording_cursor.args)
+        self.assertEqual(1, provider.connection.commits)
+
+    def test_last_page_completes_the_job(self):
+        provider = RecordingDBProvider([onboarding_job_row(pages_listed=2)])
+        self.assertTrue(ImageTagDataAccess(provider).list_onboarding_job_page(4, 2, lambda job: ("", 10, 9)))
+        self.assertEqual((None, "completed"), provider.connection.recording_cursor.args[:2])
+
+    def test_page_already_listed_is_not_listed_again(self):
+        for job_row in (onboarding_job_row(pages_listed=3), onboarding_job_row(pages_listed=2, status="failed"), None):
+            provider = RecordingDBProvider([job_row] if job_row else [])
+            self.assertFalse(ImageTagDataAccess(provider).list_onboarding_job_page(4, 2, self.fail))
+            self.assertEqual(1, len(provider.connection.recording_cursor.statements))
+            self.assertEqual(1, provider.connection.commits)
+
+    def test_page_that_fails_to_list_is_not_checkpointed(self):
+        provider = RecordingDBProvider([onboarding_job_row(pages_listed=2)])
+        def list_page(job):
+            raise Exception("queue is down")
+        with self.assertRaises(Exception):
+            ImageTagDataAccess(provider).list_onboarding_job_page(4, 2, list_page)
+        self.assertEqual(1, len(provider.connection.recording_cursor.statements))
+        self.assertEqual(0, provider.connection.commits)
+        self.assertTrue(provider.connection.closed)
+
+    def test_only_failed_jobs_are_resumed(self):
+        provider = RecordingDBProvider([(3,)])
+        self.assertEqual(3, ImageTagDataAccess(provider).resume_onboarding_job(4))
+        self.assertIn("WHERE JobId = %s AND Status = %s", provider.connection.recording_cursor.statements[0][0])
+        self.assertEqual(("running", 4, "failed"), provider.connection.recording_cursor.args)
+        self.assertIsNone(ImageTagDataAccess(RecordingDBProvider()).resume_onboarding_job(4))
+
+    def test_completed_status_cannot_be_set(self):
+        with self.assertRaises(ArgumentException):
+            ImageTagDataAccess(RecordingDBProvider()).set_onboarding_job_status(4, OnboardingJobStatus.COMPLETED)
+
+class TestBindParameters(unittest.TestCase):
+    def test_update_images_query_text_is_stable(self):
+        provider = RecordingDBProvider()
+        data_access = ImageTagDataAccess(provider)
+        data_access.update_incomplete_images([1, 2], 5)
+        data_access.update_incomplete_images([3], 5)
+        statements = provider.connection.recording_cursor.statements
+        self.assertEqual(statements[0][0], statements[1][0])
+        self.assertIn("ImageId = ANY(%s)", statements[0][0])
+        # Leaving TAG_IN_PROGRESS clears the lease
+        self.assertEqual((int(ImageTagState.INCOMPLETE_TAG), 5, None, [3]), provider.connection.recording_cursor.args)
+
+    def test_image_info_ids_are_bound(self):
+        provider = RecordingDBProvider()
+        ImageTagDataAccess(provider).get_image_info_for_image_ids(["1", 2])
+        self.assertIn("i.imageid = ANY(%s)", provider.connection.recording_cursor.statements[0][0])
+        self.assertEqual(([1, 2],), provider.connection.recording_cursor.args)
+
+    def test_images_by_tag_status_without_limit(self):
+        provider = RecordingDBProvider()
+        ImageTagDataAccess(provider).get_images_by_tag_status([1, 4])
+        self.assertEqual(([1, 4], None), provider.connection.recording_cursor.args)
+
+    def test_prediction_label_insert_binds_arrays(self):
+        provider = RecordingDBProvider()
+        labels = [PredictionLabel(7, 1, 2, 10.5, 20, 30, 40, 100, 200, 0.9, 0.8),
+                  PredictionLabel(7, 3, 2, 11, 21, 31, 41, 100, 200, 0.7, 0.6)]
+        ImageTagDataAccess(provider).add_prediction_labels(labels, 7, bulk_load=False, refresh_latest_predictions=False)
+        query = provider.connection.recording_cursor.statements[1][0]
+        self.assertIn("unnest", query)
+        self.assertNotIn("10.5", query)
+        args = provider.connection.recording_cursor.args
+        self.assertEqual(7, args[0])
+        self.assertEqual([1, 3], args[1])
+        self.assertEqual([10.5, 11.0], args[3])
+
+class TestImagesByTagStatusPage(unittest.TestCase):
+    rows = [(3, "url3", datetime(2018, 10, 2)), (2, "url2", datetime(2018, 10, 1)), (1, "url1", datetime(2018, 10, 1))]
+
+    def test_full_page_returns_next_key(self):
+        provider = RecordingDBProvider(self.rows[:2])
+        images, next_key = ImageTagDataAccess(provider).get_images_by_tag_status_page([4, 1, 1], 2)
+        self.assertEqual({3: "url3", 2: "url2"}, images)
+        self.assertEqual((datetime(2018, 10, 1), 2), next_key)
+        self.assertNotIn("(a.CreatedDtim, a.ImageId) <", provider.connection.recording_cursor.statements[0][0])
+        self.assertEqual(([1, 4], 2, 2), provider.connection.recording_cursor.args)
+
+    def test_last_page_has_no_next_key(self):
+        provider = RecordingDBProvider(self.rows[2:])
+        after = (datetime(2018, 10, 1), 2)
+        images, next_key = ImageTagDataAccess(provider).get_images_by_tag_status_page([1], 2, after)
+        self.assertEqual({1: "url1"}, images)
+        self.assertIsNone(next_key)
+        self.assertIn("(a.CreatedDtim, a.ImageId) < (%s, %s)", provider.connection.recording_cursor.statements[0][0])
+        self.assertEqual(([1], datetime(2018, 10, 1), 2, 2, 2), provider.connection.recording_cursor.args)
+
+    def test_invalid_page_size(self):
+        with self.assertRaises(ArgumentException):
+            ImageTagDataAccess(RecordingDBProvider()).get_images_by_tag_status_page([1], 0)
+
+    def test_after_type_error(self):
+        with self.assertRaises(TypeError):
+            ImageTagDataAccess(RecordingDBProvider()).get_images_by_tag_status_page([1], 2, ("2018-10-01", 2))
+
+class TestIterLabels(unittest.TestCase):
+    rows = [(1, "url1", 600, 400, "cat", 1, 2, 3, 4),
+            (1, "url1", 600, 400, "dog", 5, 6, 7, 8),
+            (2, "url2", 600, 400, "cat", 1, 2, 3, 4),
+            (3, "url3", 600, 400, "cat", 1, 2, 3, 4)]
+
+    def test_labels_are_grouped_across_fetches(self):
+        provider = RecordingDBProvider(self.rows)
+        labels = list(ImageTagDataAccess(provider).iter_labels(fetch_size=1))
+        self.assertEqual([1, 2, 3], [label.image_id for label in labels])
+        self.assertEqual(["cat", "dog"], [tag.classificationname for tag in labels[0].labels])
+        statements = [query for query, _ in provider.connection.recording_cursor.statements]
+        self.assertTrue(statements[0].startswith("DECLARE labels_cursor"))
+        self.assertEqual(5, statements.count("FETCH 1 FROM labels_cursor"))
+        self.assertEqual("CLOSE labels_cursor", statements[-1])
+        self.assertTrue(provider.connection.closed)
+
+    def test_stopping_early_closes_connection(self):
+        provider = RecordingDBProvider(self.rows)
+        labels = ImageTagDataAccess(provider).iter_labels(fetch_size=2)
+        next(labels)
+        labels.close()
+        self.assertTrue(provider.connection.closed)
+
+    def test_labels_since_filters_by_image_tag_id(self):
+        provider = RecordingDBProvider(self.rows)
+        labels = list(ImageTagDataAccess(provider).iter_labels(since=10, until=20))
+        self.assertEqual(3, len(labels))
+        declare = provider.connection.recording_cursor.statements[0][0]
+        self.assertIn("WHERE a.imageid IN (SELECT ImageId FROM Annotated_Labels WHERE ImageTagId > %s) "
+                      "AND a.ImageTagId <= %s ", declare)
+
+    def test_labels_since_type_error(self):
+        with self.assertRaises(TypeError):
+            ImageTagDataAccess(RecordingDBProvider()).get_labels_since("10")
+
+    def test_invalid_fetch_size(self):
+        with self.assertRaises(ArgumentException):
+            next(ImageTagDataAccess(RecordingDBProvider()).iter_labels(fetch_size=0))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+
+from .db_access_v2 import ImageTagDataAccess, ImageLabel, Tag
+from .classification_cache import ClassificationCache
+from .instrumentation import Instrumentation, AppInsightsExporter, NoOpExporter, instrumented, estimate_bytes
+from .test_db_access_v2 import RecordingDBProvider
+
+class RecordingExporter:
+    records_bytes = True
+
+    def __init__(self):
+        self.records = []
+
+    def export(self, method_name, duration_ms, rows, bytes_returned, success):
+        self.records.append((method_name, duration_ms, rows, bytes_returned, success))
+
+class FailingExporter(NoOpExporter):
+    def export(self, method_name, duration_ms, rows, bytes_returned, success):
+        raise Exception("telemetry is down")
+
+class RecordingTelemetryClient:
+    def __init__(self):
+        self.dependencies = []
+        self.metrics = []
+        self.flushes = 0
+
+    def track_dependency(self, name, data, **kwargs):
+        self.dependencies.append((name, data, kwargs))
+
+    def track_metric(self, name, value):
+        self.metrics.append((name, value))
+
+    def flush(self):
+        self.flushes += 1
+
+# Each call to the clock advances it by step seconds
+class StepClock:
+    def __init__(self, step):
+        self.step = step
+        self.now = 0
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+class FakeDataAccess:
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+
+    @instrumented
+    def get_rows(self, count):
+        return [(i, "url{0}".format(i)) for i in range(count)]
+
+    @instrumented
+    def iter_rows(self, count):
+        for i in range(count):
+            yield (i, "url")
+
+    @instrumented
+    def fail(self):
+        raise TypeError("bad argument")
+
+class TestInstrumentation(unittest.TestCase):
+    def test_records_duration_rows_and_bytes(self):
+        exporter = RecordingExporter()
+        data_access = FakeDataAccess(Instrumentation(exporter, clock=StepClock(0.002)))
+        data_access.get_rows(3)
+        self.assertEqual([("get_rows", 2.0, 3, 3 * (8 + 4), True)], exporter.records)
+
+    def test_generator_is_timed_until_exhausted(self):
+        exporter = RecordingExporter()
+        data_access = FakeDataAccess(Instrumentation(exporter, clock=StepClock(0.001)))
+        rows = data_access.iter_rows(4)
+        self.assertEqual([], exporter.records)
+        self.assertEqual(4, len(list(rows)))
+        self.assertEqual([("iter_rows", 1.0, 4, 4 * (8 + 3), True)], exporter.records)
+
+    def test_closed_generator_is_recorded(self):
+        exporter = RecordingExporter()
+        rows = FakeDataAccess(Instrumentation(exporter)).iter_rows(4)
+        next(rows)
+        rows.close()
+        self.assertEqual(1, exporter.records[0][2])
+        self.assertFalse(exporter.records[0][4])
+
+    def test_failures_are_recorded_and_raised(self):
+        exporter = RecordingExporter()
+        with self.assertRaises(TypeError):
+            FakeDataAccess(Instrumentation(exporter)).fail()
+        self.assertFalse(exporter.records[0][4])
+
+    def test_slow_calls_are_logged(self):
+        data_access = FakeDataAccess(Instrumentation(NoOpExporter(), slow_query_ms=100, clock=StepClock(0.5)))
+        with self.assertLogs(level='WARNING') as logs:
+            data_access.get_rows(2)
+        self.assertIn("Slow data access call get_rows took 500.0 ms and returned 2 rows", logs.output[0])
+
+    def test_export_errors_do_not_fail_the_call(self):
+        data_access = FakeDataAccess(Instrumentation(FailingExporter()))
+        self.assertEqual(2, len(data_access.get_rows(2)))
+
+    def test_noop_exporter_skips_bytes(self):
+        data_access = FakeDataAccess(Instrumentation(NoOpExporter()))
+        self.assertEqual(2, len(list(data_access.iter_rows(2))))
+
+    def test_app_insights_dependency(self):
+        client = RecordingTelemetryClient()
+        AppInsightsExporter(client).export("checkout_images", 12.7, 5, 300, True)
+        name, _, kwargs = client.dependencies[0]
+        self.assertEqual("checkout_images", name)
+        self.assertEqual("PostgreSQL", kwargs["type"])
+        self.assertEqual(12, kwargs["duration"])
+        self.assertEqual({"rows": "5", "bytes": "300"}, kwargs["properties"])
+
+    def test_app_insights_metric_is_flushed(self):
+        client = RecordingTelemetryClient()
+        AppInsightsExporter(client).track_metric("ReclaimedCheckouts", 4)
+        self.assertEqual([("ReclaimedCheckouts", 4)], client.metrics)
+        self.assertEqual(1, client.flushes)
+
+    def test_estimate_bytes_of_labels(self):
+        label = ImageLabel(1, "url", 600, 400, [Tag("cat", 1, 2, 3, 4)])
+        self.assertGreater(estimate_bytes([label]), len("url") + len("cat"))
+
+    def test_data_access_methods_are_instrumented(self):
+        exporter = RecordingExporter()
+        data_access = ImageTagDataAccess(RecordingDBProvider([(1, "cat"), (2, "dog")]), ClassificationCache(),
+                                         Instrumentation(exporter))
+        data_access.get_existing_classifications()
+        self.assertEqual("get_existing_classifications", exporter.records[0][0])
+        self.assertEqual(2, exporter.records[0][2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import time
+import threading
+import unittest
+
+from .db_access_v2 import ImageTagDataAccess, ImageInfo
+from .test_query_plans import TEST_DB_NAME, get_test_provider
+
+#################################################################
+# Checks the labels high-water mark against a real database, where
+# ImageTagIds can commit out of order. Opt in the same way as
+# test_query_plans.py, by pointing QUERY_PLAN_TEST_DB_NAME at a
+# scratch database.
+#################################################################
+
+INSERT_LABEL = ("INSERT INTO Annotated_Labels (ImageId,ClassificationId,X_Min,X_Max,Y_Min,Y_Max,CreatedByUser) "
+                "VALUES (%s, %s, 0.1, 0.2, 0.3, 0.4, %s) RETURNING ImageTagId")
+
+@unittest.skipUnless(TEST_DB_NAME, "QUERY_PLAN_TEST_DB_NAME is not set")
+class TestLabelsCursor(unittest.TestCase):
+    def setUp(self):
+        self.provider = get_test_provider()
+        self.data_access = ImageTagDataAccess(self.provider)
+        self.user_id = self.data_access.create_user("labels-cursor-test")
+        suffix = str(time.time())
+        image_ids = self.data_access.add_new_images(
+            [ImageInfo(name + ".jpg", "https://mock/{0}-{1}.jpg".format(name, suffix), 10, 10) for name in ("a", "b")],
+            self.user_id)
+        self.first_image_id = image_ids["https://mock/a-{0}.jpg".format(suffix)]
+        self.second_image_id = image_ids["https://mock/b-{0}.jpg".format(suffix)]
+        self.class_id = list(self.data_access.get_classification_map({"labels-cursor-test"}, self.user_id).values())[0]
+
+    def insert_label(self, conn, image_id):
+        cursor = conn.cursor()
+        cursor.execute(INSERT_LABEL, (image_id, self.class_id, self.user_id))
+        return cursor.fetchone()[0]
+
+    def test_label_committed_after_a_higher_id_is_not_skipped(self):
+        since = self.data_access.get_last_image_tag_id()
+
+        # The first upload draws the lower id but is still in flight when the second one commits
+        slow_upload = self.provider.get_connection()
+        fast_upload = self.provider.get_connection()
+        try:
+            lower_id = self.insert_label(slow_upload, self.first_image_id)
+            higher_id = self.insert_label(fast_upload, self.second_image_id)
+            fast_upload.commit()
+            self.assertLess(lower_id, higher_id)
+
+            marks = []
+            reader = threading.Thread(target=lambda: marks.append(self.data_access.get_last_image_tag_id()))
+            reader.start()
+            time.sleep(0.5)
+            # The mark waits for the slow upload rather than moving past its id
+            self.assertTrue(reader.is_alive())
+            slow_upload.commit()
+            reader.join(10)
+        finally:
+            slow_upload.close()
+            fast_upload.close()
+
+        self.assertGreaterEqual(marks[0], higher_id)
+        labels = self.data_access.iter_labels(since=since, until=marks[0])
+        self.assertEqual({self.first_image_id, self.second_image_id}, {label.image_id for label in labels})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import time
+import threading
+import unittest
+
+from .db_access_v2 import ImageTagDataAccess
+from .test_query_plans import TEST_DB_NAME, get_test_provider
+
+#################################################################
+# Checks that a page of an onboarding job is only listed once
+# when its message is delivered to two invocations at the same
+# time. Opt in the same way as test_query_plans.py, by pointing
+# QUERY_PLAN_TEST_DB_NAME at a scratch database.
+#################################################################
+
+@unittest.skipUnless(TEST_DB_NAME, "QUERY_PLAN_TEST_DB_NAME is not set")
+class TestOnboardingJobPageLock(unittest.TestCase):
+    def setUp(self):
+        self.data_access = ImageTagDataAccess(get_test_provider())
+        user_id = self.data_access.create_user("onboarding-job-test")
+        self.job_id = self.data_access.create_onboarding_job("account", "container", user_id)
+
+    def test_page_delivered_twice_at_once_is_listed_once(self):
+        listed = []
+        first_listing = threading.Event()
+        finish_first = threading.Event()
+
+        def slow_list_page(job):
+            listed.append("first")
+            first_listing.set()
+            finish_first.wait(10)
+            return "marker1", 3, 3
+
+        def list_page(job):
+            listed.append("second")
+            return "marker1", 3, 3
+
+        results = {}
+        first = threading.Thread(target=lambda: results.update(
+            first=self.data_access.list_onboarding_job_page(self.job_id, 0, slow_list_page)))
+        second = threading.Thread(target=lambda: results.update(
+            second=self.data_access.list_onboarding_job_page(self.job_id, 0, list_page)))
+        first.start()
+        self.assertTrue(first_listing.wait(10))
+        second.start()
+        time.sleep(0.5)
+        # The second delivery waits for the first to checkpoint rather than listing the page too
+        self.assertTrue(second.is_alive())
+        finish_first.set()
+        first.join(10)
+        second.join(10)
+
+        self.assertEqual({"first": True, "second": False}, results)
+        self.assertEqual(["first"], listed)
+        job = self.data_access.get_onboarding_job(self.job_id)
+        self.assertEqual((1, 3, "marker1"), (job["pages_listed"], job["images_queued"], job["next_marker"]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import unittest
+
+from ..db_provider import DatabaseInfo, PostGresProvider
+from .db_access_v2 import (
+    ImageTagDataAccess,
+    ImageTagState,
+    CheckoutStrategy,
+    AnnotatedLabel,
+    PredictionLabel,
+    TestClassifications
+)
+
+#################################################################
+# Runs every ImageTagDataAccess query through EXPLAIN against a
+# database seeded at production scale and fails if any of them
+# sequentially scans one of the large tables.
+#
+# Opt in by pointing QUERY_PLAN_TEST_DB_NAME at a scratch database
+# created with db/install-db-resources.py. The DB_HOST, DB_USER,
+# DB_PASS, DB_PORT and DB_SSL variables are used to connect.
+# Seeding QUERY_PLAN_TEST_ROWS images (1M by default) takes a few
+# minutes the first time; later runs reuse the data.
+#################################################################
+
+TEST_DB_NAME = os.getenv('QUERY_PLAN_TEST_DB_NAME')
+TEST_ROWS = int(os.getenv('QUERY_PLAN_TEST_ROWS', 1000000))
+
+LARGE_TABLES = {"image_info", "image_tagging_state", "image_tagging_state_audit",
+                "prediction_labels", "annotated_labels", "latest_predictions"}
+
+def get_test_provider():
+    return PostGresProvider(DatabaseInfo(os.getenv('DB_HOST'), TEST_DB_NAME, os.getenv('DB_USER'),
+                                         os.getenv('DB_PASS'), int(os.getenv('DB_PORT', 5432)),
+                                         os.getenv('DB_SSL', 'true').lower() != 'false'))
+
+def seed(provider, row_count):
+    conn = provider.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT count(*) FROM Image_Info")
+        if cursor.fetchone()[0] >= row_count:
+            return
+        # Per row audit triggers would make seeding take an hour, the query plans don't depend on them
+        for table in ("Image_Info", "Image_Tagging_State"):
+            cursor.execute("ALTER TABLE {0} DISABLE TRIGGER USER".format(table))
+        cursor.execute("INSERT INTO User_Info (UserName) VALUES ('query-plan-test') ON CONFLICT DO NOTHING")
+        cursor.execute("INSERT INTO Classification_Info (ClassificationName) SELECT unnest(%s::text[]) "
+                       "ON CONFLICT DO NOTHING", (list(TestClassifications),))
+        cursor.execute("INSERT INTO Training_Info (ModelLocation) VALUES ('query-plan-test')")
+        cursor.execute("SELECT create_prediction_labels_partition(MAX(TrainingId)) FROM Training_Info")
+        cursor.execute("INSERT INTO Image_Info (OriginalImageName,ImageLocation,Height,Width) "
+                       "SELECT g || '.jpg', 'https://mock-storage.blob.core.windows.net/perm-uploads/' || g || '.jpg', 600, 400 "
+                       "FROM generate_series(1, %s) g", (row_count,))
+        # Realistic mix: most images are tagged, a few percent wait for or are with a tagger
+        cursor.execute("INSERT INTO Image_Tagging_State (ImageId,TagStateId) "
+                       "SELECT ImageId, CASE ImageId % 100 WHEN 0 THEN 1 WHEN 1 THEN 4 WHEN 2 THEN 2 ELSE 3 END "
+                       "FROM Image_Info i WHERE NOT EXISTS (SELECT 1 FROM Image_Tagging_State s WHERE s.ImageId = i.ImageId)")
+        cursor.execute("INSERT INTO Prediction_Labels "
+                       "SELECT (SELECT MAX(TrainingId) FROM Training_Info), ImageId, "
+                       "(SELECT MIN(ClassificationId) FROM Classification_Info), 10, 20, 30, 40, 0.9, round(random()::numeric, 4) "
+                       "FROM Image_Info ON CONFLICT DO NOTHING")
+        cursor.execute("INSERT INTO Annotated_Labels (ImageId,ClassificationId,X_Min,X_Max,Y_Min,Y_Max) "
+                       "SELECT s.ImageId, (SELECT MIN(ClassificationId) FROM Classification_Info), 10, 20, 30, 40 "
+                       "FROM Image_Tagging_State s WHERE s.TagStateId = 3 ON CONFLICT DO NOTHING")
+        for table in ("Image_Info", "Image_Tagging_State"):
+            cursor.execute("ALTER TABLE {0} ENABLE TRIGGER USER".format(table))
+        # The view only picks up the predictions above when refreshed, empty it would be planned as tiny
+        cursor.execute("REFRESH MATERIALIZED VIEW Latest_Predictions")
+        conn.commit()
+        conn.autocommit = True
+        cursor.execute("ANALYZE")
+    finally:
+        conn.close()
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+class PlanCapturingCursor:
+    def __init__(self, cursor, plans):
+        self._cursor = cursor
+        self._plans = plans
+
+    def execute(self, query, args=None, stream=None):
+        params = () if args is None else (args,)
+        if stream is None and query.lstrip().split()[0].upper() in ("SELECT", "WITH", "UPDATE", "INSERT", "DELETE"):
+            self._cursor.execute("EXPLAIN (FORMAT JSON) " + query, *params)
+            plan = self._cursor.fetchone()[0]
+            self._plans.append((query, json.loads(plan) if isinstance(plan, str) else plan))
+        if stream is not None:
+            return self._cursor.execute(query, *params, stream=stream)
+        return self._cursor.execute(query, *params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+# Captures plans and rolls everything back so the seeded data never changes between tests
+class PlanCapturingConnection:
+    def __init__(self, connection, plans):
+        self._connection = connection
+        self._plans = plans
+
+    def cursor(self):
+        return PlanCapturingCursor(self._connection.cursor(), self._plans)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self._connection.rollback()
+        self._connection.close()
+
+class PlanCapturingDBProvider:
+    def __init__(self, provider):
+        self._provider = provider
+        self.plans = []
+
+    def get_connection(self):
+        return PlanCapturingConnection(self._provider.get_connection(), self.plans)
+
+@unittest.skipUnless(TEST_DB_NAME, "QUERY_PLAN_TEST_DB_NAME is not set")
+class TestQueryPlans(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        provider = get_test_provider()
+        seed(provider, TEST_ROWS)
+        data_access = ImageTagDataAccess(provider)
+        cls.user_id = data_access.create_user("query-plan-test")
+        cls.class_map = data_access.get_classification_map(set(TestClassifications), cls.user_id)
+        cls.image_ids = [TEST_ROWS // 2 + i for i in range(40)]
+
+    def setUp(self):
+        self.provider = PlanCapturingDBProvider(get_test_provider())
+        self.data_access = ImageTagDataAccess(self.provider)
+
+    def assert_uses_indexes(self):
+        self.assertTrue(self.provider.plans, "No queries were captured")
+        for query, plan in self.provider.plans:
+            # Partitions are named after their parent table with a numeric suffix
+            seq_scans = [node["Relation Name"] for node in plan_nodes(plan[0]["Plan"])
+                         if node["Node Type"] == "Seq Scan"
+                         and re.sub(r"_\d+$", "", node.get("Relation Name", "").lower()) in LARGE_TABLES]
+            self.assertFalse(seq_scans, "Sequential scan on {0} for query: {1}".format(seq_scans, query))
+
+    def test_create_user(self):
+        self.data_access.create_user("query-plan-test")
+        self.assert_uses_indexes()
+
+    def test_get_images_for_tagging(self):
+        self.data_access.get_images_for_tagging(40, self.user_id)
+        self.assert_uses_indexes()
+
+    def test_get_images_by_tag_status(self):
+        self.data_access.get_images_by_tag_status([int(ImageTagState.READY_TO_TAG), int(ImageTagState.INCOMPLETE_TAG)], 40)
+        self.assert_uses_indexes()
+
+    def test_get_images_by_tag_status_page(self):
+        tag_status = [int(state) for state in ImageTagState]
+        _, after = self.data_access.get_images_by_tag_status_page(tag_status, 500)
+        for _ in range(3):
+            _, after = self.data_access.get_images_by_tag_status_page(tag_status, 500, after)
+        self.assert_uses_indexes()
+
+    def test_get_image_info_for_image_ids(self):
+        self.data_access.get_image_info_for_image_ids(self.image_ids)
+        self.assert_uses_indexes()
+
+    def test_checkout_images(self):
+        self.data_access.checkout_images(40, self.user_id)
+        self.assert_uses_indexes()
+
+    def test_checkout_images_ranked(self):
+        self.data_access.checkout_images(40, self.user_id, CheckoutStrategy.LOWEST_CONFIDENCE)
+        self.data_access.checkout_images(40, self.user_id, CheckoutStrategy.HIGHEST_CONFIDENCE)
+        self.assert_uses_indexes()
+
+    def test_update_image_states(self):
+        self.data_access.update_incomplete_images(self.image_ids, self.user_id)
+        self.data_access.update_completed_untagged_images(self.image_ids, self.user_id)
+        self.assert_uses_indexes()
+
+    def test_reclaim_expired_checkouts(self):
+        self.data_access.reclaim_expired_checkouts(self.user_id)
+        self.assert_uses_indexes()
+
+    def test_update_image_urls(self):
+        self.data_access.update_image_urls({image_id: "https://moved/{0}.jpg".format(image_id)
+                                            for image_id in self.image_ids}, self.user_id)
+        self.assert_uses_indexes()
+
+    def test_get_classification_map(self):
+        self.data_access.get_classification_map(set(TestClassifications), self.user_id)
+        self.assert_uses_indexes()
+
+    def test_get_existing_classifications(self):
+        self.data_access.get_existing_classifications()
+        self.assert_uses_indexes()
+
+    def test_update_tagged_images_v2(self):
+        class_id = list(self.class_map.values())[-1]
+        labels = [AnnotatedLabel(image_id, class_id, 1, 2, 3, 4) for image_id in self.image_ids]
+        self.data_access.update_tagged_images_v2(labels, self.user_id, bulk_load=False)
+        self.assert_uses_indexes()
+
+    def test_add_prediction_labels(self):
+        class_id = list(self.class_map.values())[-1]
+        labels = [PredictionLabel(1, image_id, class_id, 1, 2, 3, 4, 600, 400, 0.5, 0.5) for image_id in self.image_ids]
+        self.data_access.add_prediction_labels(labels, 1, bulk_load=False)
+        self.assert_uses_indexes()
+
+    def test_get_labels_since(self):
+        self.data_access.get_labels_since(self.data_access.get_last_image_tag_id() - 50)
+        self.assert_uses_indexes()
+
+    # get_labels is a full export of every annotated label, so a sequential scan is the right plan
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1 +1 @@
-from .db_provider import DatabaseInfo, DBProvider, PostGresProvider, get_postgres_provider
+from .db_provider import DatabaseInfo, DBProvider, PostGresProvider, PooledPostGresProvider, PoolExhaustedException, get_postgres_provider, get_database_info_from_env
@@ -1,5 +1,8 @@
 import pg8000
 import os
+import time
+import logging
+import threading
 
 # import pyodbc
 
@@ -8,22 +11,50 @@ default_db_host = ""
 default_db_name = ""
 default_db_user = ""
 default_db_pass = ""
+default_db_port = 5432
+
+# Pool sizing can be tuned per function app through app settings
+DEFAULT_POOL_MIN_SIZE = 1
+DEFAULT_POOL_MAX_SIZE = 10
+DEFAULT_POOL_MAX_IDLE_SECONDS = 300
+DEFAULT_POOL_HEALTH_CHECK_SECONDS = 30
+DEFAULT_POOL_ACQUIRE_TIMEOUT_SECONDS = 30
+
+__provider_cache = {}
+__provider_cache_lock = threading.Lock()
 
 def get_postgres_provider():
-    return PostGresProvider(__get_database_info_from_env())
+    # The functions host keeps the worker process alive between invocations, so we hand out
+    # one pooled provider per database and warm invocations reuse its open connections.
+    database_info = get_database_info_from_env()
+    cache_key = (database_info.db_host_name, database_info.db_port, database_info.db_name, database_info.db_user_name)
+    with __provider_cache_lock:
+        provider = __provider_cache.get(cache_key)
+        if provider is None:
+            provider = PooledPostGresProvider(database_info,
+                                              min_size=int(os.getenv('DB_POOL_MIN_SIZE', DEFAULT_POOL_MIN_SIZE)),
+                                              max_size=int(os.getenv('DB_POOL_MAX_SIZE', DEFAULT_POOL_MAX_SIZE)),
+                                              max_idle_seconds=float(os.getenv('DB_POOL_MAX_IDLE_SECONDS', DEFAULT_POOL_MAX_IDLE_SECONDS)))
+            __provider_cache[cache_key] = provider
+    return provider
 
 
-def __get_database_info_from_env():
+def get_database_info_from_env():
     return DatabaseInfo(os.getenv('DB_HOST', default_db_host), os.getenv('DB_NAME', default_db_name),
-                        os.getenv('DB_USER', default_db_user), os.getenv('DB_PASS', default_db_pass))
+                        os.getenv('DB_USER', default_db_user), os.getenv('DB_PASS', default_db_pass),
+                        int(os.getenv('DB_PORT', default_db_port)),
+                        os.getenv('DB_SSL', 'true').lower() != 'false')
 
 
 class DatabaseInfo(object):
-    def __init__(self, db_host_name, db_name, db_user_name, db_password):
+    # Port and ssl only need changing for local databases, Azure Postgres enforces SSL on 5432
+    def __init__(self, db_host_name, db_name, db_user_name, db_password, db_port=5432, db_ssl=True):
         self.db_host_name = db_host_name
         self.db_name = db_name
         self.db_user_name = db_user_name
         self.db_password = db_password
+        self.db_port = db_port
+        self.db_ssl = db_ssl
 
 
 class DBProvider(object):
@@ -41,14 +72,182 @@ class PostGresProvider(DBProvider):
     def __init__(self, database_info):
         self.database_info = database_info
 
-    def __new_connection(self, host_name, db_name, db_user, db_pass):
-        return pg8000.connect(db_user, host=host_name, unix_sock=None, port=5432, database=db_name, password=db_pass,
-                              ssl=True, timeout=None, application_name=None)
+    def __new_connection(self, host_name, db_name, db_user, db_pass, db_port=5432, db_ssl=True):
+        return pg8000.connect(db_user, host=host_name, unix_sock=None, port=db_port, database=db_name, password=db_pass,
+                              ssl=db_ssl, timeout=None, application_name=None)
 
     def get_connection(self):
         # self.connection =
         return self.__new_connection(self.database_info.db_host_name, self.database_info.db_name,
-                                     self.database_info.db_user_name, self.database_info.db_password)
+                                     self.database_info.db_user_name, self.database_info.db_password,
+                                     self.database_info.db_port, self.database_info.db_ssl)
+
+
+class PoolExhaustedException(Exception):
+    pass
+
+
+# Wraps a pooled pg8000 connection. close() hands the connection back to the pool instead of
+# tearing down the socket, so existing callers that close their connection work unchanged.
+class PooledConnection(object):
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+        self._released = False
+        self._pid = os.getpid()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    @property
+    def autocommit(self):
+        return self._connection.autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self._connection.autocommit = value
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._connection, self._pid)
+
+
+class PooledPostGresProvider(PostGresProvider):
+
+    def __init__(self, database_info, min_size=DEFAULT_POOL_MIN_SIZE, max_size=DEFAULT_POOL_MAX_SIZE,
+                 max_idle_seconds=DEFAULT_POOL_MAX_IDLE_SECONDS,
+                 health_check_seconds=DEFAULT_POOL_HEALTH_CHECK_SECONDS,
+                 acquire_timeout_seconds=DEFAULT_POOL_ACQUIRE_TIMEOUT_SECONDS):
+        super().__init__(database_info)
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_seconds = health_check_seconds
+        self.acquire_timeout_seconds = acquire_timeout_seconds
+        # Idle connections as (connection, last_used) ordered oldest first. We hand out the most
+        # recently used one so cold connections age out through idle eviction.
+        self._idle = []
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self._pid = os.getpid()
+
+    def get_connection(self):
+        self._reset_after_fork()
+        deadline = time.monotonic() + self.acquire_timeout_seconds
+        connection, last_used = None, None
+        evicted = []
+        with self._condition:
+            while True:
+                evicted.extend(self._evict_idle_connections())
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                    break
+                if self._in_use < self.max_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._close_all_quietly(evicted)
+                    raise PoolExhaustedException("No database connection available after {0} seconds "
+                                                 "(max pool size {1})".format(self.acquire_timeout_seconds, self.max_size))
+                self._condition.wait(remaining)
+            self._in_use += 1
+
+        # Closing, connecting and health checks happen outside the lock so other callers are not blocked on network I/O
+        self._close_all_quietly(evicted)
+        try:
+            if connection is not None and time.monotonic() - last_used > self.health_check_seconds \
+                    and not self._is_healthy(connection):
+                logging.debug("Discarding unhealthy pooled connection")
+                self._close_quietly(connection)
+                connection = None
+            if connection is None:
+                connection = super().get_connection()
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+        return PooledConnection(self, connection)
+
+    def close_all(self):
+        self._reset_after_fork()
+        with self._condition:
+            idle, self._idle = self._idle, []
+        self._close_all_quietly(connection for connection, _ in idle)
+
+    def size(self):
+        with self._condition:
+            return self._in_use + len(self._idle)
+
+    def _release(self, connection, pid):
+        self._reset_after_fork()
+        if pid != self._pid:
+            # Checked out before a fork, the parent still owns the socket
+            return
+        healthy = True
+        try:
+            # Never hand the next caller a connection with a half finished transaction, or one a
+            # caller switched to autocommit, which breaks DECLARE CURSOR and multi statement writes
+            if getattr(connection, 'in_transaction', True):
+                connection.rollback()
+            if getattr(connection, 'autocommit', False):
+                connection.autocommit = False
+        except Exception as e:
+            logging.debug("Discarding pooled connection that failed to reset: {0}".format(e))
+            healthy = False
+            self._close_quietly(connection)
+        with self._condition:
+            self._in_use -= 1
+            if healthy:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def _evict_idle_connections(self):
+        # Called with the lock held. Keeps at least min_size connections open and returns the
+        # evicted connections for the caller to close once the lock is released.
+        now = time.monotonic()
+        evicted = []
+        while self._idle and self._in_use + len(self._idle) > self.min_size \
+                and now - self._idle[0][1] > self.max_idle_seconds:
+            connection, _ = self._idle.pop(0)
+            evicted.append(connection)
+        return evicted
+
+    def _reset_after_fork(self):
+        # A forked process inherits the parent's sockets and lock. Using either would interleave
+        # protocol messages with the parent, so the child forgets them, without closing the
+        # sockets the parent still uses, and starts an empty pool.
+        pid = os.getpid()
+        if self._pid != pid:
+            self._idle = []
+            self._in_use = 0
+            self._condition = threading.Condition()
+            self._pid = pid
+
+    def _is_healthy(self, connection):
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            finally: cursor.close()
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _close_quietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _close_all_quietly(self, connections):
+        for connection in connections:
+            self._close_quietly(connection)
 
 
 '''
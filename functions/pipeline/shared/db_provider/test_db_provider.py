@@ -0,0 +1,133 @@
+import unittest
+from unittest.mock import patch
+from unittest.mock import Mock
+
+from . import db_provider
+from .db_provider import (
+    DatabaseInfo,
+    PooledPostGresProvider,
+    PoolExhaustedException
+)
+
+class MockConnection:
+    def __init__(self, healthy = True):
+        self.healthy = healthy
+        self.closed = False
+        self.rollbacks = 0
+        self.autocommit = False
+        self.on_close = None
+
+    def cursor(self):
+        def execute(query):
+            if not self.healthy:
+                raise Exception("connection reset")
+
+        test = Mock()
+        test.execute = execute
+        return test
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+        if self.on_close:
+            self.on_close()
+
+def new_pool(**kwargs):
+    return PooledPostGresProvider(DatabaseInfo("host","db","user","pass"), **kwargs)
+
+@patch('pg8000.connect', side_effect=lambda *args, **kwargs: MockConnection())
+class TestPooledPostGresProvider(unittest.TestCase):
+    def test_connection_is_reused(self, connect):
+        pool = new_pool()
+        first = pool.get_connection()
+        raw = first._connection
+        first.close()
+        second = pool.get_connection()
+        self.assertIs(raw, second._connection)
+        self.assertEqual(1, connect.call_count)
+
+    def test_release_rolls_back_open_transaction(self, connect):
+        pool = new_pool()
+        conn = pool.get_connection()
+        conn.close()
+        self.assertEqual(1, conn._connection.rollbacks)
+
+    def test_double_close_releases_once(self, connect):
+        pool = new_pool(max_size=2)
+        conn = pool.get_connection()
+        conn.close()
+        conn.close()
+        self.assertEqual(1, pool.size())
+
+    def test_pool_exhausted(self, connect):
+        pool = new_pool(max_size=1, acquire_timeout_seconds=0)
+        pool.get_connection()
+        with self.assertRaises(PoolExhaustedException):
+            pool.get_connection()
+
+    def test_idle_connections_are_evicted_down_to_min_size(self, connect):
+        pool = new_pool(min_size=1, max_size=3, max_idle_seconds=0)
+        conns = [pool.get_connection() for _ in range(3)]
+        raws = [c._connection for c in conns]
+        for c in conns:
+            c.close()
+        pool.get_connection()
+        self.assertEqual(2, sum(1 for raw in raws if raw.closed))
+
+    def test_unhealthy_connection_is_replaced(self, connect):
+        pool = new_pool(health_check_seconds=0)
+        conn = pool.get_connection()
+        raw = conn._connection
+        conn.close()
+        raw.healthy = False
+        replacement = pool.get_connection()
+        self.assertTrue(raw.closed)
+        self.assertIsNot(raw, replacement._connection)
+        self.assertEqual(1, pool.size())
+
+    def test_failed_connect_frees_slot(self, connect):
+        pool = new_pool(max_size=1, acquire_timeout_seconds=0)
+        connect.side_effect = Exception("cannot connect")
+        with self.assertRaises(Exception):
+            pool.get_connection()
+        self.assertEqual(0, pool.size())
+
+    def test_release_turns_autocommit_off(self, connect):
+        pool = new_pool()
+        conn = pool.get_connection()
+        conn.autocommit = True
+        conn.close()
+        self.assertFalse(pool.get_connection().autocommit)
+
+    def test_evicted_connections_are_closed_outside_the_lock(self, connect):
+        pool = new_pool(min_size=0, max_size=2, max_idle_seconds=0)
+        conns = [pool.get_connection() for _ in range(2)]
+        lock_held = []
+        for c in conns:
+            c._connection.on_close = lambda: lock_held.append(pool._condition._is_owned())
+            c.close()
+        pool.get_connection()
+        self.assertEqual([False, False], lock_held)
+
+    def test_forked_child_does_not_reuse_parent_connections(self, connect):
+        pool = new_pool(max_size=1, acquire_timeout_seconds=0)
+        idle = pool.get_connection()
+        raw = idle._connection
+        idle.close()
+        checked_out = pool.get_connection()
+        with patch.object(db_provider.os, 'getpid', return_value=-1):
+            child_conn = pool.get_connection()
+            self.assertIsNot(raw, child_conn._connection)
+            # The parent's connection is neither closed nor pooled by the child
+            checked_out.close()
+            self.assertFalse(raw.closed)
+            self.assertEqual(1, pool.size())
+
+    def test_invalid_sizes(self, connect):
+        with self.assertRaises(ValueError):
+            new_pool(min_size=5, max_size=2)
+
+if __name__ == '__main__':
+    unittest.main()
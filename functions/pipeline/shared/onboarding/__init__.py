@@ -4,15 +4,45 @@ from enum import Enum
 from datetime import datetime
 import time
 import asyncio
+import shutil
+import tempfile
+import json
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, quote
+from urllib.request import urlopen
+from .image_dimensions import (
+    parse_image_dimensions,
+    read_image_dimensions,
+    probe_image_dimensions,
+    probe_all_image_dimensions
+)
+from .copy_engine import (
+    CopyStatus,
+    CopyOutcome,
+    CopyReport,
+    copy_blobs,
+    DEFAULT_COPY_WORKERS,
+    DEFAULT_COPY_DEADLINE_SECONDS
+)
+from ..db_access import ImageInfo, OnboardingJobStatus
+from ..constants import ImageFileType
 
 TIMEOUT_SECONDS = 1
-
-class CopyStatus(Enum):
-    SUCCESS = "success",
-    PENDING = "pending",
-    ABORTED = "aborted",
-    FAILED = "failed",
-    TIMEOUT = "timeout" # custom status
+# Downloaded images larger than this are spooled to a temporary file instead of held in memory
+SPOOL_MAX_BYTES = 32 * 1024 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 300
+# Images described by each onboardqueue message
+DEFAULT_BATCH_SIZE = 16
+# Queue messages are limited to 64 KB after base64 encoding, which adds a third
+MAX_MESSAGE_BYTES = 48 * 1024
+# Images of a batch fetched and uploaded at the same time
+BATCH_WORKERS = 8
+ONBOARDING_QUEUE_NAME = "onboardqueue"
+# Pages of container onboarding jobs waiting to be listed
+ONBOARDING_JOB_QUEUE_NAME = "onboardjobqueue"
+# Blobs listed per page of an onboarding job, list_blobs returns at most 5000
+DEFAULT_PAGE_SIZE = 1000
 
 class DeleteStatus(Enum):
     SUCCESS = "success",
@@ -21,62 +51,56 @@ class DeleteStatus(Enum):
     FAILED = "failed",
     TIMEOUT = "timeout" # custom status
 
-# Initiates copy of images from temporary to permanent storage, and checks the status of each operation.
-# Returns two dictionaries, copy_succeeded_dict and copy_error_dict, in the format {sourceURL : destinationURL }.
-def copy_images_to_permanent_storage(image_id_url_map, copy_source, copy_destination, blob_service):
-    copy_initiated_dict = {}        # Dictionary of images for which copy was successfully initiated
-    copy_error_dict = {}            # Dictionary of images for which some error/exception occurred
-
-    # Create new blob names
-    for key, value in image_id_url_map.items():
-        original_blob_url = key
-        # original_blob_name = original_blob_url.split("/")[-1]
-        file_extension = os.path.splitext(original_blob_url)[1]
-        image_id = value
-        new_blob_name = (str(image_id) + file_extension)
-
-        # Create the destination blob URL
-        destination_blob_path = blob_service.make_blob_url(copy_destination, new_blob_name)
-
-        # Copy blob from temp storage to permanent storage
-        logging.info("Now initiating copy of image from temporary to permanent storage...")
-        # Log source and destination paths for debugging
-        logging.info("Source path: " + original_blob_url)
-        logging.info("Destination path: " + destination_blob_path)
-        try:
-            blob_service.copy_blob(copy_destination, new_blob_name, original_blob_url)
-            logging.info("Done.")
-            # Add to list of items for which we need to check status if copy was initiated successfully
-            copy_initiated_dict[original_blob_url] = destination_blob_path
-        except Exception as e:
-            logging.error("ERROR: Exception thrown during copy attempt: " + str(e))
-            copy_error_dict[original_blob_url] = destination_blob_path
+# Downloads the image at url once into a file object positioned at its start, so the same bytes
+# can be used to read the image size and to upload it. Small images stay in memory.
+def download_image(url, spool_max_bytes=SPOOL_MAX_BYTES):
+    image_file = tempfile.SpooledTemporaryFile(max_size=spool_max_bytes)
+    try:
+        with urlopen(url, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+            shutil.copyfileobj(response, image_file)
+        image_file.seek(0)
+        return image_file
+    except Exception:
+        image_file.close()
+        raise
 
-    # Wait a few seconds before checking status
-    time.sleep(TIMEOUT_SECONDS)
+# Blobs can be copied between storage accounts by the storage service itself
+def is_azure_blob_url(url):
+    return urlparse(url).hostname.endswith(".blob.core.windows.net")
 
-    copy_succeeded_dict = {}        # Dictionary of copy operations that were successful
+# Has the storage service copy the blob at source_url into container_name/blob_name, setting
+# metadata on the copy. requires_sync makes the service finish the copy before it answers,
+# which it supports for source blobs up to 256 MiB.
+def copy_blob_from_url(blob_service, container_name, blob_name, source_url, metadata=None):
+    copy_properties = blob_service.copy_blob(container_name, blob_name, source_url, metadata=metadata,
+                                             requires_sync=True)
+    if copy_properties.status != "success":
+        raise Exception("Copy of {0} to {1}/{2} ended with status {3}".format(
+            source_url, container_name, blob_name, copy_properties.status))
 
-    # Get copy status of each item.  If status is succeeded, add to success list.  Otherwise, add to error list.
-    for key, value in copy_initiated_dict.items():
-        target_blob_properties = blob_service.get_blob_properties(copy_destination, value.split("/")[-1])
-        copy_properties = target_blob_properties.properties.copy
-        # logging.info("Copy status of image" + value.split("/")[-1] + " is: " + copy_properties.status)     # Debugging
-        # if copy_properties.status == CopyStatus.SUCCESS:    # Note: Want to remove hard-coding, but this line does not work
-        if copy_properties.status == "success":
-            copy_succeeded_dict[key] = value
+# Copies images from temporary to permanent storage in parallel and waits for each copy to finish.
+# Returns two dictionaries, copy_succeeded_dict and copy_error_dict, in the format {sourceURL : destinationURL },
+# and the CopyReport with the outcome of each copy and the throughput and latency of the whole batch.
+def copy_images_to_permanent_storage(image_id_url_map, copy_source, copy_destination, blob_service,
+                                     max_workers=DEFAULT_COPY_WORKERS, deadline_seconds=DEFAULT_COPY_DEADLINE_SECONDS):
+    # New blob names are the image id with the original file extension
+    copies = [(url, copy_destination, str(image_id) + os.path.splitext(url)[1])
+              for url, image_id in image_id_url_map.items()]
+    logging.info("Now copying {0} images from temporary to permanent storage...".format(len(copies)))
+    report = copy_blobs(blob_service, copies, max_workers, deadline_seconds)
+
+    copy_succeeded_dict = {}
+    copy_error_dict = {}
+    for url, outcome in report.outcomes.items():
+        destination_blob_path = blob_service.make_blob_url(copy_destination, outcome.destination_blob_name)
+        if outcome.status == CopyStatus.SUCCESS:
+            copy_succeeded_dict[url] = destination_blob_path
         else:
-            copy_error_dict[key] = value
-    
-    # Debugging
-    # logging.info("copy_succeeded_dict:")
-    # for key, value in copy_succeeded_dict.items():
-    #     logging.info("Key: " + key + " Value: " + value)
-    # logging.info("copy_error_dict:")
-    # for key, value in copy_error_dict.items():
-    #     logging.info("Key: " + key + " Value: " + value)
-    
-    return copy_succeeded_dict, copy_error_dict
+            logging.error("ERROR: Copy of {0} to {1} ended with status {2}".format(url, destination_blob_path,
+                                                                                 outcome.status.value))
+            copy_error_dict[url] = destination_blob_path
+    logging.info("Copy metrics: {0}".format(report.metrics()))
+    return copy_succeeded_dict, copy_error_dict, report
 
 # Initiates deletion of images from temporary storage, and then checks whether the images still exist in the container.
 # Returns two dictionaries, delete_succeeded_dict and delete_error_dict, in the format {sourceURL : destinationURL }.
@@ -112,4 +136,180 @@ def delete_images_from_temp_storage(delete_images_dict, delete_location, blob_se
         else:
             delete_succeeded_dict[key] = value
     
-    return delete_succeeded_dict, delete_error_dict
\ No newline at end of file
+    return delete_succeeded_dict, delete_error_dict
+
+# Splits the image descriptors (imageUrl, fileName, fileExtension and directoryComponents) into onboardqueue
+# message bodies of at most batch_size images, halving any batch whose message would be too large.
+def build_onboarding_messages(user_name, image_descriptors, batch_size=DEFAULT_BATCH_SIZE):
+    if type(batch_size) is not int or batch_size <= 0:
+        raise ValueError("batch_size must be a positive integer")
+    image_descriptors = list(image_descriptors)
+    messages = []
+    batches = [image_descriptors[i:i + batch_size] for i in range(0, len(image_descriptors), batch_size)]
+    while batches:
+        batch = batches.pop(0)
+        body = json.dumps({"userName": user_name, "images": batch})
+        if len(body.encode("utf-8")) > MAX_MESSAGE_BYTES and len(batch) > 1:
+            middle = len(batch) // 2
+            batches[:0] = [batch[:middle], batch[middle:]]
+        else:
+            messages.append(body)
+    return messages
+
+# Returns the user name and image descriptors of an onboardqueue message. Messages put before batching
+# describe a single image next to the user name.
+def read_onboarding_message(msg_json):
+    if "images" in msg_json:
+        return msg_json["userName"], msg_json["images"]
+    image_descriptor = {key: value for key, value in msg_json.items() if key != "userName"}
+    return msg_json["userName"], [image_descriptor]
+
+# Onboards a batch of images with one bulk insert and one bulk URL update. Each image is fetched once
+# and uploaded to destination_container, or with server_side_copy, blobs are copied by storage.
+# An image that fails is logged and left out, the rest of the batch carries on.
+# Returns the ids of the onboarded images and a dictionary of failed image url to error.
+def onboard_image_batch(data_access, blob_service, destination_container, user_name, image_descriptors,
+                        server_side_copy=False, max_workers=BATCH_WORKERS):
+    # The image location has to be unique within a batch to map the new ids back
+    descriptors = list({d["imageUrl"]: d for d in image_descriptors}.values())
+    if not descriptors:
+        return [], {}
+    failures = {}
+    # Keeps the downloads of a batch within about SPOOL_MAX_BYTES of memory
+    spool_max_bytes = max(SPOOL_MAX_BYTES // len(descriptors), 1024 * 1024)
+
+    def fetch(descriptor):
+        img_url = descriptor["imageUrl"]
+        if server_side_copy and is_azure_blob_url(img_url):
+            return None, probe_image_dimensions(img_url)
+        image_file = download_image(img_url, spool_max_bytes)
+        try:
+            return image_file, read_image_dimensions(image_file)
+        except Exception:
+            image_file.close()
+            raise
+
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(descriptors))) as executor:
+        futures = [(d, executor.submit(fetch, d)) for d in descriptors]
+        for descriptor, future in futures:
+            try:
+                fetched[descriptor["imageUrl"]] = future.result()
+            except Exception as e:
+                logging.error("Could not read image {0}: {1}".format(descriptor["fileName"], e))
+                failures[descriptor["imageUrl"]] = e
+
+    try:
+        fetched_descriptors = [d for d in descriptors if d["imageUrl"] in fetched]
+        if not fetched_descriptors:
+            return [], failures
+
+        user_id = data_access.create_user(user_name)
+        image_infos = []
+        for descriptor in fetched_descriptors:
+            width, height = fetched[descriptor["imageUrl"]][1]
+            image_infos.append(ImageInfo(descriptor["fileName"], descriptor["imageUrl"], height, width))
+        logging.debug("Add new images to the database, and retrieve a dictionary ImageId's mapped to ImageUrl's")
+        image_id_url_map = data_access.add_new_images(image_infos, user_id)
+
+        def store(descriptor):
+            img_url = descriptor["imageUrl"]
+            new_blob_name = str(image_id_url_map[img_url]) + descriptor["fileExtension"]
+            # Per Azure notes https://docs.microsoft.com/en-us/azure/storage/blobs/storage-properties-metadata:
+            # The name of your metadata must conform to the naming conventions for C# identifiers. Dashes do not work.
+            # Azure blob is also setting the keys to full lowercase.
+            metadata = {
+                "userFilePath": descriptor["directoryComponents"],
+                "originalFilename": descriptor["fileName"],
+                "uploadUser": user_name
+            }
+            image_file = fetched[img_url][0]
+            if image_file is None:
+                copy_blob_from_url(blob_service, destination_container, new_blob_name, img_url, metadata)
+            else:
+                blob_service.create_blob_from_stream(destination_container, new_blob_name, image_file,
+                                                     metadata=metadata)
+            return blob_service.make_blob_url(destination_container, new_blob_name)
+
+        update_urls_dictionary = {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(fetched_descriptors))) as executor:
+            futures = [(d, executor.submit(store, d)) for d in fetched_descriptors]
+            for descriptor, future in futures:
+                try:
+                    update_urls_dictionary[image_id_url_map[descriptor["imageUrl"]]] = future.result()
+                except Exception as e:
+                    logging.error("Could not store image {0}: {1}".format(descriptor["fileName"], e))
+                    failures[descriptor["imageUrl"]] = e
+    finally:
+        for image_file, _ in fetched.values():
+            if image_file:
+                image_file.close()
+
+    logging.debug("Now updating permanent URLs in the DB...")
+    onboarded_image_ids = data_access.update_image_urls(update_urls_dictionary, user_id)
+    return onboarded_image_ids, failures
+
+# Body of the onboardjobqueue message that lists page number page of a job. sas_token grants read and
+# list on the job's container, so the storage account key never leaves the request that started the job.
+def build_job_page_message(job_id, page, user_name, sas_token):
+    return json.dumps({"jobId": job_id, "page": page, "userName": user_name, "sasToken": sas_token})
+
+# Describes a blob for an onboardqueue message, or returns None when it is not a supported image
+def build_image_descriptor(blob_service, storage_container, blob_name, sas_token):
+    file_name = posixpath.basename(blob_name)
+    file_extension = posixpath.splitext(file_name)[1]
+    if not ImageFileType.is_supported_filetype(file_extension):
+        return None
+    directory = posixpath.dirname(blob_name)
+    return {
+        "imageUrl": blob_service.make_blob_url(storage_container, quote(blob_name), sas_token=sas_token),
+        "fileName": file_name,
+        "fileExtension": file_extension,
+        "directoryComponents": "/" + directory if directory else ""
+    }
+
+# Lists the next page of a job's container from its checkpoint, puts onboardqueue messages for its images,
+# moves the checkpoint on and puts the message for the following page on onboardjobqueue. The page is claimed
+# by locking the job before any image is queued, so a page message delivered twice only queues its images once.
+# A redelivered message whose page was already listed queues the following page again, in case putting it
+# failed after the checkpoint. Returns the message put for the following page, or None.
+def enqueue_container_page(data_access, blob_service, queue_service, page_msg, page_size=DEFAULT_PAGE_SIZE,
+                           batch_size=DEFAULT_BATCH_SIZE, redelivered=False):
+    job_id = page_msg["jobId"]
+    page = page_msg["page"]
+    listed = {}
+
+    def list_page(job):
+        storage_container = job["storage_container"]
+        blobs = blob_service.list_blobs(storage_container, num_results=page_size, marker=job["next_marker"])
+        image_descriptors = []
+        for blob_object in blobs.items:
+            image_descriptor = build_image_descriptor(blob_service, storage_container, blob_object.name,
+                                                      page_msg["sasToken"])
+            if image_descriptor:
+                image_descriptors.append(image_descriptor)
+            else:
+                logging.info("Blob object not supported. Blob name={0}".format(blob_object.name))
+
+        for body_str in build_onboarding_messages(page_msg["userName"], image_descriptors, batch_size):
+            queue_service.put_message(ONBOARDING_QUEUE_NAME, body_str)
+        listed.update(next_marker=blobs.next_marker, images_queued=len(image_descriptors))
+        return blobs.next_marker, len(blobs.items), len(image_descriptors)
+
+    if data_access.list_onboarding_job_page(job_id, page, list_page):
+        logging.info("Onboarding job {0} queued {1} images from page {2}".format(job_id, listed["images_queued"], page))
+        if not listed["next_marker"]:
+            return None
+    else:
+        job = data_access.get_onboarding_job(job_id)
+        if not (redelivered and job and job["status"] == OnboardingJobStatus.RUNNING.value
+                and job["pages_listed"] == page + 1 and job["next_marker"]):
+            logging.info("Skipping page {0} of onboarding job {1}, it is not the next page of a running job".format(
+                page, job_id))
+            return None
+        logging.warning("Page {0} of onboarding job {1} was already listed, queueing page {2} again".format(
+            page, job_id, page + 1))
+
+    next_page_msg = build_job_page_message(job_id, page + 1, page_msg["userName"], page_msg["sasToken"])
+    queue_service.put_message(ONBOARDING_JOB_QUEUE_NAME, next_page_msg)
+    return next_page_msg
@@ -0,0 +1,114 @@
+import time
+import math
+import logging
+from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
+
+# Copies started, and pending copies polled, at the same time
+DEFAULT_COPY_WORKERS = 16
+# How long pending copies are polled before they are reported as timed out
+DEFAULT_COPY_DEADLINE_SECONDS = 60
+# Wait before the first poll of pending copies, doubled after every poll up to MAX_POLL_SECONDS
+INITIAL_POLL_SECONDS = 0.25
+MAX_POLL_SECONDS = 5
+
+class CopyStatus(Enum):
+    SUCCESS = "success"
+    PENDING = "pending"
+    ABORTED = "aborted"
+    FAILED = "failed"
+    TIMEOUT = "timeout" # custom status
+
+# What happened to the copy of one blob. latency_seconds runs from the copy request to the poll that
+# saw it finish, error holds the exception of a copy that could not be started or polled.
+class CopyOutcome(object):
+    def __init__(self, source_url, destination_container, destination_blob_name, status=CopyStatus.PENDING,
+                 latency_seconds=None, error=None):
+        self.source_url = source_url
+        self.destination_container = destination_container
+        self.destination_blob_name = destination_blob_name
+        self.status = status
+        self.latency_seconds = latency_seconds
+        self.error = error
+
+# Outcomes of a copy_blobs call keyed by source URL, with the wall clock time it took
+class CopyReport(object):
+    def __init__(self, outcomes, elapsed_seconds, polls):
+        self.outcomes = outcomes
+        self.elapsed_seconds = elapsed_seconds
+        self.polls = polls
+
+    def with_status(self, status):
+        return [outcome for outcome in self.outcomes.values() if outcome.status == status]
+
+    # Throughput and the nearest rank latency percentiles of the copies that succeeded
+    def metrics(self):
+        latencies = sorted(outcome.latency_seconds for outcome in self.with_status(CopyStatus.SUCCESS))
+        metrics = {
+            "copies": len(self.outcomes),
+            "succeeded": len(latencies),
+            "failed": len(self.outcomes) - len(latencies),
+            "polls": self.polls,
+            "elapsed_seconds": self.elapsed_seconds,
+            "copies_per_second": len(latencies) / self.elapsed_seconds if self.elapsed_seconds else 0.0
+        }
+        for pct in (50, 99):
+            rank = max(math.ceil(pct * len(latencies) / 100) - 1, 0)
+            metrics["p{0}_latency_ms".format(pct)] = latencies[rank] * 1000 if latencies else None
+        return metrics
+
+# Copies each (source_url, destination_container, destination_blob_name) with copy_blob. Copies are
+# started on at most max_workers threads, then the pending ones are polled with get_blob_properties,
+# waiting twice as long between each round of polls, until they finish or deadline_seconds have passed.
+# Copies still pending then are reported as TIMEOUT and left to the storage service.
+def copy_blobs(blob_service, copies, max_workers=DEFAULT_COPY_WORKERS, deadline_seconds=DEFAULT_COPY_DEADLINE_SECONDS,
+               initial_poll_seconds=INITIAL_POLL_SECONDS, max_poll_seconds=MAX_POLL_SECONDS):
+    start = time.monotonic()
+    deadline = start + deadline_seconds
+    outcomes = {source_url: CopyOutcome(source_url, container, blob_name) for source_url, container, blob_name in copies}
+    if not outcomes:
+        return CopyReport(outcomes, 0.0, 0)
+    started = {}
+
+    def start_copy(outcome):
+        started[outcome.source_url] = time.monotonic()
+        copy = blob_service.copy_blob(outcome.destination_container, outcome.destination_blob_name, outcome.source_url)
+        return copy.status, time.monotonic()
+
+    def poll_copy(outcome):
+        properties = blob_service.get_blob_properties(outcome.destination_container, outcome.destination_blob_name)
+        return properties.properties.copy.status, time.monotonic()
+
+    # Records the status a worker read from the service, and when it read it. Returns True once the
+    # copy has finished one way or another.
+    def record(outcome, future):
+        try:
+            status, read_at = future.result()
+            outcome.status = CopyStatus(status)
+        except Exception as e:
+            logging.error("ERROR: Copy of {0} failed: {1}".format(outcome.source_url, e))
+            outcome.status = CopyStatus.FAILED
+            outcome.error = e
+            read_at = time.monotonic()
+        if outcome.status != CopyStatus.PENDING:
+            outcome.latency_seconds = read_at - started[outcome.source_url]
+            return True
+        return False
+
+    polls = 0
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(outcomes))) as executor:
+        futures = [(outcome, executor.submit(start_copy, outcome)) for outcome in outcomes.values()]
+        pending = [outcome for outcome, future in futures if not record(outcome, future)]
+
+        poll_seconds = initial_poll_seconds
+        while pending and time.monotonic() < deadline:
+            time.sleep(max(min(poll_seconds, deadline - time.monotonic()), 0))
+            polls += 1
+            futures = [(outcome, executor.submit(poll_copy, outcome)) for outcome in pending]
+            pending = [outcome for outcome, future in futures if not record(outcome, future)]
+            poll_seconds = min(poll_seconds * 2, max_poll_seconds)
+
+    for outcome in pending:
+        logging.warning("Copy of {0} still pending after {1} seconds".format(outcome.source_url, deadline_seconds))
+        outcome.status = CopyStatus.TIMEOUT
+    return CopyReport(outcomes, time.monotonic() - start, polls)
@@ -0,0 +1,101 @@
+import io
+import struct
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+# Bytes requested before falling back to downloading the whole image. PNG and GIF keep their
+# size in the first 24 bytes, JPEG in the frame header that follows any EXIF/ICC segments, which
+# in camera images can hold a thumbnail of a few tens of KB.
+PROBE_BYTES = 64 * 1024
+# Images probed at the same time by probe_all_image_dimensions
+DEFAULT_PROBE_WORKERS = 16
+PROBE_TIMEOUT_SECONDS = 60
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+GIF_SIGNATURES = (b'GIF87a', b'GIF89a')
+# Start of frame markers, the segments that carry the image size. C4, C8 and CC share the range
+# but are Huffman tables, a reserved marker and arithmetic coding conditioning.
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Returns (width, height) from the start of a JPEG, PNG or GIF file, or None when the format
+# is not one of those or data ends before the size
+def parse_image_dimensions(data):
+    if data[:8] == PNG_SIGNATURE:
+        if len(data) >= 24 and data[12:16] == b'IHDR':
+            return struct.unpack('>II', data[16:24])
+        return None
+    if data[:6] in GIF_SIGNATURES:
+        if len(data) >= 10:
+            return struct.unpack('<HH', data[6:10])
+        return None
+    if data[:2] == b'\xff\xd8':
+        return _parse_jpeg_dimensions(data)
+    return None
+
+def _parse_jpeg_dimensions(data):
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length
+            offset += 2
+        elif marker in JPEG_SOF_MARKERS:
+            if offset + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        elif marker in (0xD9, 0xDA):
+            # End of image or start of scan without a frame header
+            return None
+        else:
+            offset += 2 + struct.unpack('>H', data[offset + 2:offset + 4])[0]
+    return None
+
+# Reads the size of the image at url from a ranged GET of its first probe_bytes. Only when the
+# size is not in that prefix, or the format is not JPEG, PNG or GIF, is the whole image fetched.
+def probe_image_dimensions(url, probe_bytes=PROBE_BYTES):
+    request = Request(url, headers={"Range": "bytes=0-{0}".format(probe_bytes - 1)})
+    # A server that ignores Range answers 200 with the whole image, only the prefix is read from it
+    with urlopen(request, timeout=PROBE_TIMEOUT_SECONDS) as response:
+        dimensions = parse_image_dimensions(response.read(probe_bytes))
+    if dimensions:
+        return dimensions
+
+    logging.debug("Size of %s not found in its first %s bytes, fetching the whole image", url, probe_bytes)
+    with urlopen(url, timeout=PROBE_TIMEOUT_SECONDS) as response:
+        data = response.read()
+    dimensions = parse_image_dimensions(data)
+    if dimensions:
+        return dimensions
+    # Pillow is only needed for the formats the header parser does not know
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size
+
+# Reads the size of an image from a seekable file object, leaving it positioned at its start
+def read_image_dimensions(image_file):
+    dimensions = parse_image_dimensions(image_file.read(PROBE_BYTES))
+    image_file.seek(0)
+    if dimensions:
+        return dimensions
+    from PIL import Image
+    # Closing the image leaves a file object that was passed in open
+    with Image.open(image_file) as img:
+        dimensions = img.size
+    image_file.seek(0)
+    return dimensions
+
+# Probes every url on at most max_workers threads and returns a dictionary of url to (width, height).
+# Raises the first error any probe hit.
+def probe_all_image_dimensions(urls, max_workers=DEFAULT_PROBE_WORKERS):
+    urls = list(urls)
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+        return dict(zip(urls, executor.map(probe_image_dimensions, urls)))
@@ -0,0 +1,156 @@
+import time
+import threading
+import unittest
+from unittest.mock import patch
+
+from . import copy_engine
+from .copy_engine import CopyStatus, CopyOutcome, CopyReport, copy_blobs
+from . import copy_images_to_permanent_storage
+
+class FakeCopy:
+    def __init__(self, status):
+        self.status = status
+
+class FakeProperties:
+    def __init__(self, status):
+        self.copy = FakeCopy(status)
+
+class FakeBlob:
+    def __init__(self, status):
+        self.properties = FakeProperties(status)
+
+# In memory stand in for BlockBlobService. A copy from a source in pending_polls stays pending for that
+# many polls, one in final_status ends with that status instead of success, and one in missing fails
+# to start. Records how many calls were in flight at the same time.
+class FakeBlockBlobService:
+    def __init__(self, pending_polls=None, final_status=None, missing=(), delay=0):
+        self.pending_polls = dict(pending_polls or {})
+        self.final_status = final_status or {}
+        self.missing = set(missing)
+        self.delay = delay
+        self.blobs = {}
+        self.polls = 0
+        self.active = 0
+        self.most_active = 0
+        self.lock = threading.Lock()
+
+    def _call(self):
+        with self.lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+
+    def _status(self, source_url):
+        if self.pending_polls.get(source_url, 0) > 0:
+            return "pending"
+        return self.final_status.get(source_url, "success")
+
+    def copy_blob(self, container_name, blob_name, copy_source):
+        self._call()
+        if copy_source in self.missing:
+            raise Exception("The specified blob does not exist.")
+        self.blobs[(container_name, blob_name)] = copy_source
+        return FakeCopy(self._status(copy_source))
+
+    def get_blob_properties(self, container_name, blob_name):
+        self._call()
+        source_url = self.blobs[(container_name, blob_name)]
+        with self.lock:
+            self.polls += 1
+            if source_url in self.pending_polls:
+                self.pending_polls[source_url] -= 1
+        return FakeBlob(self._status(source_url))
+
+    def make_blob_url(self, container_name, blob_name):
+        return "https://perm.blob.core.windows.net/{0}/{1}".format(container_name, blob_name)
+
+# Clock that only moves when slept on, recording every sleep
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def copies(count):
+    return [("https://temp/{0}.jpg".format(i), "perm", "{0}.jpg".format(i)) for i in range(count)]
+
+class TestCopyBlobs(unittest.TestCase):
+    def test_copies_start_on_a_bounded_pool(self):
+        blob_service = FakeBlockBlobService(delay=0.02)
+        report = copy_blobs(blob_service, copies(12), max_workers=3)
+        self.assertEqual(3, blob_service.most_active)
+        self.assertEqual(12, len(report.with_status(CopyStatus.SUCCESS)))
+        self.assertEqual(0, report.polls)
+        self.assertEqual({("perm", "{0}.jpg".format(i)) for i in range(12)}, set(blob_service.blobs))
+
+    def test_pending_copies_are_polled_with_backoff(self):
+        fake_time = FakeTime()
+        blob_service = FakeBlockBlobService(pending_polls={"https://temp/0.jpg": 4, "https://temp/1.jpg": 1})
+        with patch.object(copy_engine, "time", fake_time):
+            report = copy_blobs(blob_service, copies(3), initial_poll_seconds=0.25, max_poll_seconds=1)
+
+        self.assertEqual([0.25, 0.5, 1, 1], fake_time.sleeps)
+        self.assertEqual(4, report.polls)
+        # Only copies still pending are polled again
+        self.assertEqual(5, blob_service.polls)
+        latencies = {url: outcome.latency_seconds for url, outcome in report.outcomes.items()}
+        self.assertEqual({"https://temp/0.jpg": 2.75, "https://temp/1.jpg": 0.25, "https://temp/2.jpg": 0}, latencies)
+
+    def test_copies_pending_at_the_deadline_time_out(self):
+        fake_time = FakeTime()
+        blob_service = FakeBlockBlobService(pending_polls={"https://temp/0.jpg": 100})
+        with patch.object(copy_engine, "time", fake_time):
+            report = copy_blobs(blob_service, copies(2), deadline_seconds=2, initial_poll_seconds=0.25)
+
+        self.assertEqual([0.25, 0.5, 1, 0.25], fake_time.sleeps)
+        self.assertEqual(CopyStatus.TIMEOUT, report.outcomes["https://temp/0.jpg"].status)
+        self.assertIsNone(report.outcomes["https://temp/0.jpg"].latency_seconds)
+        self.assertEqual(CopyStatus.SUCCESS, report.outcomes["https://temp/1.jpg"].status)
+
+    def test_each_copy_gets_its_own_outcome(self):
+        blob_service = FakeBlockBlobService(pending_polls={"https://temp/1.jpg": 1},
+                                            final_status={"https://temp/1.jpg": "aborted", "https://temp/2.jpg": "failed"},
+                                            missing={"https://temp/3.jpg"})
+        report = copy_blobs(blob_service, copies(4), initial_poll_seconds=0.001)
+
+        statuses = {url: outcome.status for url, outcome in report.outcomes.items()}
+        self.assertEqual({"https://temp/0.jpg": CopyStatus.SUCCESS, "https://temp/1.jpg": CopyStatus.ABORTED,
+                          "https://temp/2.jpg": CopyStatus.FAILED, "https://temp/3.jpg": CopyStatus.FAILED}, statuses)
+        self.assertIn("does not exist", str(report.outcomes["https://temp/3.jpg"].error))
+        self.assertIsNone(report.outcomes["https://temp/2.jpg"].error)
+
+    def test_no_copies(self):
+        report = copy_blobs(FakeBlockBlobService(), [])
+        self.assertEqual({}, report.outcomes)
+        self.assertEqual(0, report.metrics()["copies"])
+
+class TestCopyReport(unittest.TestCase):
+    def test_metrics(self):
+        outcomes = {str(i): CopyOutcome(str(i), "perm", str(i), CopyStatus.SUCCESS, latency_seconds=i / 100)
+                    for i in range(1, 101)}
+        outcomes["failed"] = CopyOutcome("failed", "perm", "failed", CopyStatus.FAILED)
+        metrics = CopyReport(outcomes, 4.0, 2).metrics()
+        self.assertEqual({"copies": 101, "succeeded": 100, "failed": 1, "polls": 2, "elapsed_seconds": 4.0,
+                          "copies_per_second": 25.0}, {key: metrics[key] for key in metrics if "latency" not in key})
+        self.assertAlmostEqual(500, metrics["p50_latency_ms"])
+        self.assertAlmostEqual(990, metrics["p99_latency_ms"])
+
+class TestCopyImagesToPermanentStorage(unittest.TestCase):
+    def test_succeeded_and_failed_copies(self):
+        blob_service = FakeBlockBlobService(missing={"https://temp/b.png"})
+        copy_succeeded_dict, copy_error_dict, report = copy_images_to_permanent_storage(
+            {"https://temp/a.jpg": 1, "https://temp/b.png": 2}, "temp", "perm", blob_service)
+        self.assertEqual({"https://temp/a.jpg": "https://perm.blob.core.windows.net/perm/1.jpg"}, copy_succeeded_dict)
+        self.assertEqual({"https://temp/b.png": "https://perm.blob.core.windows.net/perm/2.png"}, copy_error_dict)
+        self.assertEqual(1, report.metrics()["succeeded"])
+
+if __name__ == '__main__':
+    unittest.main()
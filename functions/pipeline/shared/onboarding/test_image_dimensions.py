@@ -0,0 +1,114 @@
+import io
+import time
+import struct
+import threading
+import unittest
+from unittest.mock import patch
+
+from . import image_dimensions
+from .image_dimensions import (
+    parse_image_dimensions,
+    read_image_dimensions,
+    probe_image_dimensions,
+    probe_all_image_dimensions
+)
+
+def png(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+
+def gif(width, height):
+    return b'GIF89a' + struct.pack('<HHBBB', width, height, 0, 0, 0)
+
+def jpeg_segment(marker, payload):
+    return bytes([0xFF, marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+# SOI, JFIF APP0, an APP1 segment of exif_bytes standing in for EXIF, a quantization table
+# and a baseline frame header
+def jpeg(width, height, exif_bytes=16):
+    return (b'\xff\xd8' + jpeg_segment(0xE0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00') +
+            jpeg_segment(0xE1, b'Exif\x00\x00' + b'\x00' * exif_bytes) + jpeg_segment(0xDB, b'\x00' * 65) +
+            jpeg_segment(0xC0, struct.pack('>BHHB', 8, height, width, 3) + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01') +
+            jpeg_segment(0xDA, b'\x00' * 10) + b'\x00' * 100 + b'\xff\xd9')
+
+# Serves bytes for any url and records the Range header of every request
+class FakeUrlopen:
+    def __init__(self, data, delay=0):
+        self.data = data
+        self.delay = delay
+        self.ranges = []
+        self.active = 0
+        self.most_active = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, request, timeout=None):
+        with self.lock:
+            self.ranges.append(request.get_header("Range") if hasattr(request, "get_header") else None)
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        return io.BytesIO(self.data)
+
+class TestParseImageDimensions(unittest.TestCase):
+    def test_png(self):
+        self.assertEqual((640, 480), parse_image_dimensions(png(640, 480)))
+
+    def test_gif(self):
+        self.assertEqual((320, 200), parse_image_dimensions(gif(320, 200)))
+
+    def test_jpeg(self):
+        self.assertEqual((4000, 3000), parse_image_dimensions(jpeg(4000, 3000)))
+
+    def test_progressive_jpeg(self):
+        data = jpeg(800, 600).replace(b'\xff\xc0', b'\xff\xc2')
+        self.assertEqual((800, 600), parse_image_dimensions(data))
+
+    def test_jpeg_frame_header_past_prefix(self):
+        data = jpeg(4000, 3000, exif_bytes=30000)
+        self.assertIsNone(parse_image_dimensions(data[:16 * 1024]))
+        self.assertEqual((4000, 3000), parse_image_dimensions(data))
+
+    def test_truncated_and_unknown_formats(self):
+        self.assertIsNone(parse_image_dimensions(png(640, 480)[:20]))
+        self.assertIsNone(parse_image_dimensions(gif(320, 200)[:8]))
+        self.assertIsNone(parse_image_dimensions(b'BM' + b'\x00' * 64))
+        self.assertIsNone(parse_image_dimensions(b''))
+
+class TestReadImageDimensions(unittest.TestCase):
+    def test_reads_size_and_rewinds(self):
+        data = jpeg(1024, 768, exif_bytes=8000)
+        image_file = io.BytesIO(data)
+        self.assertEqual((1024, 768), read_image_dimensions(image_file))
+        self.assertEqual(data, image_file.read())
+
+class TestProbeImageDimensions(unittest.TestCase):
+    def test_reads_a_ranged_prefix(self):
+        fake_urlopen = FakeUrlopen(jpeg(1024, 768))
+        with patch.object(image_dimensions, "urlopen", fake_urlopen):
+            self.assertEqual((1024, 768), probe_image_dimensions("https://host/a.jpg", probe_bytes=4096))
+        self.assertEqual(["bytes=0-4095"], fake_urlopen.ranges)
+
+    def test_falls_back_to_full_fetch(self):
+        fake_urlopen = FakeUrlopen(jpeg(1024, 768, exif_bytes=8000))
+        with patch.object(image_dimensions, "urlopen", fake_urlopen):
+            self.assertEqual((1024, 768), probe_image_dimensions("https://host/a.jpg", probe_bytes=4096))
+        self.assertEqual(["bytes=0-4095", None], fake_urlopen.ranges)
+
+    def test_probes_are_bounded(self):
+        fake_urlopen = FakeUrlopen(png(10, 20), delay=0.02)
+        urls = ["https://host/{0}.png".format(i) for i in range(12)]
+        with patch.object(image_dimensions, "urlopen", fake_urlopen):
+            dimensions = probe_all_image_dimensions(urls, max_workers=3)
+        self.assertEqual({url: (10, 20) for url in urls}, dimensions)
+        self.assertEqual(3, fake_urlopen.most_active)
+
+    def test_probe_errors_are_raised(self):
+        def failing_urlopen(request, timeout=None):
+            raise IOError("not found")
+        with patch.object(image_dimensions, "urlopen", failing_urlopen):
+            with self.assertRaises(IOError):
+                probe_all_image_dimensions(["https://host/missing.png"])
+
+if __name__ == '__main__':
+    unittest.main()
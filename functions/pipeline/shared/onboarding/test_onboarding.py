@@ -0,0 +1,285 @@
+import io
+import json
+import struct
+import unittest
+from unittest.mock import patch, MagicMock
+
+from .. import onboarding
+from . import (
+    download_image,
+    is_azure_blob_url,
+    copy_blob_from_url,
+    build_onboarding_messages,
+    read_onboarding_message,
+    onboard_image_batch,
+    enqueue_container_page
+)
+from ..db_access import OnboardingJobStatus
+
+def png(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+
+def descriptor(name):
+    return {
+        "imageUrl": "https://host/container/{0}.png?sig=x".format(name),
+        "fileName": name + ".png",
+        "fileExtension": ".png",
+        "directoryComponents": "/dir"
+    }
+
+# Serves a 30x20 png for every url except those with bad in them
+def fake_urlopen(url, timeout=None):
+    if "bad" in url:
+        raise IOError("not found")
+    return io.BytesIO(png(30, 20))
+
+# Stands in for ImageTagDataAccess, handing out ids from 1
+class FakeDataAccess:
+    def __init__(self):
+        self.image_infos = []
+        self.updated_urls = {}
+
+    def create_user(self, user_name):
+        return 7
+
+    def add_new_images(self, image_infos, user_id):
+        self.image_infos.extend(image_infos)
+        return {info.image_location: i + 1 for i, info in enumerate(image_infos)}
+
+    def update_image_urls(self, image_id_to_url_map, user_id):
+        self.updated_urls.update(image_id_to_url_map)
+        return list(image_id_to_url_map)
+
+class FakeBlobService:
+    def __init__(self):
+        self.blobs = {}
+
+    def create_blob_from_stream(self, container_name, blob_name, stream, metadata=None):
+        if blob_name.startswith("2"):
+            raise IOError("upload failed")
+        self.blobs[blob_name] = (stream.read(), metadata)
+
+    def make_blob_url(self, container_name, blob_name):
+        return "https://perm/{0}/{1}".format(container_name, blob_name)
+
+class TestDownloadImage(unittest.TestCase):
+    def test_small_images_stay_in_memory(self):
+        with patch.object(onboarding, "urlopen", lambda url, timeout=None: io.BytesIO(b"image bytes")):
+            with download_image("https://host/a.jpg") as image_file:
+                self.assertFalse(image_file._rolled)
+                self.assertEqual(b"image bytes", image_file.read())
+
+    def test_large_images_are_spooled_to_disk(self):
+        data = b"x" * 1024
+        with patch.object(onboarding, "urlopen", lambda url, timeout=None: io.BytesIO(data)):
+            with download_image("https://host/a.jpg", spool_max_bytes=100) as image_file:
+                self.assertTrue(image_file._rolled)
+                self.assertEqual(data, image_file.read())
+
+class TestServerSideCopy(unittest.TestCase):
+    def test_is_azure_blob_url(self):
+        self.assertTrue(is_azure_blob_url("https://account.blob.core.windows.net/container/a.jpg?sv=1"))
+        self.assertFalse(is_azure_blob_url("https://example.com/container/a.jpg"))
+
+    def test_copy_sends_metadata(self):
+        blob_service = MagicMock()
+        blob_service.copy_blob.return_value.status = "success"
+        copy_blob_from_url(blob_service, "perm", "1.jpg", "https://a.blob.core.windows.net/c/a.jpg", {"k": "v"})
+        blob_service.copy_blob.assert_called_once_with("perm", "1.jpg", "https://a.blob.core.windows.net/c/a.jpg",
+                                                       metadata={"k": "v"}, requires_sync=True)
+
+    def test_unfinished_copy_raises(self):
+        blob_service = MagicMock()
+        blob_service.copy_blob.return_value.status = "failed"
+        with self.assertRaises(Exception):
+            copy_blob_from_url(blob_service, "perm", "1.jpg", "https://a.blob.core.windows.net/c/a.jpg")
+
+class TestOnboardingMessages(unittest.TestCase):
+    def test_messages_hold_batch_size_images(self):
+        descriptors = [descriptor(str(i)) for i in range(5)]
+        messages = [json.loads(m) for m in build_onboarding_messages("user", descriptors, batch_size=2)]
+        self.assertEqual([2, 2, 1], [len(m["images"]) for m in messages])
+        self.assertEqual(descriptors, [d for m in messages for d in m["images"]])
+        self.assertTrue(all(m["userName"] == "user" for m in messages))
+
+    def test_large_batches_are_split(self):
+        descriptors = [descriptor("x" * 4000 + str(i)) for i in range(16)]
+        messages = build_onboarding_messages("user", descriptors, batch_size=16)
+        self.assertGreater(len(messages), 1)
+        self.assertTrue(all(len(m) <= onboarding.MAX_MESSAGE_BYTES for m in messages))
+        self.assertEqual(descriptors, [d for m in messages for d in json.loads(m)["images"]])
+
+    def test_invalid_batch_size(self):
+        with self.assertRaises(ValueError):
+            build_onboarding_messages("user", [], batch_size=0)
+
+    def test_reads_single_image_messages(self):
+        msg_json = dict(descriptor("a"), userName="user")
+        self.assertEqual(("user", [descriptor("a")]), read_onboarding_message(msg_json))
+        self.assertEqual(("user", [descriptor("a")]),
+                         read_onboarding_message({"userName": "user", "images": [descriptor("a")]}))
+
+class TestOnboardImageBatch(unittest.TestCase):
+    def test_bad_images_do_not_fail_the_batch(self):
+        data_access = FakeDataAccess()
+        blob_service = FakeBlobService()
+        descriptors = [descriptor("a"), descriptor("bad"), descriptor("b"), descriptor("c")]
+        with patch.object(onboarding, "urlopen", fake_urlopen):
+            image_ids, failures = onboard_image_batch(data_access, blob_service, "perm", "user", descriptors)
+
+        # The bad image is not inserted, the second inserted image fails to upload
+        self.assertEqual(["a.png", "b.png", "c.png"], [info.image_name for info in data_access.image_infos])
+        self.assertEqual([(20, 30)] * 3, [(info.height, info.width) for info in data_access.image_infos])
+        self.assertEqual([1, 3], image_ids)
+        self.assertEqual({1: "https://perm/perm/1.png", 3: "https://perm/perm/3.png"}, data_access.updated_urls)
+        self.assertEqual({descriptors[1]["imageUrl"], descriptors[2]["imageUrl"]}, set(failures))
+        self.assertEqual((png(30, 20), {"userFilePath": "/dir", "originalFilename": "a.png", "uploadUser": "user"}),
+                         blob_service.blobs["1.png"])
+
+    def test_nothing_fetched(self):
+        data_access = MagicMock()
+        with patch.object(onboarding, "urlopen", fake_urlopen):
+            image_ids, failures = onboard_image_batch(data_access, FakeBlobService(), "perm", "user",
+                                                      [descriptor("bad")])
+        self.assertEqual([], image_ids)
+        self.assertEqual(1, len(failures))
+        data_access.add_new_images.assert_not_called()
+
+    def test_server_side_copy(self):
+        data_access = FakeDataAccess()
+        blob_service = MagicMock()
+        blob_service.copy_blob.return_value.status = "success"
+        blob = dict(descriptor("a"), imageUrl="https://account.blob.core.windows.net/c/a.png?sig=x")
+        with patch.object(onboarding, "probe_image_dimensions", lambda url: (30, 20)):
+            image_ids, failures = onboard_image_batch(data_access, blob_service, "perm", "user", [blob],
+                                                      server_side_copy=True)
+        self.assertEqual(([1], {}), (image_ids, failures))
+        blob_service.create_blob_from_stream.assert_not_called()
+        self.assertEqual(blob["imageUrl"], blob_service.copy_blob.call_args[0][2])
+
+class FakeBlob:
+    def __init__(self, name):
+        self.name = name
+
+class FakeBlobList:
+    def __init__(self, names, next_marker):
+        self.items = [FakeBlob(name) for name in names]
+        self.next_marker = next_marker
+
+# Lists a container of blob names in pages, the marker being the index of the next blob
+class FakeContainer:
+    def __init__(self, names):
+        self.names = names
+        self.markers = []
+
+    def list_blobs(self, container_name, num_results=None, marker=None):
+        self.markers.append(marker)
+        start = int(marker or 0)
+        end = start + num_results
+        return FakeBlobList(self.names[start:end], str(end) if end < len(self.names) else "")
+
+    def make_blob_url(self, container_name, blob_name, sas_token=None):
+        return "https://account.blob.core.windows.net/{0}/{1}?{2}".format(container_name, blob_name, sas_token)
+
+# Puts to failing_queue raise, as when the queue service is unavailable
+class FakeQueueService:
+    def __init__(self, failing_queue=None):
+        self.messages = []
+        self.failing_queue = failing_queue
+
+    def put_message(self, queue_name, content):
+        if queue_name == self.failing_queue:
+            raise Exception("The queue service is unavailable.")
+        self.messages.append((queue_name, json.loads(content)))
+
+    def queued(self, queue_name):
+        return [body for name, body in self.messages if name == queue_name]
+
+# Keeps one onboarding job with the rules of list_onboarding_job_page
+class FakeJobDataAccess:
+    def __init__(self):
+        self.job = {"id": 4, "storage_container": "photos", "status": OnboardingJobStatus.RUNNING.value,
+                    "next_marker": None, "pages_listed": 0, "blobs_listed": 0, "images_queued": 0}
+
+    def get_onboarding_job(self, job_id):
+        return dict(self.job)
+
+    def list_onboarding_job_page(self, job_id, page, list_page):
+        if self.job["status"] != OnboardingJobStatus.RUNNING.value or self.job["pages_listed"] != page:
+            return False
+        next_marker, blobs_listed, images_queued = list_page(dict(self.job))
+        self.job.update(next_marker=next_marker or None, pages_listed=page + 1,
+                        blobs_listed=self.job["blobs_listed"] + blobs_listed,
+                        images_queued=self.job["images_queued"] + images_queued,
+                        status=(OnboardingJobStatus.RUNNING if next_marker else OnboardingJobStatus.COMPLETED).value)
+        return True
+
+class TestEnqueueContainerPage(unittest.TestCase):
+    def test_job_walks_the_container_page_by_page(self):
+        names = ["a/b/{0}.jpg".format(i) for i in range(5)] + ["notes.txt", "top.PNG"]
+        container = FakeContainer(names)
+        queue_service = FakeQueueService()
+        data_access = FakeJobDataAccess()
+        page_msg = {"jobId": 4, "page": 0, "userName": "user", "sasToken": "sig=x"}
+        pages = 0
+        while page_msg:
+            page_msg = enqueue_container_page(data_access, container, queue_service, page_msg, page_size=3,
+                                              batch_size=2)
+            page_msg = page_msg and json.loads(page_msg)
+            pages += 1
+
+        self.assertEqual(3, pages)
+        self.assertEqual([None, "3", "6"], container.markers)
+        self.assertEqual({"status": "completed", "pages_listed": 3, "blobs_listed": 7, "images_queued": 6},
+                         {key: data_access.job[key] for key in ("status", "pages_listed", "blobs_listed", "images_queued")})
+        images = [image for body in queue_service.queued("onboardqueue") for image in body["images"]]
+        self.assertEqual([1, 2], [body["page"] for body in queue_service.queued("onboardjobqueue")])
+        self.assertEqual(["0.jpg", "1.jpg", "2.jpg", "3.jpg", "4.jpg", "top.PNG"], [i["fileName"] for i in images])
+        self.assertEqual({"imageUrl": "https://account.blob.core.windows.net/photos/a/b/0.jpg?sig=x",
+                          "fileName": "0.jpg", "fileExtension": ".jpg", "directoryComponents": "/a/b"}, images[0])
+        self.assertEqual("", images[-1]["directoryComponents"])
+
+    def test_page_delivered_twice_is_skipped(self):
+        container = FakeContainer(["{0}.jpg".format(i) for i in range(5)])
+        queue_service = FakeQueueService()
+        data_access = FakeJobDataAccess()
+        page_msg = {"jobId": 4, "page": 0, "userName": "user", "sasToken": "sig=x"}
+        self.assertIsNotNone(enqueue_container_page(data_access, container, queue_service, page_msg, page_size=3))
+        self.assertIsNone(enqueue_container_page(data_access, container, queue_service, page_msg, page_size=3))
+        self.assertEqual([None], container.markers)
+        self.assertEqual(1, len(queue_service.queued("onboardqueue")))
+        self.assertEqual(1, len(queue_service.queued("onboardjobqueue")))
+
+    def test_next_page_is_queued_again_when_its_put_failed_after_the_checkpoint(self):
+        container = FakeContainer(["{0}.jpg".format(i) for i in range(5)])
+        queue_service = FakeQueueService(failing_queue="onboardjobqueue")
+        data_access = FakeJobDataAccess()
+        page_msg = {"jobId": 4, "page": 0, "userName": "user", "sasToken": "sig=x"}
+        with self.assertRaises(Exception):
+            enqueue_container_page(data_access, container, queue_service, page_msg, page_size=3)
+        self.assertEqual(1, data_access.job["pages_listed"])
+        self.assertEqual([], queue_service.queued("onboardjobqueue"))
+
+        # The host delivers the message again once the queue is back
+        queue_service.failing_queue = None
+        next_page_msg = enqueue_container_page(data_access, container, queue_service, page_msg, page_size=3,
+                                               redelivered=True)
+        self.assertEqual(1, json.loads(next_page_msg)["page"])
+        self.assertEqual([1], [body["page"] for body in queue_service.queued("onboardjobqueue")])
+        # The page itself is not listed or queued again
+        self.assertEqual([None], container.markers)
+        self.assertEqual(1, len(queue_service.queued("onboardqueue")))
+
+    def test_redelivered_last_page_queues_nothing(self):
+        container = FakeContainer(["{0}.jpg".format(i) for i in range(2)])
+        queue_service = FakeQueueService()
+        data_access = FakeJobDataAccess()
+        page_msg = {"jobId": 4, "page": 0, "userName": "user", "sasToken": "sig=x"}
+        self.assertIsNone(enqueue_container_page(data_access, container, queue_service, page_msg, page_size=3))
+        self.assertIsNone(enqueue_container_page(data_access, container, queue_service, page_msg, page_size=3,
+                                                 redelivered=True))
+        self.assertEqual("completed", data_access.job["status"])
+        self.assertEqual([], queue_service.queued("onboardjobqueue"))
+
+if __name__ == '__main__':
+    unittest.main()
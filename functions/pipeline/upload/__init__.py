@@ -1,7 +1,7 @@
 import json
 import logging
 from ..shared.db_provider import get_postgres_provider
-from ..shared.db_access import ImageTag, ImageTagDataAccess
+from ..shared.db_access import ImageTag, AsyncImageTagDataAccess
 
 import azure.functions as func
 
@@ -13,7 +13,7 @@ def __create_ImageTag_list(image_id, tags_list):
         image_tags.append(ImageTag(image_id, tag['x1'], tag['x2'], tag['y1'], tag['y2'], tag['classes']))
     return image_tags
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
         # TODO: Create if check for userId and valid json checks?
         upload_data = req.get_json()
@@ -27,8 +27,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             )
 
         # DB configuration
-        data_access = ImageTagDataAccess(get_postgres_provider())
-        user_id = data_access.create_user(user_name)
+        data_access = AsyncImageTagDataAccess(get_postgres_provider())
+        user_id = await data_access.create_user(user_name)
 
         # Update tagged images
         ids_to_tags = upload_data["imageIdToTags"]
@@ -40,15 +40,15 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
         logging.info("Update all visited images with tags and set state to completed")
         unique_class_names = upload_data["uniqueClassNames"]
-        class_map = data_access.get_classification_map(unique_class_names,user_id)
+        class_map = await data_access.get_classification_map(unique_class_names,user_id)
         annotated_labels = data_access.convert_to_annotated_label(all_imagetags,class_map)
-        data_access.update_tagged_images_v2(annotated_labels,user_id)
+        await data_access.update_tagged_images_v2(annotated_labels,user_id)
 
         logging.info("Update visited but no tags identified images")
-        data_access.update_completed_untagged_images(upload_data["imagesVisitedNoTag"], user_id)
+        await data_access.update_completed_untagged_images(upload_data["imagesVisitedNoTag"], user_id)
 
         logging.info("Update unvisited/incomplete images")
-        data_access.update_incomplete_images(upload_data["imagesNotVisited"], user_id)
+        await data_access.update_incomplete_images(upload_data["imagesNotVisited"], user_id)
 
         return func.HttpResponse(
             body=json.dumps(upload_data),
@@ -0,0 +1,61 @@
+import unittest
+import sys
+import os
+import tempfile
+import shutil
+from pathlib import Path
+
+# Allow us to import files from "train" and the packages it imports from the repo root
+repo_dir = str(Path(__file__).resolve().parent.parent)
+train_dir = str(Path(repo_dir) / "train")
+for path in (repo_dir, train_dir):
+    if path not in sys.path:
+        sys.path.append(path)
+from unittest.mock import patch, Mock
+from training import convert_labels_to_csv, read_label_cache, get_image_pages
+
+def image_labels(name, *class_names):
+    return {"imagelocation": "https://storage/perm-uploads/" + name, "image_height": 600, "image_width": 400,
+            "labels": [{"classificationname": class_name, "x_min": 1, "x_max": 2, "y_min": 3, "y_max": 4}
+                       for class_name in class_names]}
+
+class LabelCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.tagged_output = os.path.join(self.temp_dir, "tagged.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_no_cache(self):
+        self.assertEqual((None, {}), read_label_cache(self.tagged_output))
+
+    def test_delta_replaces_cached_images(self):
+        convert_labels_to_csv([image_labels("1.jpg", "cat"), image_labels("2.jpg", "dog")], self.tagged_output, None, "10")
+        labels_cursor, cached_rows = read_label_cache(self.tagged_output)
+        self.assertEqual("10", labels_cursor)
+
+        convert_labels_to_csv([image_labels("2.jpg", "dog", "cat"), image_labels("3.jpg", "cat")],
+                              self.tagged_output, cached_rows, "12")
+        labels_cursor, cached_rows = read_label_cache(self.tagged_output)
+        self.assertEqual("12", labels_cursor)
+        self.assertEqual(["1.jpg", "2.jpg", "3.jpg"], sorted(cached_rows))
+        self.assertEqual(["dog", "cat"], [row[1] for row in cached_rows["2.jpg"]])
+
+    def test_missing_cursor_drops_cache(self):
+        convert_labels_to_csv([image_labels("1.jpg", "cat")], self.tagged_output, None, "10")
+        convert_labels_to_csv([image_labels("1.jpg", "cat")], self.tagged_output)
+        self.assertEqual((None, {}), read_label_cache(self.tagged_output))
+
+class ImagePagesTestCase(unittest.TestCase):
+    @patch('training.requests.get')
+    def test_follows_cursor_until_last_page(self, get):
+        get.side_effect = [Mock(json=Mock(return_value=[{"location": "1.jpg"}]), headers={"x-images-cursor": "10_1"}),
+                           Mock(json=Mock(return_value=[{"location": "2.jpg"}]), headers={})]
+        pages = list(get_image_pages("http://function/api/images", {"tagStatus": "1,4"}, 1))
+        self.assertEqual([[{"location": "1.jpg"}], [{"location": "2.jpg"}]], pages)
+        self.assertEqual({"tagStatus": "1,4", "pageSize": 1}, get.call_args_list[0][1]["params"])
+        self.assertEqual("10_1", get.call_args_list[1][1]["params"]["cursor"])
+
+if __name__ == '__main__':
+    unittest.main()
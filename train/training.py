@@ -11,11 +11,15 @@ import time
 from functions.pipeline.shared.db_access import ImageTagState
 
 CONFIG_PATH = os.environ.get('ALCONFIG', None)
+IMAGES_PAGE_SIZE = 1000
 
-def train(config, num_images):
+def train(config, num_images, full_refresh=False):
+
+    # Read the labels cached by the last run before the training location is cleaned out
+    labels_cursor, cached_rows = (None, {}) if full_refresh else read_label_cache(config.get('tagged_output'))
 
     # First, downloxad data necessary for training
-    training_data = download_data_for_training(config, num_images)
+    training_data = download_data_for_training(config, num_images, labels_cursor)
 
     # Make sure directory is clean:
     file_location = Config.initialize_training_location(config)
@@ -24,7 +28,8 @@ def train(config, num_images):
     download_images(training_data["imageURLs"], config.get('training_image_dir'))
 
     # create csv file from this data
-    convert_labels_to_csv(training_data["taggedLabelData"],config.get('tagged_output'))
+    convert_labels_to_csv(training_data["taggedLabelData"],config.get('tagged_output'),
+                          cached_rows, training_data["labelsCursor"])
 
 
 def download_images(imageURLs, file_location): 
@@ -47,33 +52,81 @@ def download_images(imageURLs, file_location):
     print("Downloaded images into " + file_location)
 
 
-def download_data_for_training(config, num_images):
+def download_data_for_training(config, num_images, labels_cursor=None):
     print("Downloading data for training, this may take a few moments...")
     # Download n images that are ready to tag
     query = {
         "userName": config.get('tagging_user'),
-        "imageCount": num_images,
-        "tagStatus": [  int(ImageTagState.READY_TO_TAG),
-                        int(ImageTagState.TAG_IN_PROGRESS),
-                        int(ImageTagState.COMPLETED_TAG),
-                        int(ImageTagState.INCOMPLETE_TAG)]
+        "tagStatus": ",".join(str(int(state)) for state in (ImageTagState.READY_TO_TAG,
+                                                            ImageTagState.TAG_IN_PROGRESS,
+                                                            ImageTagState.COMPLETED_TAG,
+                                                            ImageTagState.INCOMPLETE_TAG))
     }
-    url = config.get('url') + '/api/images'
-    response = requests.get(url, params=query)
-    all_images_json = response.json()
-    image_urls_to_download = [info['location'] for info in all_images_json]
+    image_urls_to_download = []
+    page_size = min(num_images, IMAGES_PAGE_SIZE) if num_images else IMAGES_PAGE_SIZE
+    for page in get_image_pages(config.get('url') + '/api/images', query, page_size):
+        image_urls_to_download.extend(info['location'] for info in page)
+        if num_images and len(image_urls_to_download) >= num_images:
+            del image_urls_to_download[num_images:]
+            break
 
     # Download upto 200 images that have been tagged, for training
     query['tagStatus'] = ImageTagState.COMPLETED_TAG
     query['imageCount'] = 200
+    # Only ask for images tagged since the last run when we still have its labels
+    if labels_cursor is not None:
+        query['since'] = labels_cursor
     url = config.get('url') + '/api/labels'
     response = requests.get(url, params=query)
     tagged_label_data = response.json()
+    print("Downloaded labels for {0} images".format(len(tagged_label_data)))
 
     return { "imageURLs": image_urls_to_download,
-             "taggedLabelData": tagged_label_data }
-
-def convert_labels_to_csv(data, tagging_output_file_path):
+             "taggedLabelData": tagged_label_data,
+             "labelsCursor": response.headers.get('x-labels-cursor') }
+
+# Yields /api/images a page at a time, following the x-images-cursor header until the last page
+def get_image_pages(url, query, page_size=IMAGES_PAGE_SIZE):
+    params = dict(query, pageSize=page_size)
+    while True:
+        response = requests.get(url, params=params)
+        response.raise_for_status()
+        yield response.json()
+        page_cursor = response.headers.get('x-images-cursor')
+        if not page_cursor:
+            return
+        params = dict(params, cursor=page_cursor)
+
+# The cursor of the labels in tagged_output is kept next to it so the next run only
+# downloads the images tagged after it
+def get_label_cursor_path(tagging_output_file_path):
+    return tagging_output_file_path + '.cursor'
+
+def read_label_cache(tagging_output_file_path):
+    cursor_path = get_label_cursor_path(tagging_output_file_path)
+    if not os.path.exists(tagging_output_file_path) or not os.path.exists(cursor_path):
+        return None, {}
+    with open(cursor_path) as cursor_file:
+        labels_cursor = cursor_file.read().strip()
+    rows_by_image = {}
+    with open(tagging_output_file_path, newline='') as csvfile:
+        filereader = csv.reader(csvfile, delimiter=',',quotechar='|')
+        next(filereader, None)
+        for row in filereader:
+            rows_by_image.setdefault(row[0], []).append(row)
+    print("Read cached labels for {0} images".format(len(rows_by_image)))
+    return labels_cursor, rows_by_image
+
+def convert_labels_to_csv(data, tagging_output_file_path, cached_rows=None, labels_cursor=None):
+    # Images in data replace whatever was cached for them
+    rows_by_image = dict(cached_rows or {})
+    for img in data:
+        imagelocation = get_image_name_from_url(img["imagelocation"])
+        image_height = img["image_height"]
+        image_width = img["image_width"]
+        rows_by_image[imagelocation] = [[imagelocation, label["classificationname"], label['x_min'], label['x_max'],
+                                         label['y_min'], label['y_max'], image_height, image_width]
+                                        for label in img["labels"]]
     try:
         if not os.path.exists(tagging_output_file_path):
             dir_name = os.path.dirname(tagging_output_file_path)
@@ -82,13 +135,14 @@ def convert_labels_to_csv(data, tagging_output_file_path):
         with open(tagging_output_file_path, 'w') as csvfile:
             filewriter = csv.writer(csvfile, delimiter=',',quotechar='|', quoting=csv.QUOTE_MINIMAL)
             filewriter.writerow(['filename','class','xmin','xmax','ymin','ymax','height','width'])   
-            for img in data:
-                imagelocation = get_image_name_from_url(img["imagelocation"])
-                image_height = img["image_height"]
-                image_width = img["image_width"]
-                for label in img["labels"]:
-                    data = [imagelocation, label["classificationname"], label['x_min'], label['x_max'], label['y_min'], label['y_max'], image_height, image_width]
-                    filewriter.writerow(data)
+            for rows in rows_by_image.values():
+                filewriter.writerows(rows)
+        cursor_path = get_label_cursor_path(tagging_output_file_path)
+        if labels_cursor is not None:
+            with open(cursor_path, 'w') as cursor_file:
+                cursor_file.write(str(labels_cursor))
+        elif os.path.exists(cursor_path):
+            os.remove(cursor_path)
     except Exception as e:
         print("An error occurred attempting to write to file at {0}:\n\n{1}".format(tagging_output_file_path,e))
         raise
@@ -101,6 +155,8 @@ def get_image_name_from_url(image_url):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-n', '--num-images', type=int)
+    parser.add_argument('-f', '--full-refresh', action='store_true',
+                        help='Ignore the cached labels and download all of them')
     config = Config.read_config(CONFIG_PATH)
     args = parser.parse_args()
-    train(config, args.num_images)
+    train(config, args.num_images, args.full_refresh)
@@ -38,7 +38,8 @@ def build_id_to_VottImageTag(row):
         tag_id = row[0]
         if tag_id in tag_id_to_VottImageTag:
             tag_id_to_VottImageTag[tag_id].classification_names.append(row[6].strip())
-        elif row[4] and row[5] and row[6] and row[7]:
+        # Images without predictions come back with NULL boxes, a 0 coordinate is a box on the image edge
+        elif None not in (row[4], row[5], row[6], row[7]):
             tag_id_to_VottImageTag[tag_id] = VottImageTag(row[0], float(row[4]), float(row[5]),
                                                             float(row[6]), float(row[7]), [row[3].strip()],
                                                             row[8], row[9], row[1])